@@ -0,0 +1,160 @@
+#Water and heater accounting per shower. picoHardwareLoop() hands sample() every shower's occupancy, flow and heater state once a loop, along
+#with ticks_ms(), and the flow and heater time are integrated over the time that really passed since the last sample (not the nominal period,
+#so a late loop still adds up right). Sessions come from the occupancy edges: one opens when a shower goes occupied and closes when it goes
+#vacant, and a closed session that lasted at least min_ms goes into a fixed ring of packed records. The per-day and per-shower totals are kept
+#up as samples come in, so a page or API call only ever reads them.
+#
+#Everything is ints in arrays allocated once. Water is kept in millilitres, with the leftover fraction of a millilitre carried from one
+#sample to the next, so nothing gets lost to rounding however short the samples are.
+import struct
+import utime
+from history import zeros
+
+RECORD = "<IIIHBB" #One session: start (clock seconds, see below), duration (ms), water (mL), heater on (s), shower, day. 16 bytes.
+RECORD_SIZE = struct.calcsize(RECORD)
+M_WRITTEN, M_DAY, M_CLOCK_S, M_CLOCK_MS = 0, 1, 2, 3 #Indexes into Accounting.meta.
+
+class Accounting:
+    #showers: how many showers. days: how many days the per-day totals go round (COARSE_TIMESTEP, same as the bar graph).
+    #log_size: sessions kept in the record log; the oldest is overwritten. flow_scale: what the flow readings are multiplied by (100 for
+    #hundredths of a L/min). period_ms: how often sample() is called. A gap of more than max_gaps periods (a stall, or the first sample) only
+    #counts as one period, so a stale reading isn't integrated over the whole gap. min_ms: shorter sessions aren't logged, e.g. someone walking past the IR.
+    def __init__(self, showers, days, log_size, flow_scale, period_ms, min_ms, max_gaps = 5):
+        self.showers = showers
+        self.days = days
+        self.log_size = log_size
+        self.divisor = 60*flow_scale #Flow times ms over this is mL.
+        self.period_ms = period_ms
+        self.max_gap_ms = max_gaps*period_ms
+        self.min_ms = min_ms
+        self.last_ms = None #ticks_ms() at the last sample.
+        #Saved in snapshots (see buffers()), so the log and totals come back after a reset.
+        self.shape = zeros('H', 3) #log_size, showers, days: checked after a restore.
+        self.shape[0] = log_size
+        self.shape[1] = showers
+        self.shape[2] = days
+        self.meta = zeros('L', 4) #Sessions ever logged, the current day, and the clock: metered time in seconds plus leftover ms. The clock only runs while we do, so it's the same across a reset.
+        self.log = bytearray(log_size*RECORD_SIZE) #Session k is at (k % log_size)*RECORD_SIZE.
+        self.day_sessions = zeros('H', days*showers) #Day d, shower s at d*showers + s. Sessions are counted on the day they end.
+        self.day_ml = zeros('L', days*showers)
+        self.day_occupied_ms = zeros('L', days*showers)
+        self.day_heater_ms = zeros('L', days*showers)
+        self.total_sessions = zeros('L', showers) #Per shower, for as long as the snapshots go back.
+        self.total_ml = zeros('L', showers)
+        self.total_occupied_s = zeros('L', showers)
+        self.total_heater_s = zeros('L', showers)
+        self.total_occupied_ms = zeros('H', showers) #Leftover ms of the two above.
+        self.total_heater_ms = zeros('H', showers)
+        self.ml_rem = zeros('l', showers) #Leftover flow*ms that hasn't made a whole mL yet.
+        #Open sessions. Not saved: a reset ends them.
+        self.occupied = bytearray(showers)
+        self.open_start = zeros('L', showers)
+        self.open_ms = zeros('L', showers)
+        self.open_ml = zeros('L', showers)
+        self.open_heater_ms = zeros('L', showers)
+        self.meta[M_DAY] = days #Not a real day, so the first sample clears its day.
+
+    def buffers(self): #Everything that goes in a snapshot, in order. snapshot.load() reads straight back into these.
+        return (self.shape, self.meta, self.log, self.day_sessions, self.day_ml, self.day_occupied_ms, self.day_heater_ms,
+                self.total_sessions, self.total_ml, self.total_occupied_s, self.total_heater_s, self.total_occupied_ms, self.total_heater_ms)
+
+    def restored(self): #Call after loading buffers() from a snapshot. Returns False (and clears everything) if it was for a different layout.
+        if self.shape[0] != self.log_size or self.shape[1] != self.showers or self.shape[2] != self.days or self.meta[M_DAY] > self.days:
+            self.clear()
+            return False
+        for s in range(self.showers):
+            self.occupied[s] = 0
+            self.ml_rem[s] = 0
+        self.last_ms = None
+        return True
+
+    def clear(self):
+        for buf in self.buffers()[1:]:
+            for i in range(len(buf)):
+                buf[i] = 0
+        self.shape[0] = self.log_size
+        self.shape[1] = self.showers
+        self.shape[2] = self.days
+        self.meta[M_DAY] = self.days
+        for s in range(self.showers):
+            self.occupied[s] = 0
+            self.ml_rem[s] = 0
+        self.last_ms = None
+
+    def clock(self): #Metered seconds so far. Session starts are on this clock.
+        return self.meta[M_CLOCK_S]
+
+    def sample(self, day, occupied, flow, heater, now = None):
+        #One loop's worth: each shower's occupancy (0/1), flow (times flow_scale) and heater state (0/1), all indexable by shower.
+        #'day' is which of the days this sample is on. O(showers).
+        if now is None:
+            now = utime.ticks_ms()
+        dt = self.period_ms if self.last_ms is None else utime.ticks_diff(now, self.last_ms)
+        self.last_ms = now
+        if dt < 0 or dt > self.max_gap_ms:
+            dt = self.period_ms
+        meta = self.meta
+        if day != meta[M_DAY]: #A new day: whatever's in its row is from last time round.
+            meta[M_DAY] = day
+            for i in range(day*self.showers, (day + 1)*self.showers):
+                self.day_sessions[i] = 0
+                self.day_ml[i] = 0
+                self.day_occupied_ms[i] = 0
+                self.day_heater_ms[i] = 0
+        ms = meta[M_CLOCK_MS] + dt
+        meta[M_CLOCK_S] += ms//1000
+        meta[M_CLOCK_MS] = ms % 1000
+        base = day*self.showers
+        divisor = self.divisor
+        for s in range(self.showers):
+            total = self.ml_rem[s] + max(flow[s], 0)*dt #A calibration can dip a little below zero at no flow.
+            ml = total//divisor
+            self.ml_rem[s] = total - ml*divisor
+            heater_ms = dt if heater[s] else 0
+            if ml:
+                self.day_ml[base + s] += ml
+                self.total_ml[s] += ml
+            if heater_ms:
+                self.day_heater_ms[base + s] += heater_ms
+                ms = self.total_heater_ms[s] + heater_ms
+                self.total_heater_s[s] += ms//1000
+                self.total_heater_ms[s] = ms % 1000
+            if self.occupied[s]:
+                self.day_occupied_ms[base + s] += dt
+                ms = self.total_occupied_ms[s] + dt
+                self.total_occupied_s[s] += ms//1000
+                self.total_occupied_ms[s] = ms % 1000
+                self.open_ms[s] += dt
+                self.open_ml[s] += ml
+                self.open_heater_ms[s] += heater_ms
+                if not occupied[s]:
+                    self.close(s, day)
+            elif occupied[s]: #Opens now; this sample's water and heat went before anyone was in there.
+                self.occupied[s] = 1
+                self.open_start[s] = meta[M_CLOCK_S]
+                self.open_ms[s] = 0
+                self.open_ml[s] = 0
+                self.open_heater_ms[s] = 0
+
+    def close(self, shower, day): #Ends a shower's open session, logging it if it was long enough.
+        self.occupied[shower] = 0
+        if self.open_ms[shower] < self.min_ms:
+            return
+        written = self.meta[M_WRITTEN]
+        struct.pack_into(RECORD, self.log, (written % self.log_size)*RECORD_SIZE, self.open_start[shower], self.open_ms[shower],
+                         self.open_ml[shower], min(self.open_heater_ms[shower]//1000, 65535), shower, day)
+        self.meta[M_WRITTEN] = written + 1
+        self.day_sessions[day*self.showers + shower] += 1
+        self.total_sessions[shower] += 1
+
+    def count(self): #Sessions in the log.
+        return min(self.meta[M_WRITTEN], self.log_size)
+
+    def record(self, k): #The k-th newest logged session (0 is the newest), as RECORD's tuple.
+        return struct.unpack_from(RECORD, self.log, ((self.meta[M_WRITTEN] - 1 - k) % self.log_size)*RECORD_SIZE)
+
+    def day_total(self, array, day): #One of the day_ arrays summed over every shower.
+        total = 0
+        for i in range(day*self.showers, (day + 1)*self.showers):
+            total += array[i]
+        return total
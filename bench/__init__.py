@@ -0,0 +1,92 @@
+#Host benchmarks for the request path and the sensor loop. Everything runs against the real main.py on top of the simulator (see sim/), so the
+#numbers are CPython numbers, not Pico numbers, but they move in the same direction when we make something slower or allocate more.
+#
+#Run with 'python -m bench'. Results go to bench/latest.json and get compared against bench/baseline.json; anything that's got worse by more
+#than the threshold fails the run. 'python -m bench --update-baseline' saves the median of a few runs as the new baseline.
+#
+#The baseline only gates anything if it stays put. A change that fails the run gets fixed, not rebaselined. When a cost goes up on purpose
+#(more samples per reading, say), refresh the baseline in a commit of its own with --reason saying why, and leave every other change's commit
+#without baseline.json in it. --update-baseline refuses to save over a regression without a --reason.
+import gc
+import time
+import tracemalloc
+
+def percentile(sorted_values, pct): #Nearest-rank percentile of an already sorted list.
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, int(round(pct/100.0*len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+def median(values): #Of a handful of calibrations. One alone can land in a slow patch and swing a whole case's rescaling by 2x.
+    return percentile(sorted(values), 50)
+
+def summarise(rounds, alloc_bytes, calibration_us): #Turns per-round lists of per-call timings (ns), the allocation figure and the calibration taken alongside them into the result dict that ends up in the JSON.
+    durations_ns = best_round(rounds)
+    p50 = percentile(durations_ns, 50)
+    everything = sorted(d for durations in rounds for d in durations) #The tail comes from every round: one round's p99 is its one or two slowest calls, so it's whichever round a GC pause landed in.
+    return {
+        "calls": len(durations_ns),
+        "ops_per_sec": round(1e9/p50, 1) if p50 else 0.0, #From the median rather than the mean, so one GC pause or scheduler hiccup doesn't swing it.
+        "p50_us": round(p50/1000, 2),
+        "p99_us": round(percentile(everything, 99)/1000, 2),
+        "alloc_bytes": alloc_bytes,
+        "calibration_us": calibration_us,
+    }
+
+def measure_alloc(fn, calls = 20): #Average bytes allocated per call (the peak tracemalloc sees above where it started), measured separately from the timing so the tracing overhead doesn't skew it.
+    gc.collect()
+    tracemalloc.start()
+    try:
+        total = 0
+        for i in range(calls):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            fn()
+            total += tracemalloc.get_traced_memory()[1] - before
+        return int(total/calls)
+    finally:
+        tracemalloc.stop()
+
+ROUNDS = 5 #Each benchmark is split into this many rounds and the best round's median is kept, like timeit does. Anything else on the machine only ever makes a round slower, so the best one is the most repeatable.
+
+def best_round(rounds): #Picks the round with the lowest median out of a list of per-round duration lists.
+    best = None
+    for durations in rounds:
+        durations.sort()
+        if best is None or percentile(durations, 50) < percentile(best, 50):
+            best = durations
+    return best
+
+def bench(fn, iterations, warmup = 10): #Times fn() 'iterations' times (in ROUNDS rounds), after a few warmup calls.
+    for i in range(warmup):
+        fn()
+    calibrations = [calibrate()]
+    rounds = []
+    clock = time.perf_counter_ns
+    for r in range(ROUNDS):
+        durations = []
+        for i in range(max(1, iterations//ROUNDS)):
+            start = clock()
+            fn()
+            durations.append(clock() - start)
+        rounds.append(durations)
+        calibrations.append(calibrate())
+    return summarise(rounds, measure_alloc(fn), median(calibrations))
+
+def _calibration_work(): #A fixed chunk of ordinary interpreter work (loops, dicts, string formatting), the same mix the firmware does.
+    d = {}
+    total = 0
+    for i in range(2000):
+        d[i & 63] = "{}:{}".format(i, total)
+        total += len(d[i & 63])
+    return total
+
+def calibrate(): #Times _calibration_work() (best of ROUNDS*4). Every benchmark takes one of these before and after each of its rounds, and the comparison scales its timings by their median, so a slower or busier machine doesn't read as a regression.
+    best = None
+    for i in range(ROUNDS*4):
+        start = time.perf_counter_ns()
+        _calibration_work()
+        elapsed = time.perf_counter_ns() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return round(best/1000, 2)
@@ -0,0 +1,137 @@
+#'python -m bench [--iterations N] [--clients N] [--requests N] [--threshold 0.3] [--out path] [--update-baseline [--reason why]]'. See bench/__init__.py.
+#Exits with status 1 if anything regressed past the threshold compared to bench/baseline.json (after re-running the case to rule out a slow patch).
+#--update-baseline runs the suite BASELINE_RUNS times and keeps the median of each figure, then runs the same comparison, and won't save over a
+#regression unless --reason says why it's meant; the reason is kept in the baseline.
+import json
+import os
+import sys
+import sim
+
+USAGE = "usage: python -m bench [--iterations N] [--clients N] [--requests N] [--threshold 0.3] [--out path] [--update-baseline [--reason why]]"
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE = os.path.join(HERE, "baseline.json")
+HIGHER_IS_BETTER = ("ops_per_sec", "req_per_sec")
+LOWER_IS_BETTER = ("p50_us", "p99_us", "alloc_bytes", "hw_late_p99_ms", "errors")
+TIMINGS = ("ops_per_sec", "req_per_sec", "p50_us", "p99_us") #Metrics that scale with how fast the machine is. Allocations and error counts don't.
+RETRIES = 2 #A case that looks like it regressed gets run this many more times, and only fails if it never comes back under. Shared machines have slow patches.
+BASELINE_RUNS = 5 #A baseline from one run is wherever that run's noise put it, and every later run gets compared against that. The median of a few is a fair middle.
+SLACK = {"alloc_bytes": 64, "hw_late_p99_ms": 2.0, "p50_us": 2.0, "p99_us": 20.0, "errors": 0} #Absolute wiggle room on top of the threshold, so tiny numbers don't fail on noise.
+
+TAILS = ("p99_us", "hw_late_p99_ms") #Tail latencies jump around a lot more than medians do, so they get twice the threshold.
+
+def compare(results, baseline, threshold): #Returns a list of human-readable regressions. Each case's timings are first rescaled by the ratio of the calibration figures taken alongside it in the two runs.
+    failures = []
+    for name in baseline:
+        if name == "machine":
+            continue
+        if name not in results:
+            failures.append("{}: missing from this run".format(name))
+            continue
+        speed = 1.0
+        if baseline[name].get("calibration_us") and results[name].get("calibration_us"):
+            speed = results[name]["calibration_us"]/baseline[name]["calibration_us"] #>1 means the machine was slower while this one ran.
+        for metric, old in baseline[name].items():
+            new = results[name].get(metric)
+            if new is None or metric == "calibration_us":
+                continue
+            if metric in TIMINGS:
+                new = new*speed if metric in HIGHER_IS_BETTER else new/speed
+            if metric in HIGHER_IS_BETTER and new < old*(1 - threshold):
+                failures.append("{}.{}: {} -> {:.2f} ({:+.0%})".format(name, metric, old, new, (new - old)/old if old else 0))
+            elif metric in LOWER_IS_BETTER and new > old*(1 + threshold*(2 if metric in TAILS else 1)) + SLACK.get(metric, 0):
+                failures.append("{}.{}: {} -> {:.2f} ({:+.0%})".format(name, metric, old, new, (new - old)/old if old else 0))
+    return failures
+
+def median_runs(runs):
+    #Each case's figures out of several whole-suite runs: every metric's median, with the timings first rescaled to the calibration of the
+    #median-calibration run (the same rescaling compare() does), so a run that caught a slow patch counts as the same speed.
+    results = {}
+    for name in runs[0]:
+        cases = sorted([run[name] for run in runs], key = lambda case: case.get("calibration_us") or 0)
+        middle = dict(cases[len(cases)//2])
+        for metric in middle:
+            if not isinstance(middle[metric], (int, float)) or metric == "calibration_us":
+                continue
+            values = []
+            for case in cases:
+                value = case[metric]
+                if metric in TIMINGS and case.get("calibration_us") and middle.get("calibration_us"):
+                    speed = case["calibration_us"]/middle["calibration_us"]
+                    value = value*speed if metric in HIGHER_IS_BETTER else value/speed
+                values.append(value)
+            values.sort()
+            middle[metric] = type(middle[metric])(round(values[len(values)//2], 2))
+        results[name] = middle
+    return results
+
+def main(argv):
+    options = {"--iterations": 2000, "--clients": 8, "--requests": 200, "--threshold": 0.3, "--out": os.path.join(HERE, "latest.json"), "--reason": ""}
+    update = False
+    args = list(argv)
+    while args:
+        arg = args.pop(0)
+        if arg == "--update-baseline":
+            update = True
+        elif arg in options and args:
+            options[arg] = type(options[arg])(args.pop(0))
+        else:
+            print(USAGE)
+            return 2
+
+    sim.install(fast = True)
+    sys.path.insert(0, os.path.dirname(HERE))
+    import main as firmware
+    from bench.cases import run_all
+    results = run_all(firmware, options["--iterations"], options["--clients"], options["--requests"])
+    if update:
+        runs = [results]
+        for i in range(BASELINE_RUNS - 1):
+            print("Baseline run {} of {}...".format(i + 2, BASELINE_RUNS))
+            runs.append(run_all(firmware, options["--iterations"], options["--clients"], options["--requests"]))
+        results = median_runs(runs)
+    results["machine"] = {"python": sys.version.split()[0], "platform": sys.platform}
+
+    with open(options["--out"], "w") as f:
+        json.dump(results, f, indent = 2, sort_keys = True)
+    for name in sorted(results):
+        print("{:16} {}".format(name, ", ".join("{}={}".format(k, v) for k, v in sorted(results[name].items()))))
+
+    if not os.path.exists(BASELINE):
+        if update:
+            save_baseline(results, options["--reason"])
+            return 0
+        print("No baseline yet; run with --update-baseline to save one.")
+        return 0
+    with open(BASELINE) as f:
+        baseline = json.load(f)
+    failures = compare(results, baseline, options["--threshold"])
+    for attempt in range(0 if update else RETRIES): #A baseline update keeps its medians rather than swapping in whichever rerun came in under.
+        flagged = sorted(set(failure.split(".")[0].split(":")[0] for failure in failures))
+        if not flagged:
+            break
+        print("Re-running {} to confirm...".format(", ".join(flagged)))
+        rerun = run_all(firmware, options["--iterations"], options["--clients"], options["--requests"], flagged)
+        for name in flagged:
+            if name in rerun and not compare({name: rerun[name]}, {name: baseline[name]}, options["--threshold"]):
+                results[name] = rerun[name]
+        failures = compare(results, baseline, options["--threshold"])
+        with open(options["--out"], "w") as f:
+            json.dump(results, f, indent = 2, sort_keys = True)
+    for failure in failures:
+        print("REGRESSION " + failure)
+    if update:
+        if failures and not options["--reason"]:
+            print("Not updating the baseline over a regression. If it's meant (the work got bigger on purpose), say why with --reason.")
+            return 1
+        save_baseline(results, options["--reason"])
+        return 0
+    return 1 if failures else 0
+
+def save_baseline(results, reason):
+    if reason:
+        results["machine"]["reason"] = reason #compare() skips "machine", so this just rides along for whoever reads the diff.
+    with open(BASELINE, "w") as f:
+        json.dump(results, f, indent = 2, sort_keys = True)
+    print("Baseline updated.")
+
+sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,239 @@
+#The individual benchmarks. Each one returns the result dict from bench.summarise() (or the load test's own dict), keyed by name in run_all().
+import asyncio
+import time
+import tracemalloc
+import gc
+from bench import bench, summarise, percentile, calibrate, median, ROUNDS
+
+BROWSER_REQUEST = (b"GET /status HTTP/1.1\r\nHost: 192.168.4.1\r\nUser-Agent: Mozilla/5.0 (X11; Linux x86_64; rv:128.0) Gecko/20100101 Firefox/128.0\r\n"
+                   b"Accept: application/json\r\nAccept-Language: en-CA,en;q=0.5\r\nAccept-Encoding: gzip, deflate\r\nReferer: http://192.168.4.1/\r\n"
+                   b"Connection: keep-alive\r\nPriority: u=4\r\n\r\n")
+
+class NullWriter: #Swallows a response, like a client on a very fast link.
+    def __init__(self):
+        self.sent = 0
+    def write(self, data):
+        self.sent += len(data)
+    async def drain(self):
+        pass
+    def get_extra_info(self, name):
+        return ("127.0.0.1", 0)
+
+class BytesReader: #Hands out a canned request the way a socket would, in pieces of whatever size gets asked for.
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+    async def read(self, n):
+        chunk = self.data[self.pos:self.pos+n]
+        self.pos += len(chunk)
+        return chunk
+
+def bench_async(make_call, iterations, warmup = 10): #Like bench.bench() for coroutines. Everything runs inside one event loop so we time the call, not loop startup.
+    async def run():
+        for i in range(warmup):
+            await make_call()
+        calibrations = [calibrate()]
+        rounds = []
+        clock = time.perf_counter_ns
+        for r in range(ROUNDS):
+            durations = []
+            for i in range(max(1, iterations//ROUNDS)):
+                start = clock()
+                await make_call()
+                durations.append(clock() - start)
+            rounds.append(durations)
+            calibrations.append(calibrate())
+        gc.collect()
+        tracemalloc.start()
+        try:
+            total = 0
+            for i in range(20):
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+                await make_call()
+                total += tracemalloc.get_traced_memory()[1] - before
+        finally:
+            tracemalloc.stop()
+        return summarise(rounds, int(total/20), median(calibrations))
+    return asyncio.run(run())
+
+def case_web_page_render(main, iterations): #Worst case for GET /: the bar graph changed since the last render.
+    def call():
+        main.m_bargraph_version += 1
+        main.publish_state()
+        main.web_page()
+    return bench(call, iterations)
+
+def case_web_page_cached(main, iterations): #The usual case: nothing's changed, so it should just hand back the cached fragments.
+    main.web_page()
+    return bench(main.web_page, iterations)
+
+def case_get_status(main, iterations):
+    return bench(main.get_status, iterations)
+
+def case_status_bin(main, iterations): #The binary status, with the values changing every call so it has to re-pack each time.
+    def call():
+        main.m_bargraph_version += 1
+        main.publish_state()
+        main.status_bin()
+    return bench(call, iterations)
+
+def case_hardware_loop(main, iterations): #One simulated second of hardware work: a second's worth of sensor timer ticks, then one picoHardwareLoop().
+    import sim.board
+    board = sim.board.board
+    ticks = main.HARDWARE_PERIOD_MS//main.SENSOR_TICK_MS
+    def call():
+        for i in range(ticks):
+            main.sensorScheduler.tick()
+            board.advance(main.SENSOR_TICK_MS*1000)
+        main.picoHardwareLoop()
+    return bench(call, iterations)
+
+def case_control_step(main, iterations): #One controlStep(): what the sensor timer does every CONTROL_PERIOD_MS for the IR lights and heaters, with one shower pre-heating.
+    import sim.board
+    board = sim.board.board
+    main.m_predictor.preheat[0] = 1
+    def call():
+        board.advance(main.CONTROL_PERIOD_MS*1000)
+        main.controlStep(None)
+    try:
+        return bench(call, iterations)
+    finally:
+        main.m_predictor.preheat[0] = 0
+
+def case_history_day(main, iterations): #/api/history's body for a whole day at its default step, out of a day of recorded samples (so the 10 minute tier answers it).
+    import rollup
+    saved = main.m_rollup
+    main.m_rollup = rollup.Rollup(main.ROLLUP_TIERS, len(main.HISTORY_SERIES))
+    sample = [0]*len(main.HISTORY_SERIES)
+    for i in range(86400):
+        sample[0] = 2500 + i % 700
+        sample[1] = (i//30) % 1500
+        sample[2] = (i//300) % 3*100
+        main.m_rollup.record(sample)
+    def call():
+        for row in main.history_rows(main.m_rollup.plan(-86400, -1, 60, main.HISTORY_MAX_POINTS), False):
+            pass
+    try:
+        return bench(call, max(1, iterations//20))
+    finally:
+        main.m_rollup = saved
+
+def case_parse_request(main, iterations): #httpd.read_request() on a typical browser /status poll.
+    import httpd
+    buf = bytearray(httpd.REQ_BUFSIZE)
+    async def call():
+        await httpd.read_request(BytesReader(BROWSER_REQUEST), buf, None, 5, 5)
+    return bench_async(call, iterations)
+
+def case_serve_status(main, iterations): #Parse + route + respond for /status, into a writer that never blocks. This is respond_request()'s work minus the socket.
+    import httpd
+    buf = bytearray(httpd.REQ_BUFSIZE)
+    writer = NullWriter()
+    async def call():
+        request, carry = await httpd.read_request(BytesReader(BROWSER_REQUEST), buf, None, 5, 5)
+        request["keep_alive"] = True
+        await httpd.dispatch(request, writer)
+    return bench_async(call, iterations)
+
+async def _load_client(port, count, latencies, errors):
+    request = b"GET /status HTTP/1.1\r\nHost: localhost\r\n\r\n"
+    reader = writer = None
+    done = 0
+    while done < count:
+        if writer is None:
+            try:
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            except OSError:
+                errors[0] += 1
+                await asyncio.sleep(0.01)
+                continue
+        start = time.perf_counter_ns()
+        try:
+            writer.write(request)
+            await writer.drain()
+            head = await reader.readuntil(b"\r\n\r\n")
+            length = 0
+            for line in head.split(b"\r\n"):
+                if line.lower().startswith(b"content-length:"):
+                    length = int(line[15:])
+            await reader.readexactly(length)
+        except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            errors[0] += 1
+            writer = None
+            continue
+        done += 1
+        if not head.startswith(b"HTTP/1.1 200"):
+            errors[0] += 1
+            writer.close()
+            writer = None
+            continue
+        latencies.append(time.perf_counter_ns() - start)
+    if writer is not None:
+        writer.close()
+
+async def _hardware_ticker(main, period_ms, lateness, stop): #Runs the sensor timer tick and the hardware loop on a fixed period, like hardware_task(), and records how late each tick was.
+    next_tick = time.perf_counter()
+    while not stop:
+        main.sensorScheduler.tick()
+        main.picoHardwareLoop()
+        next_tick += period_ms/1000
+        delay = next_tick - time.perf_counter()
+        await asyncio.sleep(max(0, delay))
+        lateness.append(max(0.0, time.perf_counter() - next_tick)*1000)
+
+def load_status_once(main, clients, requests_per_client): #End-to-end: many keep-alive clients hammering /status on a real local socket while the hardware loop ticks every 100 ms alongside them.
+    import httpd
+    async def run():
+        calibrations = [calibrate(), calibrate()]
+        server = await asyncio.start_server(httpd.respond_request, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        latencies = []
+        errors = [0]
+        lateness = []
+        stop = []
+        ticker = asyncio.create_task(_hardware_ticker(main, 100, lateness, stop))
+        start = time.perf_counter()
+        await asyncio.gather(*[_load_client(port, requests_per_client, latencies, errors) for i in range(clients)])
+        elapsed = time.perf_counter() - start
+        stop.append(True)
+        await ticker
+        server.close()
+        await server.wait_closed()
+        calibrations += [calibrate(), calibrate(), calibrate()]
+        latencies.sort()
+        lateness.sort()
+        return {
+            "clients": clients,
+            "requests": len(latencies),
+            "errors": errors[0],
+            "req_per_sec": round(len(latencies)/elapsed, 1),
+            "p50_us": round(percentile(latencies, 50)/1000, 2),
+            "p99_us": round(percentile(latencies, 99)/1000, 2),
+            "hw_late_p99_ms": round(percentile(lateness, 99), 2),
+            "calibration_us": median(calibrations),
+        }
+    return asyncio.run(run())
+
+def case_load_status(main, clients, requests_per_client): #The load test is noisier than the micro-benchmarks, so it gets a few goes and keeps the best.
+    best = None
+    for r in range(3):
+        result = load_status_once(main, clients, requests_per_client)
+        if best is None or result["req_per_sec"] > best["req_per_sec"]:
+            best = result
+    return best
+
+def run_all(main, iterations, clients, requests_per_client, only = None): #only: a list of case names to run, or None for all of them.
+    cases = (
+        ("web_page_render", lambda: case_web_page_render(main, iterations)),
+        ("web_page_cached", lambda: case_web_page_cached(main, iterations)),
+        ("get_status", lambda: case_get_status(main, iterations)),
+        ("status_bin", lambda: case_status_bin(main, iterations)),
+        ("hardware_loop", lambda: case_hardware_loop(main, iterations)),
+        ("control_step", lambda: case_control_step(main, iterations)),
+        ("history_day", lambda: case_history_day(main, iterations)),
+        ("parse_request", lambda: case_parse_request(main, iterations)),
+        ("serve_status", lambda: case_serve_status(main, iterations)),
+        ("load_status", lambda: case_load_status(main, clients, requests_per_client)),
+    )
+    return dict((name, case()) for name, case in cases if only is None or name in only)
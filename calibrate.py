@@ -0,0 +1,101 @@
+#Per-channel calibration by lookup table. Each sensor's curve (raw 16-bit ADC reading -> real units) is evaluated once at boot at a few hundred
+#evenly spaced raw values, and every reading after that is a table lookup plus an integer linear interpolation between the two nearest entries.
+#That makes a nonlinear curve like Steinhart-Hart (a log and a cube per reading) cost the same as a straight line, with no float math at all.
+#
+#The table holds the values multiplied by 'scale' as ints (scale 100 keeps hundredths of a degree), so a lookup never makes a float object.
+#
+#A calibration file (JSON) can replace any channel's curve by name:
+#    {"temp1": {"steinhart_hart": [1.009e-3, 2.378e-4, 2.019e-7], "r_fixed": 10000},
+#     "flow1": {"points": [[0, 0], [20000, 4.5], [65535, 50]]},
+#     "temp2": {"poly": [-3.1, 0.00081, 0.0]},
+#     "ir1": {"linear": [-1, 65536]}}
+#"linear" is [gain, offset]; "poly" is coefficients from the constant term up; "points" are (raw, value) pairs measured against a reference,
+#joined with straight lines; "steinhart_hart" is the thermistor's A, B, C with the thermistor on the ground side of a divider with an r_fixed resistor.
+import json
+import math
+from history import zeros
+
+TABLE_BITS = 8 #2**TABLE_BITS segments across the 16-bit range, so 257 entries (about 1 KB) per channel. The error between entries is tiny for any smooth curve.
+
+class Table:
+    def __init__(self, fn, scale = 100, bits = TABLE_BITS): #fn(raw) -> value in real units. Called 2**bits + 1 times, here and never again.
+        self.scale = scale
+        self.shift = 16 - bits
+        self.mask = (1 << self.shift) - 1
+        self.points = zeros('l', (1 << bits) + 1)
+        for i in range(len(self.points)):
+            self.points[i] = int(round(fn(i << self.shift)*scale)) #The last one is at 65536, just past the top, so 65535 interpolates like everything else.
+
+    def lookup(self, raw): #The value for a raw reading, times scale, as an int.
+        i = raw >> self.shift
+        a = self.points[i]
+        return a + (((self.points[i + 1] - a)*(raw & self.mask)) >> self.shift)
+
+class Calibration: #One Table per channel, in the sampler's channel order.
+    def __init__(self, tables):
+        self.tables = tables
+
+    def convert(self, channel, raw): #One channel's reading through its table, times its scale, as an int.
+        return self.tables[channel].lookup(raw)
+
+#Curves. Each one returns fn(raw) -> value for Table().
+
+def linear(gain, offset = 0):
+    return lambda raw: raw*gain + offset
+
+def poly(coefficients):
+    def fn(raw):
+        total = 0.0
+        for c in reversed(coefficients):
+            total = total*raw + c
+        return total
+    return fn
+
+def points(pairs): #Straight lines through measured (raw, value) pairs. Flat beyond the first and last ones.
+    pairs = sorted(pairs)
+    def fn(raw):
+        if raw <= pairs[0][0]:
+            return pairs[0][1]
+        for i in range(1, len(pairs)):
+            x1, y1 = pairs[i]
+            if raw <= x1:
+                x0, y0 = pairs[i - 1]
+                return y0 + (y1 - y0)*(raw - x0)/(x1 - x0)
+        return pairs[-1][1]
+    return fn
+
+def steinhart_hart(a, b, c, r_fixed): #Degrees C for an NTC thermistor between the ADC pin and ground, with r_fixed between the pin and 3.3 V.
+    def fn(raw):
+        raw = min(max(raw, 1), 65534) #The ends would mean zero or infinite resistance.
+        r = r_fixed*raw/(65535 - raw)
+        ln = math.log(r)
+        return 1/(a + b*ln + c*ln*ln*ln) - 273.15
+    return fn
+
+def from_spec(spec): #Turns one channel's entry from a calibration file into a curve.
+    if "linear" in spec:
+        return linear(*spec["linear"])
+    if "poly" in spec:
+        return poly(spec["poly"])
+    if "points" in spec:
+        return points(spec["points"])
+    if "steinhart_hart" in spec:
+        a, b, c = spec["steinhart_hart"]
+        return steinhart_hart(a, b, c, spec.get("r_fixed", 10000))
+    raise ValueError("Unknown calibration: {}".format(spec))
+
+def load(path): #Reads a calibration file into {channel name: spec}. A missing file just means no overrides.
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except OSError:
+        return {}
+
+def build(names, defaults, scales, path = None): #Makes the Calibration for channels called 'names', using each one's curve from the file at 'path' if it has one, or else its entry in 'defaults'. A bad entry raises ValueError (or TypeError).
+    overrides = load(path) if path else {}
+    tables = []
+    for i in range(len(names)):
+        spec = overrides.get(names[i])
+        fn = from_spec(spec) if spec is not None else defaults[i]
+        tables.append(Table(fn, scales[i]))
+    return Calibration(tables)
@@ -0,0 +1,126 @@
+#Heater control. Two halves:
+#
+#Predictor learns how likely each shower is to be in use in each slot of the week, from the same ring of RAVG_DEPTH weeks as the bar graph
+#(one History per shower, holding 100 for an occupied slot and 0 for a vacant one), and flags the showers whose next few slots look busy so
+#their heaters can start warming up before anyone walks in. The rolling sums the History keeps make each slot's probability a single lookup.
+#
+#HeaterControl decides each heater's relay from the temperature. With no gains set it's the old hysteresis (on below setpoint - band, off
+#above the setpoint) with the band tunable; with gains it's a PID whose output is the fraction of a time window the relay is on. Either way the
+#relay is never switched again within min_switch_ms of its last switch, except to turn it off because demand has gone or the water is past
+#setpoint + band. Each step is a couple of dozen int operations, so it runs from the sensor timer like the old set_heater_status() did.
+#
+#sim/replay.py runs both over recorded or made-up occupancy and scores the energy against the wait for hot water.
+import utime
+from history import History, zeros
+
+class Predictor:
+    #showers, slots and depth: as the bar graph (SHOWER_COUNT, WEEK_TIMESTEP, RAVG_DEPTH). lead: how many slots ahead to look; 0 turns
+    #pre-heating off. threshold: how likely (percent) a slot has to be to warm up for it.
+    def __init__(self, showers, slots, depth, lead, threshold):
+        self.slots = slots
+        self.depth = depth
+        self.lead = lead
+        self.limit = threshold*depth #Compared straight against a History's sums, which are 100 per occupied week.
+        self.histories = [History(slots, depth, 'B', 100) for shower in range(showers)]
+        self.shape = zeros('H', 3) #showers, slots, depth: saved with the data and checked by rebuilt().
+        self.shape[0] = showers
+        self.shape[1] = slots
+        self.shape[2] = depth
+        self.preheat = bytearray(showers) #1 while a shower's coming slots look busy. Read by the heater side every step.
+
+    def record(self, timestamp, occupied): #Stores each shower's occupancy (0/1, indexable by shower) for the slot at 'timestamp'.
+        for shower in range(len(self.histories)):
+            self.histories[shower].record(timestamp, occupied[shower])
+
+    def update(self, timestamp): #Works out preheat for the 'lead' slots starting at 'timestamp' (the next one to be recorded). O(showers*lead).
+        for shower in range(len(self.histories)):
+            sums = self.histories[shower].sums
+            flag = 0
+            for slot in range(timestamp, timestamp + self.lead):
+                if sums[slot % self.slots] >= self.limit:
+                    flag = 1
+                    break
+            self.preheat[shower] = flag
+
+    def probability(self, shower, slot): #How often (percent) a shower has been in use in a slot, over the weeks kept.
+        return self.histories[shower].sums[slot % self.slots]//self.depth
+
+    def buffers(self): #What goes in a snapshot. Call rebuilt() after loading into them.
+        return [self.shape] + [history.data for history in self.histories]
+
+    def rebuilt(self): #Redoes the sums after buffers() have been loaded from a snapshot. Returns False (and forgets everything) if it was for a different layout.
+        if self.shape[0] != len(self.histories) or self.shape[1] != self.slots or self.shape[2] != self.depth:
+            self.shape[0] = len(self.histories)
+            self.shape[1] = self.slots
+            self.shape[2] = self.depth
+            for history in self.histories:
+                history.clear()
+            return False
+        for history in self.histories:
+            history.rebuild()
+        return True
+
+class HeaterControl:
+    #band: hundredths of a degree. Hysteresis turns on below setpoint - band; in either mode the heater goes off above setpoint + band.
+    #min_switch_ms: shortest time between two switches of one relay. kp, ki, kd: PID gains in permille of full power per degree below the
+    #setpoint, per degree-second and per degree/second. All 0 means hysteresis. window_ms: the PID's output is the share of each window the
+    #heater is on; make it a few times min_switch_ms or short duties get stretched.
+    def __init__(self, showers, band, min_switch_ms, kp = 0, ki = 0, kd = 0, window_ms = 20000):
+        self.band = band
+        self.min_switch_ms = min_switch_ms
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.window_ms = window_ms
+        self.integral_limit = 100000//ki if ki else 0 #Enough integral for full power on its own, and no more (anti-windup).
+        self.on = bytearray(showers)
+        self.changed = zeros('L', showers) #ticks_ms() of each relay's last switch.
+        self.switches = zeros('L', showers) #Switches so far. /api/control reports it; the relays only last so many.
+        self.duty = zeros('H', showers) #The PID's last output, permille. 1000 or 0 in hysteresis.
+        self.integral = zeros('l', showers) #Hundredths of a degree times seconds.
+        self.last_error = zeros('l', showers)
+        self.last_ms = zeros('L', showers)
+        self.window_start = zeros('L', showers)
+
+    def step(self, shower, demand, setpoint, temperature, now): #Returns the heater's new state (0/1). setpoint and temperature in hundredths, now from ticks_ms().
+        on = self.on[shower]
+        forced = False
+        if not demand or temperature > setpoint + self.band:
+            want = 0
+            forced = True
+            self.integral[shower] = 0
+        elif not (self.kp or self.ki or self.kd):
+            if on:
+                want = 1 if temperature <= setpoint else 0
+            else:
+                want = 1 if temperature < setpoint - self.band else 0
+            self.duty[shower] = want*1000
+        else:
+            want = self.pid(shower, setpoint - temperature, now)
+        if want != on and not forced and self.switches[shower] and utime.ticks_diff(now, self.changed[shower]) < self.min_switch_ms:
+            want = on
+        if want != on:
+            self.on[shower] = want
+            self.changed[shower] = now
+            self.switches[shower] += 1
+        return want
+
+    def pid(self, shower, error, now): #One PID step, then where we are in the window. Returns whether the heater should be on right now.
+        dt = utime.ticks_diff(now, self.last_ms[shower])
+        self.last_ms[shower] = now
+        if dt <= 0 or dt > self.window_ms: #First step, or we've been off a while: no integral or derivative to speak of.
+            dt = 0
+            self.last_error[shower] = error
+        integral = min(max(self.integral[shower] + error*dt//1000, -self.integral_limit), self.integral_limit)
+        self.integral[shower] = integral
+        duty = self.kp*error + self.ki*integral
+        if dt:
+            duty += self.kd*(error - self.last_error[shower])*1000//dt
+        self.last_error[shower] = error
+        duty = min(max(duty//100, 0), 1000)
+        self.duty[shower] = duty
+        phase = utime.ticks_diff(now, self.window_start[shower])
+        if phase < 0 or phase >= self.window_ms:
+            self.window_start[shower] = now
+            phase = 0
+        return 1 if phase*1000 < duty*self.window_ms else 0
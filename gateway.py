@@ -0,0 +1,383 @@
+#Facility gateway. Every Pico runs its own access point and only knows about its own showers, so checking a whole facility meant joining each
+#AP in turn. This runs on an ordinary computer that can reach all of them (a Pi on the building network, say), polls every unit's /status, and
+#serves one dashboard and API for the lot:
+#
+#    python gateway.py [--port 8000] [--nodes nodes.json] [name=]host[:port] ...
+#
+#nodes.json is a list of "host:port" strings or {"name": ..., "host": ..., "port": ...} objects. The web side is the same httpd.py the Picos use,
+#routes and all. On the polling side each unit gets its own task and one kept-alive connection that's reused for every poll, at most
+#MAX_CONCURRENT polls are in flight at once however many units there are, and a unit that doesn't answer is retried less and less often
+#(up to BACKOFF_MAX_S) instead of every POLL_PERIOD_S. Each unit's last good status is kept along with how old it is; anything older than
+#STALE_AFTER_S is shown as stale and left out of the facility totals.
+#
+#To try it without any hardware: 'python -m sim.farm 8' starts eight simulated units on localhost and prints the arguments to give this.
+import sys
+import json
+import time
+import random
+import asyncio
+try:
+    import utime
+except ImportError: #Plain CPython, which is the usual case here. httpd, metrics and log want MicroPython's wrapping ticks; the simulator's utime gives them those off the host's clock.
+    from sim import utime
+    sys.modules["utime"] = utime
+import httpd
+import metrics
+import log
+
+HTTP_PORT = 8000
+POLL_PERIOD_S = 2 #How often each reachable unit is asked for its status.
+POLL_TIMEOUT_S = 3 #Connect plus request plus response. A unit that takes longer counts as unreachable this time round.
+MAX_CONCURRENT = 16 #Polls in flight at once. Keeps a big facility from opening hundreds of sockets in the same instant.
+BACKOFF_MIN_S = 2 #First retry after a failed poll. Doubles every failure after that...
+BACKOFF_MAX_S = 60 #...up to this.
+STALE_AFTER_S = 10 #A unit whose last good status is older than this is marked stale.
+MAX_RESPONSE = 16384 #Biggest status we'll read from a unit. A Pico's is a few hundred bytes.
+LOG_DRAIN_PERIOD_S = 5
+
+class PollError(Exception):
+    pass
+
+class Node: #One Pico, its pooled connection and the last thing it told us.
+    def __init__(self, name, host, port):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.reader = None #The kept-alive connection, or None between a failure and the next poll.
+        self.writer = None
+        self.status = None #The last good /status payload, as a dict.
+        self.last_ok = None #time.monotonic() of that.
+        self.failures = 0 #Failed polls in a row.
+        self.error = None #Why the last poll failed, if it did.
+        self.polls = 0
+
+    def close(self):
+        if self.writer is not None:
+            try:
+                self.writer.close()
+            except OSError:
+                pass
+        self.reader = self.writer = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port, limit = MAX_RESPONSE)
+
+    async def request(self, path): #GET path over the pooled connection. Returns (status code, body bytes). Raises on anything going wrong.
+        self.writer.write("GET {} HTTP/1.1\r\nHost: {}\r\nAccept: application/json\r\n\r\n".format(path, self.host).encode("UTF-8"))
+        await self.writer.drain()
+        code, body, close = await read_response(self.reader)
+        if close:
+            self.close()
+        return code, body
+
+    async def fetch(self, path): #Like request(), but (re)connects if need be. A kept-alive connection the Pico has since dropped gets one fresh retry before it counts as a failure.
+        if self.writer is None:
+            await self.connect()
+        else:
+            try:
+                return await self.request(path)
+            except (OSError, asyncio.IncompleteReadError, PollError):
+                self.close()
+                await self.connect()
+        return await self.request(path)
+
+    def age(self, now): #Seconds since the last good status, or None if we've never had one.
+        return None if self.last_ok is None else now - self.last_ok
+
+    def stale(self, now):
+        return self.last_ok is None or now - self.last_ok > STALE_AFTER_S
+
+async def read_response(reader): #Reads one HTTP/1.1 response. Returns (status code, body bytes, whether the server is closing the connection). Handles Content-Length and chunked bodies.
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.LimitOverrunError:
+        raise PollError("response headers too long")
+    lines = head.decode("latin-1").split("\r\n")
+    parts = lines[0].split(" ", 2)
+    if len(parts) < 2 or not parts[0].startswith("HTTP/"):
+        raise PollError("bad status line")
+    code = int(parts[1])
+    length = 0
+    chunked = False
+    close = False
+    for line in lines[1:]:
+        name, _, value = line.partition(":")
+        name = name.strip().lower()
+        if name == "content-length":
+            length = int(value)
+        elif name == "transfer-encoding":
+            chunked = "chunked" in value.lower()
+        elif name == "connection":
+            close = value.strip().lower() == "close"
+    if chunked:
+        body = b""
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            if size:
+                body += await reader.readexactly(size)
+            await reader.readline() #The CRLF after every chunk, including the last, empty one.
+            if not size:
+                break
+            if len(body) > MAX_RESPONSE:
+                raise PollError("response too long")
+    else:
+        if length > MAX_RESPONSE:
+            raise PollError("response too long")
+        body = await reader.readexactly(length)
+    return code, body, close
+
+nodes = [] #Every Node, in the order they were given.
+poll_slots = None #asyncio.Semaphore(MAX_CONCURRENT), made once the loop is running.
+facility_version = 0 #Bumped whenever any unit's status (or reachability) changes, so the merged view is only rebuilt when it has to be.
+shutdown = False
+
+@metrics.timed_async("poll_node")
+async def poll_node(node): #One poll. Returns True if the unit answered with a status.
+    async with poll_slots:
+        try:
+            code, body = await asyncio.wait_for(node.fetch("/status"), POLL_TIMEOUT_S)
+            if code != 200:
+                raise PollError("HTTP {}".format(code))
+            status = json.loads(body)
+        except (OSError, ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError, PollError) as e:
+            node.close()
+            return fail(node, e)
+    node.polls += 1
+    changed = status != node.status or node.failures
+    node.status = status
+    node.last_ok = time.monotonic()
+    node.failures = 0
+    node.error = None
+    if changed:
+        bump()
+    return True
+
+def fail(node, e):
+    if not node.failures:
+        log.warning("{} ({}) unreachable: {!r}", node.name, "{}:{}".format(node.host, node.port), e)
+        bump()
+    node.failures += 1
+    node.error = repr(e)
+    return False
+
+def bump():
+    global facility_version
+    facility_version += 1
+
+def backoff(failures): #Seconds until the next poll after this many failures in a row. Jittered, so units that dropped off together don't all come back in step.
+    delay = min(BACKOFF_MAX_S, BACKOFF_MIN_S*(2**min(failures - 1, 16)))
+    return delay*random.uniform(0.8, 1.2)
+
+async def node_task(node): #Polls one unit for as long as the gateway runs.
+    await asyncio.sleep(random.uniform(0, POLL_PERIOD_S)) #Spread the units out over the period rather than hitting them all at once at startup.
+    while not shutdown:
+        if await poll_node(node):
+            delay = POLL_PERIOD_S
+        else:
+            delay = backoff(node.failures)
+            if node.failures > 1:
+                log.debug("{}: retrying in {:.1f} s", node.name, delay)
+        await asyncio.sleep(delay)
+    node.close()
+
+#The merged view. Rebuilt at most once per facility_version per second (the ages tick over every second even when nothing else moves).
+m_facility_json = b""
+m_facility_key = None
+
+def node_summary(node, now): #One unit's entry in the facility view.
+    age = node.age(now)
+    return {
+        "name": node.name,
+        "address": "{}:{}".format(node.host, node.port),
+        "stale": node.stale(now),
+        "age": None if age is None else round(age, 1),
+        "failures": node.failures,
+        "error": node.error,
+        "status": node.status,
+    }
+
+def facility(now = None): #The facility-wide view as a dict: totals over every unit that isn't stale, plus each unit's own entry.
+    now = time.monotonic() if now is None else now
+    showers = 0
+    in_use = 0
+    heaters = 0
+    flow = 0
+    temp_total = 0
+    stale = 0
+    for node in nodes:
+        if node.stale(now) or not node.status:
+            stale += 1
+            continue
+        status = node.status
+        for key in status: #Per-shower keys are named after the shower (see STATUS_KEYS in main.py), so count those rather than assume two a unit.
+            if key.startswith("temp"):
+                showers += 1
+                temp_total += status[key]
+            elif key.endswith("_heatstatus") and status[key] == "On":
+                heaters += 1
+        in_use += status.get("num_showers", 0)
+        flow += status.get("flow", 0)
+    return {
+        "nodes": len(nodes),
+        "stale": stale,
+        "showers": showers,
+        "num_showers": in_use,
+        "heaters_on": heaters,
+        "flow": round(flow, 2),
+        "avg_temp": round(temp_total/showers, 2) if showers else None,
+        "units": [node_summary(node, now) for node in nodes],
+    }
+
+def facility_bytes():
+    global m_facility_json, m_facility_key
+    now = time.monotonic()
+    key = (facility_version, int(now))
+    if m_facility_key != key:
+        m_facility_json = json.dumps(facility(now)).encode("UTF-8")
+        m_facility_key = key
+    return m_facility_json
+
+GATEWAY_PAGE = """<html>
+    <head>
+        <title>Shower Gateway</title>
+        <meta name="viewport" content="width=device-width, initial-scale=1">
+        <link rel="icon" href="data:,">
+        <style>
+            td, th {padding: 4px 12px; text-align: center;}
+            .stale {color: #999999;}
+            .box {border: 2px solid black; padding: 10px; display: inline-block; min-width: 100px; font-size: 170%;}
+        </style>
+    </head>
+    <body>
+        <table>
+            <tr><td>Avg Temp</td><td>Showers in Use</td><td>Heaters On</td><td>Water Usage</td><td>Units Stale</td></tr>
+            <tr>
+                <td><div class="box"><span id="avg_temp"></span>&deg;C</div></td>
+                <td><div class="box"><span id="num_showers"></span> / <span id="showers"></span></div></td>
+                <td><div class="box"><span id="heaters_on"></span></div></td>
+                <td><div class="box"><span id="flow"></span> L/min</div></td>
+                <td><div class="box"><span id="stale"></span> / <span id="nodes"></span></div></td>
+            </tr>
+        </table>
+        <br>
+        <table border="1">
+            <thead><tr><th>Unit</th><th>Address</th><th>Avg Temp</th><th>In Use</th><th>Heater</th><th>Flow</th><th>Last Heard</th></tr></thead>
+            <tbody id="units"></tbody>
+        </table>
+        <script>
+            function show(value, suffix) {
+                return (value === null || value === undefined) ? "-" : Math.round(value*100)/100 + suffix;
+            }
+            function cell(row, text) {
+                row.insertCell().innerText = text;
+            }
+            function applyFacility(data) {
+                ["avg_temp", "num_showers", "showers", "heaters_on", "flow", "stale", "nodes"].forEach((key) => {
+                    document.getElementById(key).innerText = show(data[key], "");
+                });
+                var body = document.getElementById("units");
+                body.innerHTML = "";
+                data.units.forEach((unit) => {
+                    var row = body.insertRow();
+                    var status = unit.status || {};
+                    if (unit.stale) {
+                        row.className = "stale";
+                    }
+                    cell(row, unit.name);
+                    cell(row, unit.address);
+                    cell(row, show(status.avg_temp, " C"));
+                    cell(row, show(status.num_showers, ""));
+                    cell(row, status.heater_check || "-");
+                    cell(row, show(status.flow, " L/min"));
+                    cell(row, unit.age === null ? "never" : unit.age + " s ago" + (unit.error ? " (" + unit.error + ")" : ""));
+                });
+            }
+            function update() {
+                fetch("/api/facility").then((response) => response.json()).then(applyFacility);
+            }
+            update();
+            setInterval(update, 2000);
+        </script>
+    </body>
+</html>
+"""
+GATEWAY_PAGE_BYTES = GATEWAY_PAGE.encode("UTF-8")
+
+@httpd.route("GET", "/")
+async def send_page(request, writer, params):
+    await httpd.send_response(writer, "200 OK", "text/html", (GATEWAY_PAGE_BYTES,), len(GATEWAY_PAGE_BYTES), ("Cache-Control: no-cache",))
+
+@httpd.route("GET", "/api/facility")
+async def send_facility(request, writer, params): #Everything: the totals and every unit's last status with its age.
+    body = facility_bytes()
+    await httpd.send_response(writer, "200 OK", "application/json", (body,), len(body), ("Cache-Control: no-store",))
+
+@httpd.route("GET", "/api/node", (("name", str, None, None, None),))
+async def send_node(request, writer, params): #One unit's entry, by name.
+    for node in nodes:
+        if node.name == params.get("name"):
+            await httpd.send_json(writer, node_summary(node, time.monotonic()))
+            return
+    raise httpd.RequestError("404 Not Found", "No unit called {}".format(params.get("name")))
+
+@httpd.route("GET", "/metrics")
+async def send_metrics(request, writer, params):
+    await httpd.send_response(writer, "200 OK", "text/plain; version=0.0.4", metrics.render())
+
+def parse_node(spec, default_port = 80): #"[name=]host[:port]" or a dict from a nodes file -> Node.
+    if isinstance(spec, dict):
+        return Node(spec.get("name") or spec["host"], spec["host"], int(spec.get("port", default_port)))
+    name, _, address = spec.rpartition("=")
+    host, _, port = address.partition(":")
+    return Node(name or address, host, int(port) if port else default_port)
+
+def load_nodes(path): #Reads a nodes file: a JSON list of "host:port" strings or {"name", "host", "port"} objects.
+    with open(path) as f:
+        return [parse_node(spec) for spec in json.load(f)]
+
+async def serve():
+    global poll_slots
+    poll_slots = asyncio.Semaphore(MAX_CONCURRENT)
+    httpd.MAX_CONNECTIONS = 32 #A desktop has sockets to spare; these are dashboard clients, not the units.
+    server = await asyncio.start_server(httpd.respond_request, "0.0.0.0", HTTP_PORT)
+    log.info("Gateway for {} units listening on port {}", len(nodes), HTTP_PORT)
+    asyncio.create_task(log.drain_task(LOG_DRAIN_PERIOD_S))
+    try:
+        await asyncio.gather(*[node_task(node) for node in nodes])
+    finally:
+        server.close()
+        await server.wait_closed()
+
+USAGE = "usage: python gateway.py [--port N] [--nodes nodes.json] [name=]host[:port] ..."
+
+def main(argv):
+    global HTTP_PORT, shutdown
+    args = list(argv)
+    while args:
+        arg = args.pop(0)
+        if arg == "--port" and args:
+            HTTP_PORT = int(args.pop(0))
+        elif arg == "--nodes" and args:
+            nodes.extend(load_nodes(args.pop(0)))
+        elif arg.startswith("-"):
+            print(USAGE)
+            return 2
+        else:
+            nodes.append(parse_node(arg))
+    if not nodes:
+        print(USAGE)
+        return 2
+    names = [node.name for node in nodes]
+    if len(set(names)) != len(names):
+        print("Every unit needs a different name (use name=host:port)")
+        return 2
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        shutdown = True
+        log.info("Shutting down...")
+    log.drain()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
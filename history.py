@@ -0,0 +1,111 @@
+#Compact ring-buffer storage for the bar graph history. The old m_dataRecord was a list of lists of Python floats, and every float is its own little
+#heap object, so it couldn't get much bigger than a couple of weeks at a few dozen slots. This keeps everything in one flat array instead, so the
+#memory cost is fixed at slots*depth entries (4 bytes each for 'f', 2 for 'H'), no matter how fine the resolution is.
+from array import array
+
+def zeros(typecode, n): #A zero-filled array without building a list of n zeros first. Both CPython and MicroPython copy a bytes initializer straight in.
+    return array(typecode, bytes(n*array(typecode).itemsize))
+
+class History:
+    #slots: how many time slots make up one period (e.g. one week).
+    #depth: how many periods are kept for the rolling average.
+    #typecode: 'f' stores the values as 32-bit floats. 'H' or 'h' stores them as integers of value*scale (e.g. scale=100 keeps centi-degrees
+    #          in half the space), and then the running sums are exact integers too.
+    def __init__(self, slots, depth, typecode = 'f', scale = 1):
+        self.slots = slots
+        self.depth = depth
+        self.scale = scale
+        self.integer = typecode != 'f' and typecode != 'd'
+        self.data = zeros(typecode, slots*depth) #Row-major: period 0 is data[0:slots], period 1 is data[slots:2*slots], and so on.
+        self.sums = zeros('l' if self.integer else 'f', slots) #Running total of each slot across all the periods, so the average never needs a re-sum.
+
+    def index(self, timestamp): #Where in self.data a given timestamp lives. Timestamps just keep counting; the ring wraps every slots*depth.
+        return timestamp % (self.slots*self.depth)
+
+    def record(self, timestamp, value): #Stores one sample and updates that slot's running sum in O(1). Returns the new rolling average for the slot.
+        slot = timestamp % self.slots
+        idx = self.index(timestamp)
+        if self.integer:
+            value = int(round(value*self.scale)) #Rounded: truncating would store 12.35 as 1234, since 12.35*100 comes out a hair under 1235.
+        self.sums[slot] += value - self.data[idx]
+        self.data[idx] = value
+        if not self.integer and idx < self.slots:
+            #Float sums pick up a little rounding error on every update. Once per trip round the ring (when we're back on period 0) re-add the
+            #slot from scratch so it can't build up; that's O(depth) once every 'depth' updates, so still O(1) on average.
+            total = 0.0
+            for row in range(self.depth):
+                total += self.data[row*self.slots + slot]
+            self.sums[slot] = total
+        return self.mean(slot)
+
+    def mean(self, slot): #Rolling average of one slot over the last 'depth' periods.
+        return self.sums[slot]/(self.depth*self.scale)
+
+    def value(self, timestamp): #The raw sample stored for a timestamp, converted back to real units.
+        return self.data[self.index(timestamp)]/self.scale
+
+    def rebuild(self): #Re-adds every slot's running sum from the stored data, e.g. after the data has been loaded back from a snapshot.
+        for slot in range(self.slots):
+            total = 0
+            for row in range(self.depth):
+                total += self.data[row*self.slots + slot]
+            self.sums[slot] = total
+
+    def clear(self):
+        for i in range(len(self.data)):
+            self.data[i] = 0
+        for i in range(len(self.sums)):
+            self.sums[i] = 0
+
+class DayStats:
+    #Per-day summaries for the bar graph's text row (and /api/days), kept up as each sample lands instead of rescanning every day's slots on
+    #every render. A day's figures cover the most recent run through it: when the timestamp comes back round to the start of a day, that day
+    #is wiped and starts again. Values are ints in whatever scale the caller uses (main.py: hundredths).
+    #days: how many days make up the ring (COARSE_TIMESTEP); per_day: samples in a day (FINE_TIMESTEP).
+    def __init__(self, days, per_day):
+        self.days = days
+        self.per_day = per_day
+        self.mins = zeros('l', days)
+        self.maxs = zeros('l', days)
+        self.argmin = zeros('H', days) #Sample within the day where the min (and max) happened. The first one, if it happened more than once.
+        self.argmax = zeros('H', days)
+        self.sums = zeros('l', days)
+        self.counts = zeros('H', days)
+
+    def reset(self, day):
+        self.counts[day] = 0
+        self.sums[day] = 0
+
+    def record(self, timestamp, value): #One sample. O(1). Returns True if the day's min or max moved (or it started over), which is what the page shows.
+        slot = timestamp % (self.days*self.per_day)
+        day = slot//self.per_day
+        pos = slot % self.per_day
+        changed = False
+        if pos == 0: #Back round to the start of this day: last week's figures are out of date.
+            self.reset(day)
+            changed = True
+        n = self.counts[day]
+        if n == 0 or value < self.mins[day]:
+            self.mins[day] = value
+            self.argmin[day] = pos
+            changed = True
+        if n == 0 or value > self.maxs[day]:
+            self.maxs[day] = value
+            self.argmax[day] = pos
+            changed = True
+        self.sums[day] += value
+        self.counts[day] = n + 1
+        return changed
+
+    def mean(self, day): #The day's mean, rounded, or None if nothing's been recorded yet.
+        n = self.counts[day]
+        if not n:
+            return None
+        return (self.sums[day] + n//2)//n
+
+    def rebuild(self, history, timestamp, scale = 1): #Refills every day from a History's last full ring of samples before 'timestamp', e.g. after restoring a snapshot.
+        for day in range(self.days):
+            self.reset(day)
+        slots = self.days*self.per_day
+        for t in range(timestamp - slots, timestamp):
+            self.record(t, int(round(history.value(t)*scale)))
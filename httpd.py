@@ -0,0 +1,455 @@
+#The web server side of the Pico: request parsing, the route table, the response writer and the connection pool. main.py registers its pages
+#with route() and hands respond_request() to asyncio.start_server(); nothing in here knows about showers.
+#
+#Requests are parsed by a small state machine that reads straight into a preallocated bytearray, stops as soon as it sees the blank line that ends the
+#headers, and only turns the bits of the request we actually route on into strings. A client can't make us allocate more than the buffer we handed it.
+import json
+import metrics
+import log
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+REQ_BUFSIZE = 2048 #Request line + headers + body all have to fit in here. Anything bigger gets a 413.
+MAX_HEADERS = 32 #Header lines past this get a 400. Browsers send about a dozen.
+MAX_BODY = 512 #Largest request body we'll accept (threshold updates and the like are tiny).
+RECV_TIMEOUT = 5 #Seconds a client gets to send its request before we give up on it and close the connection.
+WANTED_HEADERS = ("connection", "content-length", "transfer-encoding", "if-none-match", "accept-encoding", "accept") #The only headers routing needs. Everything else is skipped without ever being decoded.
+
+#Lengths of the wanted header names, so most headers can be skipped by length alone without making a string out of them.
+_wanted_lengths = set(len(name) for name in WANTED_HEADERS)
+
+_free_buffers = [] #Request buffers waiting to be handed to the next connection.
+
+def preallocate_buffers(count): #Allocates the request buffers up front (one per connection we allow), so accepting a client doesn't have to find REQ_BUFSIZE of contiguous heap.
+    while len(_free_buffers) < count:
+        _free_buffers.append(bytearray(REQ_BUFSIZE))
+
+def take_buffer(): #Hands out a request buffer for a new connection. Only allocates if the pool has run dry (e.g. an evicted connection hasn't given its one back yet).
+    if _free_buffers:
+        return _free_buffers.pop()
+    return bytearray(REQ_BUFSIZE)
+
+def return_buffer(buf, limit): #Puts a connection's buffer back for reuse, unless we're already holding 'limit' spares.
+    if len(_free_buffers) < limit:
+        _free_buffers.append(buf)
+
+class RequestError(Exception): #Raised for requests we refuse to handle. 'status' is the HTTP status line to answer with, and 'message' (if any) is sent back as a JSON error.
+    def __init__(self, status, message = None):
+        Exception.__init__(self, status)
+        self.status = status
+        self.message = message
+
+async def _readinto(reader, mv): #uasyncio streams can read straight into our buffer. CPython's StreamReader can't, so there we copy one read's worth in.
+    if hasattr(reader, "readinto"):
+        return await reader.readinto(mv)
+    data = await reader.read(len(mv))
+    mv[:len(data)] = data
+    return len(data)
+
+def _strip(buf, start, end): #Trims spaces and tabs off both ends of buf[start:end] and returns the new (start, end), without copying anything.
+    while start < end and buf[start] in (32, 9):
+        start += 1
+    while end > start and buf[end-1] in (32, 9):
+        end -= 1
+    return start, end
+
+def _hex_digit(c): #The value of one hex digit's byte. Anything else makes the escape it's in malformed.
+    if 48 <= c <= 57: #'0'-'9'
+        return c - 48
+    c |= 32 #Lower case.
+    if 97 <= c <= 102: #'a'-'f'
+        return c - 87
+    raise RequestError("400 Bad Request")
+
+def _unquote(buf, start, end): #buf[start:end] as a string, with '+' as a space and %XX escapes decoded. Decodes over the top of buf, since the result is never longer.
+    read = start
+    while read < end and buf[read] != 37 and buf[read] != 43: #Nothing to decode up to the first '%' or '+', which for most keys and values is all of it.
+        read += 1
+    write = read
+    while read < end:
+        c = buf[read]
+        if c == 43: #'+'
+            c = 32
+        elif c == 37: #'%'
+            if end - read < 3:
+                raise RequestError("400 Bad Request")
+            c = (_hex_digit(buf[read+1]) << 4) | _hex_digit(buf[read+2])
+            read += 2
+        buf[write] = c
+        write += 1
+        read += 1
+    return bytes(buf[start:write]).decode("UTF-8")
+
+def parse_query(buf, start, end):
+    #Splits a query string (or form body) sitting in buf[start:end] into a list of (key, value) strings, URL-decoded. That happens in place,
+    #so buf[start:end] is scrambled afterwards. Raises RequestError for a malformed escape.
+    query = []
+    while start < end:
+        amp = start
+        while amp < end and buf[amp] != 38: #'&'
+            amp += 1
+        eq = start
+        while eq < amp and buf[eq] != 61: #'='
+            eq += 1
+        if amp > start:
+            key = _unquote(buf, start, eq)
+            vstart, vend = _strip(buf, min(eq + 1, amp), amp)
+            query.append((key, _unquote(buf, vstart, vend)))
+        start = amp + 1
+    return query
+
+def _parse_request_line(buf, start, end, request): #Fills in method, path, query and protocol from the request line in buf[start:end].
+    sp1 = start
+    while sp1 < end and buf[sp1] != 32:
+        sp1 += 1
+    sp2 = sp1 + 1
+    while sp2 < end and buf[sp2] != 32:
+        sp2 += 1
+    if sp1 >= end or sp2 >= end or sp2 == sp1 + 1:
+        raise RequestError("400 Bad Request")
+    qmark = sp1 + 1
+    while qmark < sp2 and buf[qmark] != 63: #'?'
+        qmark += 1
+    request["method"] = bytes(buf[start:sp1]).decode("UTF-8")
+    request["path"] = bytes(buf[sp1+1:qmark]).decode("UTF-8")
+    request["querystr"] = bytes(buf[qmark+1:sp2]).decode("UTF-8") if qmark < sp2 else ""
+    request["query"] = parse_query(buf, qmark + 1, sp2)
+    request["protocol"] = bytes(buf[sp2+1:end]).decode("UTF-8")
+
+def _next_line(buf, start, stop): #Finds the line starting at buf[start]. Returns (end of the line without its line ending, start of the next line).
+    nl = start
+    while nl < stop and buf[nl] != 10:
+        nl += 1
+    end = nl - 1 if (nl > start and buf[nl-1] == 13) else nl
+    return end, nl + 1
+
+def _parse_headers(buf, start, stop, request): #Picks the WANTED_HEADERS out of the header lines in buf[start:stop]. Returns the Content-Length (0 if there isn't one).
+    headers = []
+    length = 0
+    while start < stop:
+        end, next_start = _next_line(buf, start, stop)
+        if end == start: #The blank line at the end of the headers.
+            break
+        colon = start
+        while colon < end and buf[colon] != 58: #':'
+            colon += 1
+        if colon >= end:
+            raise RequestError("400 Bad Request")
+        name_start = start
+        start = next_start
+        if (colon - name_start) not in _wanted_lengths:
+            continue
+        name = bytes(buf[name_start:colon]).lower().decode("UTF-8")
+        if name not in WANTED_HEADERS:
+            continue
+        vstart, vend = _strip(buf, colon + 1, end)
+        value = bytes(buf[vstart:vend]).decode("UTF-8")
+        if name == "content-length":
+            try:
+                length = int(value)
+            except ValueError:
+                raise RequestError("400 Bad Request")
+            if length < 0:
+                raise RequestError("400 Bad Request")
+        elif name == "transfer-encoding":
+            raise RequestError("400 Bad Request") #No chunked uploads; nothing we serve needs them.
+        headers.append((name, value))
+    request["headers"] = headers
+    return length
+
+async def read_request(reader, buf, carry, timeout, recv_timeout):
+    #Reads one request into buf and parses it. 'carry' is the (start, end) of any bytes in buf left over from the last request on this connection
+    #(pipelining), as returned last time. 'timeout' applies while waiting for the request to start and 'recv_timeout' once it has.
+    #Returns (request, carry) to pass back in next time, or (None, None) if the client closed the connection cleanly.
+    #Raises RequestError if the request is malformed (which includes anything we decode not being UTF-8) or too big.
+    mv = memoryview(buf)
+    filled = 0
+    if carry is not None and carry[1] > carry[0]:
+        filled = carry[1] - carry[0]
+        buf[:filled] = buf[carry[0]:carry[1]] #Shuffle a pipelined request down to the start of the buffer.
+    scan = 0 #Everything before this has already been run through the state machine.
+    line_start = 0
+    request_line = -1 #Where the request line starts, once we've found it.
+    nlines = 0
+    header_end = -1
+    while header_end < 0:
+        while scan < filled: #Line state machine: every '\n' ends a line (with or without a '\r' before it), and an empty line ends the headers.
+            if buf[scan] == 10:
+                line_end = scan - 1 if (scan > line_start and buf[scan-1] == 13) else scan
+                if line_end == line_start:
+                    if nlines:
+                        header_end = scan + 1
+                        break
+                else:
+                    if nlines > MAX_HEADERS:
+                        raise RequestError("400 Bad Request")
+                    if not nlines:
+                        request_line = line_start #Blank lines before the request line are allowed, and skipped.
+                    nlines += 1
+                line_start = scan + 1
+            scan += 1
+        if header_end >= 0:
+            break
+        if filled >= len(buf):
+            raise RequestError("413 Payload Too Large")
+        n = await asyncio.wait_for(_readinto(reader, mv[filled:]), timeout if filled == 0 else recv_timeout)
+        if not n:
+            if filled == 0:
+                return None, None
+            raise RequestError("400 Bad Request") #Hung up halfway through the headers.
+        filled += n
+
+    request = {}
+    line_end, headers_start = _next_line(buf, request_line, header_end)
+    try:
+        _parse_request_line(buf, request_line, line_end, request)
+        length = _parse_headers(buf, headers_start, header_end, request)
+    except UnicodeError: #Bytes that aren't UTF-8 in the bits we decode. CPython raises; MicroPython lets most through.
+        raise RequestError("400 Bad Request")
+    if length > MAX_BODY or header_end + length > len(buf):
+        raise RequestError("413 Payload Too Large")
+    while filled < header_end + length:
+        n = await asyncio.wait_for(_readinto(reader, mv[filled:header_end+length]), recv_timeout)
+        if not n:
+            raise RequestError("400 Bad Request")
+        filled += n
+    try:
+        request["body"] = bytes(mv[header_end:header_end+length]).decode("UTF-8") if length else "" #Before parse_query(), which decodes over the top of it.
+        request["form"] = parse_query(buf, header_end, header_end + length) #Form-encoded bodies are split straight out of the buffer, like the query string.
+    except UnicodeError:
+        raise RequestError("400 Bad Request")
+    return request, (header_end + length, filled)
+
+#One send buffer shared by every connection. This is safe because send_response() only awaits right after writer.write(), and both uasyncio and CPython copy the data out during write(), so the buffer is always free again by the time anyone else gets to run.
+SEND_BUFSIZE = 536 #About one TCP segment on the Pico's network stack.
+send_buf = bytearray(SEND_BUFSIZE)
+send_mv = memoryview(send_buf)
+
+async def _flush_send_buf(writer, fill, chunked): #Pushes the first 'fill' bytes of the send buffer to the client, wrapped in a chunk header if we're doing chunked encoding.
+    if chunked:
+        writer.write("{:x}\r\n".format(fill).encode("UTF-8"))
+    writer.write(send_mv[:fill])
+    if chunked:
+        writer.write(b"\r\n")
+    await writer.drain()
+
+@metrics.timed_async("send_response")
+async def send_response(writer, status, content_type, body = (), length = None, headers = ()): #Streams a response to the client. 'body' is any iterable (or generator) of bytes fragments; they get copied through the one preallocated send buffer and sent in SEND_BUFSIZE pieces, so the full page never has to exist as one string. If the length isn't known ahead of time, the body is sent with chunked encoding instead of a Content-Length. 'headers' is any extra "Name: value" header lines.
+    chunked = length is None
+    head = "HTTP/1.1 {}\r\n".format(status)
+    if content_type:
+        head += "Content-Type: {}\r\n".format(content_type)
+    for line in headers:
+        head += line + "\r\n"
+    if chunked:
+        head += "Transfer-Encoding: chunked\r\n"
+    else:
+        head += "Content-Length: {}\r\n".format(length)
+    head += "\r\n" #No Connection header means keep-alive under HTTP/1.1; respond_request() decides whether the socket actually stays open.
+    writer.write(head.encode("UTF-8"))
+
+    fill = 0
+    for fragment in body:
+        fragment = memoryview(fragment)
+        pos = 0
+        while pos < len(fragment):
+            n = min(SEND_BUFSIZE - fill, len(fragment) - pos)
+            send_mv[fill:fill+n] = fragment[pos:pos+n]
+            fill += n
+            pos += n
+            if fill == SEND_BUFSIZE:
+                await _flush_send_buf(writer, fill, chunked)
+                fill = 0
+    if fill:
+        await _flush_send_buf(writer, fill, chunked)
+    if chunked:
+        writer.write(b"0\r\n\r\n") #Zero-length chunk marks the end of the body.
+    await writer.drain()
+    
+def get_header(request, name): #Finds a request header by name (case-insensitive), or returns an empty string if the client didn't send it.
+    name = name.lower()
+    for k, v in request["headers"]:
+        if k.lower() == name:
+            return v
+    return ""
+
+def etag_matches(request, etag): #True if the client's If-None-Match says it already has this exact version.
+    match = get_header(request, "If-None-Match")
+    return match == "*" or etag in match
+
+async def send_not_modified(writer, etag): #A 304 has no body, so this is about the cheapest response we can possibly send.
+    await send_response(writer, "304 Not Modified", None, (), 0, ("ETag: " + etag,))
+
+#Route table. Each (method, path) maps to (handler, compiled params), so finding a page is a single dict lookup however many we add.
+#Handlers are 'async def handler(request, writer, params)', where params is a dict of the route's query/form parameters, already converted and range-checked.
+ROUTES = {}
+
+def compile_params(spec): #Turns a route's parameter list [(name, type, low, high, default), ...] into a dict keyed by name so decoding is one lookup per parameter. low/high can be None for "no limit"; a default of None means the parameter is optional and left out of params if not given.
+    compiled = {}
+    for name, kind, low, high, default in spec:
+        compiled[name] = (kind, low, high, default)
+    return compiled
+
+def route(method, path, params = ()): #Decorator that registers a handler in ROUTES.
+    def register(handler):
+        add_route(method, path, handler, params)
+        return handler
+    return register
+
+def add_route(method, path, handler, params = ()):
+    ROUTES[(method, path)] = (handler, compile_params(params))
+
+def decode_params(request, compiled): #Converts the query string (and a form-encoded body, if there is one) into typed values according to the route's compiled params. Unknown parameters are ignored; bad ones raise a 400 that says what was wrong.
+    params = {}
+    for name in compiled:
+        default = compiled[name][3]
+        if default is not None:
+            params[name] = default
+    for k, v in request["query"] + request["form"]:
+        if k not in compiled:
+            continue
+        kind, low, high, default = compiled[k]
+        try:
+            value = kind(v)
+        except ValueError:
+            raise RequestError("400 Bad Request", "{} isn't a valid {}".format(k, kind.__name__))
+        if (low is not None and value < low) or (high is not None and value > high):
+            if high is None:
+                raise RequestError("400 Bad Request", "{} must be at least {}".format(k, low))
+            if low is None:
+                raise RequestError("400 Bad Request", "{} must be at most {}".format(k, high))
+            raise RequestError("400 Bad Request", "{} must be between {} and {}".format(k, low, high))
+        params[k] = value
+    return params
+
+@metrics.timed_async("dispatch")
+async def dispatch(request, writer): #Looks the request up in ROUTES and runs its handler. Unknown paths get a 404; known paths with the wrong method get a 405.
+    entry = ROUTES.get((request["method"], request["path"]))
+    if entry is None:
+        allowed = [method for method, path in ROUTES if path == request["path"]]
+        if allowed:
+            await send_response(writer, "405 Method Not Allowed", "text/plain", (), 0, ("Allow: " + ", ".join(allowed),))
+        else:
+            await send_response(writer, "404 Not Found", "text/plain", (), 0)
+        return
+    handler, compiled = entry
+    await handler(request, writer, decode_params(request, compiled))
+
+async def send_json(writer, data, status = "200 OK"): #Sends a small JSON reply, e.g. an acknowledgement from one of the /api routes.
+    body = json.dumps(data).encode("UTF-8")
+    await send_response(writer, status, "application/json", (body,), len(body))
+
+async def send_error(writer, error, headers = ()): #Answers a RequestError, with its message as JSON if it has one.
+    if error.message is None:
+        await send_response(writer, error.status, "text/plain", (), 0, headers)
+    else:
+        body = json.dumps({"error": error.message}).encode("UTF-8")
+        await send_response(writer, error.status, "application/json", (body,), len(body), headers)
+
+def wants_keep_alive(request): #HTTP/1.1 keeps the connection open unless the client says otherwise; HTTP/1.0 closes unless the client asks to keep it.
+    connection = get_header(request, "Connection").lower()
+    if request["protocol"] == "HTTP/1.0":
+        return connection == "keep-alive"
+    return connection != "close"
+
+#Connection pool. Every open client socket gets an entry here, least recently used first, so we can cap how many the lwIP stack has to juggle at once.
+MAX_CONNECTIONS = 8 #Includes the long-lived /events streams.
+IDLE_TIMEOUT = 10 #Seconds a kept-alive connection can sit between requests before we close it.
+open_connections = [] #Entries are [writer, busy]. Busy means we're in the middle of answering it, so it mustn't be evicted.
+
+async def claim_connection(writer): #Adds a new connection to the pool. If the pool is full, the least recently used idle connection is closed to make room; if they're all busy, returns None and the new client gets turned away.
+    victim = None
+    if len(open_connections) >= MAX_CONNECTIONS:
+        for victim in open_connections:
+            if not victim[1]:
+                open_connections.remove(victim)
+                break
+        else:
+            return None
+    entry = [writer, False] #Not busy until its first request actually arrives, so speculative browser pre-connects can be evicted too.
+    open_connections.append(entry) #In the pool before we await anything, so a client arriving meanwhile counts it.
+    if victim is not None:
+        log.info("Evicted an idle connection")
+        try:
+            #uasyncio's close() does nothing; the socket only really closes in wait_closed(). Its task's read then fails or sees the end
+            #of the stream, and it notices it's no longer in the pool and exits.
+            victim[0].close()
+            await victim[0].wait_closed()
+        except OSError:
+            pass
+    return entry
+
+def touch_connection(entry, busy): #Marks a connection busy or idle, and moves it to the most recently used end of the pool.
+    entry[1] = busy
+    if entry in open_connections:
+        open_connections.remove(entry)
+        open_connections.append(entry)
+
+def release_connection(entry):
+    if entry in open_connections:
+        open_connections.remove(entry)
+
+@metrics.timed_async("respond_request") #Covers the whole connection, keep-alive and all. "dispatch" is the per-request figure.
+async def respond_request(reader, writer): #Handles a single client connection. The asyncio server gives every connection its own task, so one slow client no longer holds up the others (or the sensors). The connection is kept alive for further requests until the client closes it, asks us to, or goes idle for IDLE_TIMEOUT.
+    if log.level <= log.DEBUG: #Looking up the peer isn't free, and log.debug() would only throw it away.
+        log.debug("Got a connection from {}", writer.get_extra_info('peername'))
+
+    entry = await claim_connection(writer)
+    if entry is None:
+        try:
+            await send_response(writer, "503 Service Unavailable", "text/plain", (), 0, ("Connection: close", "Retry-After: 1"))
+            writer.close()
+            await writer.wait_closed()
+        except OSError:
+            pass
+        return
+
+    buf = take_buffer() #This connection's request buffer, reused for every request on it.
+    carry = None
+    try:
+        timeout = RECV_TIMEOUT #The first request should show up promptly; after that the client gets the longer idle timeout.
+        while True:
+            try:
+                request, carry = await read_request(reader, buf, carry, timeout, RECV_TIMEOUT)
+            except RequestError as e: #Malformed or oversized. Tell the client why and hang up before it can send us any more.
+                await send_error(writer, e, ("Connection: close",))
+                break
+
+            # If the request was empty, the client has closed its end
+            if request is None:
+                break
+            if entry not in open_connections: #Evicted while it was waiting. Don't answer on a socket that's been closed under us.
+                break
+
+            touch_connection(entry, True)
+            request["keep_alive"] = wants_keep_alive(request) #Handlers can clear this if the connection can't be reused afterwards (an event stream, say).
+            try:
+                await dispatch(request, writer)
+            except OSError:
+                raise
+            except RequestError as e: #Bad parameters and the like. The connection is still fine to reuse.
+                await send_error(writer, e)
+            except Exception as e:
+                log.error("{} {} failed: {!r}", request["method"], request["path"], e)
+                # Return a 500 code if the request processor encounters an exception
+                await send_response(writer, "500 Internal Server Error", "text/plain", (), 0, ("Connection: close",))
+                break
+            if not request["keep_alive"]:
+                break
+            touch_connection(entry, False)
+            timeout = IDLE_TIMEOUT
+    except asyncio.TimeoutError: #If the client goes quiet, drop it and let the other tasks carry on.
+        pass
+    except OSError as e: #Client hung up on us partway through (or we evicted it). Nothing to do but close our end.
+        log.debug("Connection error: {}", e)
+    finally:
+        release_connection(entry)
+        return_buffer(buf, MAX_CONNECTIONS)
+        try:
+            writer.close()
+            await writer.wait_closed()
+        except OSError:
+            pass
+    return
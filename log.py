@@ -0,0 +1,163 @@
+#Leveled logging into a fixed-size ring buffer, instead of print()ing straight to the USB serial.
+#
+#A print() blocks until the serial port has taken the whole line, and that was happening on every request and every hardware loop. Here a log
+#call just formats the line (only if its level is switched on; the level check comes before any formatting) and copies it into a bytearray that
+#never grows. drain_task() pushes whatever is new out to serial (and a file, if LOG_FILE is set) in batches every few seconds, well away from
+#the request path, and /logs hands out the buffer as it stands. If the buffer laps the drain, the oldest lines are just lost, and the next drain says so.
+#
+#With core 1 running, both cores write into the ring and core 0 reads it, so share(True) puts a lock around every copy in or out.
+import sys
+import utime
+import shared
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+NAMES = {DEBUG: "D", INFO: "I", WARNING: "W", ERROR: "E"} #What goes in front of each line.
+
+level = INFO #Anything below this is thrown away before it's even formatted.
+BUFSIZE = 4096 #Bytes of log kept in RAM, about 80 lines of the usual length. Keep it a power of two so it divides the counters' wrap evenly.
+LOG_FILE = None #Set to a path to also append the drained lines to flash. Off by default; it's a lot of writes for the flash to put up with.
+FILE_MAX = 16384 #Once LOG_FILE gets this big, it's renamed to LOG_FILE + ".1" (replacing the last one) and started over.
+ECHO = True #Drain to serial as well. Off saves the USB time entirely, with /logs as the only way to see them.
+
+_MASK = (1 << 30) - 1 #The write and drain counters wrap like ticks do, so they stay small ints forever.
+_buf = bytearray(BUFSIZE)
+_mv = memoryview(_buf)
+_written = 0 #Total bytes ever written (mod 2**30). The next byte goes at _written % BUFSIZE.
+_drained = 0 #Total bytes drain() has dealt with.
+_full = False #Set once the ring has gone all the way round.
+_lock = None #See share().
+
+def share(on): #Locks the ring while a line goes in or a copy comes out, for when another core logs too. main() turns it on just before starting
+    #core 1. It's off otherwise because on one core the sensor timer logs from a soft interrupt, which would hang on a lock held by the code it interrupted.
+    global _lock
+    _lock = shared.allocate_lock() if on else None
+
+def _write(data): #Copies one finished line into the ring, wrapping round the end if need be.
+    global _written, _full
+    n = len(data)
+    if n > BUFSIZE:
+        data = data[n - BUFSIZE:]
+        n = BUFSIZE
+    lock = _lock
+    if lock is not None:
+        lock.acquire()
+    try:
+        pos = _written % BUFSIZE
+        first = min(n, BUFSIZE - pos)
+        _mv[pos:pos+first] = data[:first]
+        if first < n:
+            _mv[0:n-first] = data[first:]
+        if pos + n >= BUFSIZE:
+            _full = True
+        _written = (_written + n) & _MASK
+    finally:
+        if lock is not None:
+            lock.release()
+
+def emit(lvl, msg, a = None, b = None, c = None): #Logs msg.format(a, b, c) at level lvl. Up to three arguments, passed separately so that a disabled call doesn't even build a tuple.
+    if lvl < level:
+        return
+    if a is not None or b is not None or c is not None:
+        msg = msg.format(a, b, c)
+    _write("{} {} {}\n".format(utime.ticks_ms(), NAMES.get(lvl, "?"), msg).encode("UTF-8"))
+
+def debug(msg, a = None, b = None, c = None):
+    if level <= DEBUG:
+        emit(DEBUG, msg, a, b, c)
+
+def info(msg, a = None, b = None, c = None):
+    if level <= INFO:
+        emit(INFO, msg, a, b, c)
+
+def warning(msg, a = None, b = None, c = None):
+    if level <= WARNING:
+        emit(WARNING, msg, a, b, c)
+
+def error(msg, a = None, b = None, c = None):
+    if level <= ERROR:
+        emit(ERROR, msg, a, b, c)
+
+def _backlog():
+    return (_written - _drained) & _MASK
+
+def _copy(start): #contents(), plus the _written it goes up to.
+    lock = _lock
+    if lock is not None:
+        lock.acquire()
+    try:
+        written = _written
+        if start is None:
+            backlog = BUFSIZE if _full else written
+        else:
+            backlog = min((written - start) & _MASK, BUFSIZE)
+        if backlog == 0:
+            return b"", written
+        end = written % BUFSIZE
+        begin = (end - backlog) % BUFSIZE
+        if begin < end:
+            return bytes(_mv[begin:end]), written
+        return bytes(_mv[begin:]) + bytes(_mv[:end]), written
+    finally:
+        if lock is not None:
+            lock.release()
+
+def contents(start = None): #A copy of the log from 'start' (a position from an earlier _written, default as far back as the buffer goes) to now, as bytes.
+    return _copy(start)[0]
+
+def lines(): #The whole buffer for /logs, trimmed to start on a line boundary if the oldest line has been partly overwritten.
+    data = contents()
+    if _full:
+        cut = data.find(b"\n")
+        data = data[cut+1:] if cut >= 0 else b""
+    return data
+
+def _to_file(data):
+    import os
+    try:
+        if os.stat(LOG_FILE)[6] + len(data) > FILE_MAX:
+            try:
+                os.remove(LOG_FILE + ".1")
+            except OSError:
+                pass
+            os.rename(LOG_FILE, LOG_FILE + ".1")
+    except OSError: #No log file yet.
+        pass
+    with open(LOG_FILE, "ab") as f:
+        f.write(data)
+
+def drain(): #Pushes everything logged since the last drain out to serial and/or LOG_FILE in one go.
+    global _drained
+    if not _backlog():
+        return
+    data, written = _copy(_drained)
+    backlog = (written - _drained) & _MASK #Taken with the copy, in case core 1 has logged since.
+    if backlog > BUFSIZE:
+        cut = data.find(b"\n") #The oldest line we still have is missing its start.
+        data = "[{} bytes of log lost]\n".format(backlog - BUFSIZE + cut + 1).encode("UTF-8") + data[cut+1:]
+    _drained = written
+    if ECHO:
+        out = getattr(sys.stdout, "buffer", sys.stdout) #CPython wants bytes on .buffer; MicroPython's stdout takes bytes directly.
+        if out is not sys.stdout:
+            sys.stdout.flush() #Keep the order straight with anything that still goes through print().
+        out.write(data)
+        flush = getattr(out, "flush", None)
+        if flush is not None:
+            flush()
+    if LOG_FILE:
+        try:
+            _to_file(data)
+        except OSError as e:
+            if ECHO:
+                print("Couldn't write {}: {}".format(LOG_FILE, e))
+
+async def drain_task(period_s): #Drains the log every period_s seconds, for as long as the program runs.
+    while True:
+        await asyncio.sleep(period_s)
+        drain()
@@ -1,9 +1,27 @@
 import utime
 import machine
-import usocket as socket
 import network
 import json
 import gc #Added a garbage collection library because I was having some memory management problems.
+import binascii
+import random
+import struct
+import httpd
+import snapshot
+import metrics
+import sampler
+import calibrate
+import scheduler
+import shared
+import log
+import rollup
+import accounting
+import control
+from history import History, DayStats, zeros
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio #Plain CPython has it under the normal name, which lets the server run on a laptop for testing.
 
 #Bargraph constants
 FINE_TIMESTEP = 6
@@ -13,7 +31,9 @@ RAVG_DEPTH = 2
 #Maya's constants
 WEEK_TIMESTEP = FINE_TIMESTEP*COARSE_TIMESTEP
 TOTAL_TIME = RAVG_DEPTH*WEEK_TIMESTEP
-HYST_RANGE = 10000 #Hysteresis +/- range, affects on/off sensitivity.
+HISTORY_TYPECODE = 'f' #How m_history stores samples. 'f' is a 32-bit float; 'h' with HISTORY_SCALE = 100 stores centi-degrees in half the space, which is the way to go if WEEK_TIMESTEP gets cranked up to per-minute.
+HISTORY_SCALE = 1
+HYST_RANGE = 2500 #Hysteresis +/- range, affects on/off sensitivity. Was 10000 back when every reading was a single sample; averaging ADC_BURST samples cuts the noise by about sqrt(ADC_BURST).
 HYST_OFFSET = 0 #Hysteresis midpoint offset.
 IR_THRESHOLD_HIGH = 2**15 + HYST_OFFSET + HYST_RANGE
 IR_THRESHOLD_LOW = 2**15 + HYST_OFFSET - HYST_RANGE #These should be double-checked to ensure the hysteresis works at the desired range. !!!!!!!
@@ -23,52 +43,136 @@ MAX_RATE = 50 #Esme's constants - estimated max rate of water flowing from showe
 
 COEFFICIENT = 50 #Seb constants. Coefficient for the Resistance_to_Celsius function. May be determined experimentally using a thermometer.  
 
+#Heater control. See control.py; python -m sim.replay scores a tuning against recorded occupancy before it goes on a real heater.
+HEATER_BAND = 200 #Hundredths of a degree. The heater comes on below threshold - band and goes off above threshold (hysteresis), and never stays on past threshold + band. This was the hardcoded 2 degrees.
+HEATER_MIN_SWITCH_MS = 5000 #Shortest time between two switches of a heater relay, bar switching off because nobody needs it or it's too hot.
+HEATER_KP = 0 #PID gains: permille of full power per degree below the threshold, per degree-second, and per degree/second. All 0 is plain hysteresis.
+HEATER_KI = 0
+HEATER_KD = 0
+HEATER_WINDOW_MS = 20000 #With PID, the heater is on for the PID's share of each window.
+PREHEAT_LEAD_SLOTS = 10 #How many bar graph slots ahead to look for likely use, and so roughly how long the heater gets to warm up beforehand. 0 turns pre-heating off.
+PREHEAT_PROBABILITY = 50 #Percent of the weeks kept that a slot has to have been in use in for it to be warmed up for.
+
+#Server constants
+HTTP_PORT = 80
+HARDWARE_PERIOD_MS = 1000 #How often picoHardwareLoop() runs. This is a fixed cadence now, no matter how busy the web server is.
+LOG_DRAIN_PERIOD_S = 5 #How often the log buffer is pushed out to the serial port. See log.py.
+WATCHDOG_TIMEOUT_MS = 5000 #If the hardware loop doesn't feed the watchdog for this long, the Pico resets. /metrics reports how close we've come.
+
+#Snapshot constants
+SNAPSHOT_FILES = ("history_a.bin", "history_b.bin") #Written alternately, so there's always one good copy even if we reset mid-write. See snapshot.py.
+SNAPSHOT_PERIOD_S = 600 #How often the history gets saved to flash. Shorter loses less on a reset but wears the flash faster. 0 turns snapshots off.
+
+#Downsampled history for /api/history; see rollup.py. Bucket sizes are in hardware loops (HARDWARE_PERIOD_MS each).
+ROLLUP_TIERS = ((1, 120), (10, 180), (60, 240), (600, 144), (3600, 168)) #Raw for 2 min, 10 s buckets for 30 min, 1 min for 4 h, 10 min for a day, hourly for a week. About 15 KB all told.
+HISTORY_SERIES = ("temp", "flow", "occupancy") #Average temperature, total flow and showers in use, all in hundredths.
+HISTORY_MAX_POINTS = 500 #Most points one /api/history response will have. A bigger span just gets a bigger step.
+HISTORY_BIN_VERSION = 1
+HISTORY_BIN_HEADER = "<BBHIIII" #Layout version, series, HARDWARE_PERIOD_MS, newest sample number, first sample number, step, points.
+HISTORY_BIN_ROW = "<" + "hhh"*len(HISTORY_SERIES) #Then per point, per series: min, max, mean (hundredths). min > max means no data for that point.
+
+#Water and heater accounting; see accounting.py.
+SESSION_LOG_SIZE = 128 #Finished sessions kept for /api/sessions, 16 bytes each. The oldest goes first.
+SESSION_MIN_MS = 10000 #Occupied for less than this isn't logged as a session (its water still counts in the totals).
+USAGE_FILES = ("usage_a.bin", "usage_b.bin") #The session log and usage totals, snapshotted alongside SNAPSHOT_FILES but separately, so either layout can change without losing the other.
+OCCUPANCY_FILES = ("occupancy_a.bin", "occupancy_b.bin") #Same for what m_predictor has learned.
+
+#ADC acquisition. See sampler.py.
+ADC_BURST = 16 #Samples per channel per hardware loop.
+ADC_FILTER = sampler.MEAN #How a burst is turned into one reading. sampler.MEDIAN if the heater relays turn out to put spikes on the line.
+ADC_SETTLE_US = 5 #Wait after switching a sensor's transistor on before sampling it.
+
+#Calibration. Every channel's reading goes through a lookup table built at boot; see calibrate.py.
+CALIBRATION_FILE = "calibration.json" #Optional. Any channel named in it gets that curve (e.g. a fitted Steinhart-Hart) instead of the default formula below.
+
+#Sensor scheduling. Sampling and the heater/IR outputs run off a machine.Timer, not the asyncio loop; see scheduler.py.
+SENSOR_TICK_MS = 100 #The timer's period. Every period below gets rounded to a whole number of these.
+IR_PERIOD_MS = 100 #10 Hz, so the In Use light feels instant.
+FLOW_PERIOD_MS = 500
+TEMP_PERIOD_MS = 1000 #The water temperature can't change much in a second.
+CONTROL_PERIOD_MS = 100 #How often the IR outputs and heaters are updated from the newest readings.
+RING_SIZE = 16 #Readings kept per channel between hardware loops. A power of two, and it needs to hold at least HARDWARE_PERIOD_MS of the fastest sensor.
+
+#The showers. Everything per shower (mux channels, calibration tables, rings, IR lights, heaters, thresholds, the status JSON and the dashboard)
+#is generated from this table, so another stall is one more line here and nothing else. Per shower:
+#    name: goes in the JSON keys and element ids (temp1, sh1_heatstatus, threshold1...) and on the page.
+#    IR, flow and thermistor GPIOs: the mux select lines that switch each of its sensors onto the ADC.
+#    light and heater GPIOs: its In Use output and its inline heater.
+#    threshold: default HOT threshold in degrees, until someone moves its slider.
+#    calibration: None, or {"ir"/"flow"/"temp": spec} in the CALIBRATION_FILE format (see calibrate.py) for this shower's sensors. CALIBRATION_FILE still wins.
+SHOWERS = (
+    #name, IR, flow, temp, light, heater, threshold, calibration
+    ("1", 10, 12, 14, 6, 8, 25, None),
+    ("2", 11, 13, 15, 7, 9, 25, None),
+)
+SH_NAME, SH_MUX, SH_LIGHT, SH_HEATER, SH_THRESHOLD, SH_CALIBRATION = 0, 1, 4, 5, 6, 7 #Field positions. The sensor of kind K is at SH_MUX + K.
+SHOWER_COUNT = len(SHOWERS)
+SHOWER_NAMES = tuple(shower[SH_NAME] for shower in SHOWERS)
+
+#Sensor kinds, in the order their GPIOs come in a SHOWERS record. adcSampler's channel for kind K on shower S is K*SHOWER_COUNT + S, so each
+#kind is one contiguous run of channels and pollSensors(K) is a single loop over it.
+SENSOR_KINDS = (
+    #CALIBRATION_FILE prefix, table scale, poll period
+    ("ir", 1, IR_PERIOD_MS), #Raw counts. Maya's.
+    ("flow", 100, FLOW_PERIOD_MS), #Hundredths of a L/min. Esme's.
+    ("temp", 100, TEMP_PERIOD_MS), #Hundredths of a degree. Seb's.
+)
+KIND_IR, KIND_FLOW, KIND_TEMP = range(3)
+IR_BASE, FLOW_BASE, TEMP_BASE = KIND_IR*SHOWER_COUNT, KIND_FLOW*SHOWER_COUNT, KIND_TEMP*SHOWER_COUNT #First channel of each kind.
+CHANNEL_NAMES = tuple(kind[0] + SHOWERS[i % SHOWER_COUNT][SH_NAME] for kind in SENSOR_KINDS for i in range(SHOWER_COUNT)) #ir1, ir2, ..., flow1, ... in channel order. These are the keys in CALIBRATION_FILE.
+CHANNEL_SCALES = tuple(kind[1] for kind in SENSOR_KINDS for i in range(SHOWER_COUNT)) #Each table stores value*scale as an int.
+SENSOR_GROUPS = tuple(range(k*SHOWER_COUNT, (k + 1)*SHOWER_COUNT) for k in range(len(SENSOR_KINDS))) #The adcSampler channels behind each pollSensors() ID, which is the kind.
+
+#Dual core. With DUAL_CORE on (and a build with _thread), core 1 runs the sensors, heaters and history in core1_main() and core 0 just does the
+#network. Off, or without _thread, everything stays on core 0 with the sensors on sensorScheduler's timer.
+DUAL_CORE = True
+CORE1_STALL_MS = 3000 #If core 1 hasn't published anything for this long, core 0 stops feeding the watchdog and lets it reset us.
+STATE_FORMAT = "<" + "h"*(2*SHOWER_COUNT) + "B"*(2*SHOWER_COUNT) + "II" #What core 1 publishes for the pages: every shower's temperature, then flow (hundredths), then occupancy, then heater (0/1), then the timestamp and bar graph version.
+ST_TEMP, ST_FLOW, ST_OCC, ST_HEAT, ST_TIMESTAMP, ST_VERSION = 0, SHOWER_COUNT, 2*SHOWER_COUNT, 3*SHOWER_COUNT, 4*SHOWER_COUNT, 4*SHOWER_COUNT + 1 #Field positions in a coreState.read(). Shower S's temperature is at ST_TEMP + S, and so on.
+STATE_LIMIT_LOW = -32768 #Temperatures and flows are pinned to this range before they go into the "h" fields. A shorted or open thermistor can read
+STATE_LIMIT_HIGH = 32767 #well over a thousand degrees through a Steinhart-Hart table, and a failed pack would stop core 1 (or boot-loop us from prime_sensors()). -327.68 or 327.67 means the sensor is off scale.
+
+#Snapshot layout, now that the thresholds are per shower.
+SNAPSHOT_META = "<IHHBB" + "h"*SHOWER_COUNT #timestamp, WEEK_TIMESTEP, RAVG_DEPTH, history typecode, SHOWER_COUNT, then each shower's threshold. (Same size as the old two-shower "<IHHBxhh", whose pad byte reads as a count of 0.)
+
 #Pin configuration
 adcPin = machine.ADC(26)
 obLed = machine.Pin('WL_GPIO0', machine.Pin.OUT)
-actuatorPin = [machine.Pin(i,machine.Pin.OUT) for i in range(6,10)] #6 and 7 will be the presence/absence for the IR sensors, 8 and 9 will be the heating elements. '10' is not actually in this list; it's just there for the range function.
-pinOut = [machine.Pin(i,machine.Pin.OUT) for i in range (10,16)]
+lightPins = [machine.Pin(shower[SH_LIGHT], machine.Pin.OUT) for shower in SHOWERS] #In Use outputs, one per shower.
+heaterPins = [machine.Pin(shower[SH_HEATER], machine.Pin.OUT) for shower in SHOWERS]
+pinOut = [machine.Pin(SHOWERS[channel % SHOWER_COUNT][SH_MUX + channel//SHOWER_COUNT], machine.Pin.OUT) for channel in range(len(CHANNEL_NAMES))] #Mux select lines, in channel order.
+adcSampler = sampler.Sampler(adcPin, pinOut, ADC_BURST, ADC_SETTLE_US, ADC_FILTER) #Channel N is whatever pinOut[N] switches onto the ADC: all the IRs, then all the flows, then all the temperatures.
 
 # Bargraph global variables.
-m_dataRecord = [[0.0 for i in range(WEEK_TIMESTEP)] for j in range(RAVG_DEPTH)] #Bargraph data record. This is the master copy: outer is week number, inner is timestamp number.
+m_history = History(WEEK_TIMESTEP, RAVG_DEPTH, HISTORY_TYPECODE, HISTORY_SCALE) #Bargraph data record. This is the master copy: one flat ring buffer holding RAVG_DEPTH weeks of WEEK_TIMESTEP samples. See history.py.
 timestamp = 0 #Integer tracking the current timestep in the week, ranging from 0 to TOTAL_TIME-1.
-m_irStatus = [0,0] #Gives the current TRUE/FALSE status of whether the IR sensor is detecting anyone.
-m_bargraph = [0.0 for i in range(WEEK_TIMESTEP)] #Bargraph output
+m_irStatus = bytearray(SHOWER_COUNT) #Gives the current 1/0 status of whether each shower's IR sensor is detecting anyone.
+m_bargraph = zeros('f', WEEK_TIMESTEP) #Bargraph output: the rolling average for each timestep of the week.
+m_bargraph_version = 0 #Bumped every time a value in m_bargraph actually changes, so the web page knows when its cached copy is stale.
+m_daystats = DayStats(COARSE_TIMESTEP, FINE_TIMESTEP) #Each day's min/max/mean temperature (hundredths) and water use, for the text under the bar graph.
+m_rollup = rollup.Rollup(ROLLUP_TIERS, len(HISTORY_SERIES)) #Every hardware loop's temperature, flow and occupancy, for /api/history.
+rollup_sample = zeros('l', len(HISTORY_SERIES)) #Filled in place by picoHardwareLoop() for m_rollup.record().
+m_accounting = accounting.Accounting(SHOWER_COUNT, COARSE_TIMESTEP, SESSION_LOG_SIZE, 100, HARDWARE_PERIOD_MS, SESSION_MIN_MS) #Litres, shower time and heater time per shower, per session and per day. Flow is in hundredths of a L/min.
 
 #Esme's results
-e_flowrate = [0.0,0.0] #records the values detected by both photoresistors
-shower1_status = "Off"
-shower2_status = "Off"
+e_flowrate = zeros('l', SHOWER_COUNT) #Each shower's flow rate, averaged over the last hardware loop, in hundredths of a L/min.
 
 #sebastian's results
-s_Temperature = [0.0,0.0] #records the current temperature at thermistor 1 and 2
+s_Temperature = zeros('l', SHOWER_COUNT) #The current temperature at each shower's thermistor, in hundredths of a degree.
+heaterControl = control.HeaterControl(SHOWER_COUNT, HEATER_BAND, HEATER_MIN_SWITCH_MS, HEATER_KP, HEATER_KI, HEATER_KD, HEATER_WINDOW_MS)
+heaterOn = heaterControl.on #1 while a shower's heater is switched on.
+m_predictor = control.Predictor(SHOWER_COUNT, WEEK_TIMESTEP, RAVG_DEPTH, PREHEAT_LEAD_SLOTS, PREHEAT_PROBABILITY) #How likely each shower is to be in use in each slot of the week, for pre-heating.
+shower_temp_threshold = [shower[SH_THRESHOLD] for shower in SHOWERS] #HOT thresholds in whole degrees, set from the sliders.
 
 #Maya's functions
     
 shutdown = False
 
-def m_IRsensor(m_irID):
-    adcValue = 2**16 - adcPin.read_u16() #Invert the ADC value, since HIGH = no detection and LOW = detection.
-    if(m_irStatus[m_irID]==0): #hysteresis to prevent flickering value near a single threshold.
-        m_irStatus[m_irID] = (adcValue>IR_THRESHOLD_HIGH)
-    elif(m_irStatus[m_irID]==1):
-        m_irStatus[m_irID] = (adcValue>IR_THRESHOLD_LOW)
-    if(m_irStatus[m_irID]): #Update the status of the corresponding actuator pin.
-        actuatorPin[m_irID].on()
-    else:
-        actuatorPin[m_irID].off()
-
-def m_minmax(data): #Simple function that computes the minimum and maximum of the data passed by m_peak_day().
-    output = [0.0,0,float(COEFFICIENT),0]
-    for i in range(len(data)):
-        c = data[i]
-        if(c>output[0]):
-            output[0]=c
-            output[1]=i
-        elif(c<output[2]):
-            output[2]=c
-            output[3]=i
-    return output
+IR_THRESHOLDS = (IR_THRESHOLD_HIGH, IR_THRESHOLD_LOW) #Indexed by the current status: hysteresis to prevent flickering value near a single threshold.
+
+def m_IRsensor(m_irID, adcValue): #adcValue is the calibrated reading, which is already inverted (HIGH = detection).
+    m_irStatus[m_irID] = adcValue > IR_THRESHOLDS[m_irStatus[m_irID]]
+    lightPins[m_irID].value(m_irStatus[m_irID]) #Update the status of the corresponding actuator pin.
 
 def m_bars_day(m_day_response): #Writes the bars for a single day as HTML.
     bars = []
@@ -82,34 +186,28 @@ def m_bars_day(m_day_response): #Writes the bars for a single day as HTML.
     bars.append("</td>")
     return "".join(bars)
 
-def m_peak_day(m_day_response): #Assembles the min/max into HTML. 
-    data_txt = []
-    data_txt.append("""<td>""")
-    data = m_day_response
-    data_minmax = m_minmax(data)
-    #data_minmax = [max(data),max(range(len(data)), key=data.__getitem__),min(data),min(range(len(data)), key=data.__getitem__)] #Might need to alter this since this seems to think lists can't use __getitem__
-    #data_flow = data[1]%13+2 # Need to be able to pull out the flow rate and attendance data from Esme's results and mine.
-    #data_attendance = data[1]%31+7
-    snip = """Max Temp: {max} ({tmax}:00)<br>Min Temp: {min} ({tmin}:00)""".format(max=data_minmax[0],tmax=data_minmax[1],min=data_minmax[2],tmin=data_minmax[3])
-    data_txt.append(snip)
-    data_txt.append("""</td>""")
-    return "".join(data_txt)
+def day_usage(day): #(shower-minutes, litres) so far on a day, every shower together, from m_accounting. Whole numbers, as the page shows them.
+    return m_accounting.day_total(m_accounting.day_occupied_ms, day)//60000, m_accounting.day_total(m_accounting.day_ml, day)//1000
+
+def m_peak_day(day): #Assembles the day's min/max and water use into HTML. These are kept up as samples come in (m_daystats and m_accounting), so there's no rescanning here.
+    stats = m_daystats
+    if not stats.counts[day]:
+        return """<td>No data yet</td>"""
+    minutes, litres = day_usage(day)
+    snip = """Max Temp: {max} ({tmax}:00)<br>Min Temp: {min} ({tmin}:00)<br>Use: {minutes} min, {litres} L""".format(max=stats.maxs[day]/100,tmax=stats.argmax[day],min=stats.mins[day]/100,tmin=stats.argmin[day],minutes=minutes,litres=litres)
+    return """<td>""" + snip + """</td>"""
 
 
 
 #Esme functions
         
-def get_resistance(): 
-#function to get resistance value from photoresistor
-    resistance_val = (adcPin.read_u16()) 
-    return resistance_val
 def flow_rate(resistance_val): 
-#function that calculates the flow rate of the water in L/min based on the resistance found by the get_resistance function	
+#function that calculates the flow rate of the water in L/min based on the photoresistor reading. Only called at boot now, to build the flow channels' calibration tables.	
     water_flow = (resistance_val*MAX_RATE)/(2**16) 
     return water_flow
-def heater_status(shower1_status, shower2_status):
-#function to determine whether the heater is on or off 
-    if shower1_status == "On" or shower2_status == "On":
+def heater_status(heaters):
+#function to determine whether the heater is on or off. 'heaters' is each shower's heater state, 1 or 0.
+    if any(heaters):
         return "ON"
     else:
         return "OFF"
@@ -121,6 +219,7 @@ def heater_status(shower1_status, shower2_status):
 #Parameters: thermistor_resistance: 16-bit value input. Intended to be sourced from the ADC reading of the thermistor.
 #		     coefficient: Conversion coefficient that dictates what the value the 16-bit input is converted to. May be determined experimentally with a thermometer.
 #Return: Returns the calculated temperature.
+#Only called at boot now, to build the default calibration tables for the thermistors. Put a fitted curve in CALIBRATION_FILE to do better than this.
 
 def Resistance_to_Celsius(thermistor_resistance, coefficient):
     Temperature = thermistor_resistance*coefficient/(2**16)
@@ -128,46 +227,23 @@ def Resistance_to_Celsius(thermistor_resistance, coefficient):
     return Temperature
 
 
-#Function: s_CollectTemperatureData
-#Purpose: Collects the 16-bit value reading from the ADC pin, then calls the Resistance_to_Celsius conversion function and places it inside of the variable "result."
-#Parameters: Takes no parameters.
-#Return: Returns the calculated result, which should be a temperature in celsius. 
-def s_CollectTemperatureData(): 
-    
-    adc = adcPin.read_u16()
-    
-    result = Resistance_to_Celsius(adc,COEFFICIENT)
-    
-    return result
-
-
 #Is there a function to actually encode switching the heating elements off and on? !!!!!!!
 
 #Function: set_heater_status
 #Purpose: Sets the heater status for a given shower to on or off based on the parameters it was passed
-#Parameters: int pindex: GPIO output pin array index number that correlates to a given shower heater
-#             float threshold: The temperature threshold for a shower. Inteneded to correlate to the pin and taken from the UI.
-#             float temperature: The current temperature from a thermometer. Intended to correlate to the above shower. 
-#Return: Returns the string "on" if the temperature is less than the threshold minus two, and off if it is greater than that, or if it is greater than the threshold overall.
-
-def set_heater_status(pindex, threshold, temperature): #Switches the heater status on or off depending on the temperature at the thermistor and the threshold values.
-    status = [shower1_status,m_irStatus[0]] if (pindex == 2) else [shower2_status,m_irStatus[1]]
-    #Checks if pin is on or off. 
-    if(status[1] == 0): return "Off"
-    if(status[0].lower() == "on"):
-        #If on, switches pin off if it is GREATER than the threshold, else stays on and returns on.
-        if(temperature > threshold):
-            actuatorPin[pindex].off()
-            return "Off"
-        else:
-            return "On"
-    else:
-    #If it is off, it switches the pin on if it is LESS than the threshold minus two
-        if(temperature < (threshold - 2)):
-            actuatorPin[pindex].on()
-            return "On"
-        else:
-            return "Off"
+#Parameters: int shower: Index of the shower in SHOWERS, which says which pin is its heater.
+#             int threshold: The temperature threshold for that shower, in whole degrees. Taken from the UI.
+#             int temperature: The current temperature from that shower's thermistor, in hundredths of a degree (so there's no float math on the timer).
+#             int now: utime.ticks_ms(), taken once per controlStep().
+#Return: Returns the string "On" or "Off". The heater is wanted while the shower is occupied, or while m_predictor expects it to be soon (pre-heating), and heaterControl decides from the
+#        temperature whether it's on: by default on below the threshold minus HEATER_BAND and off again above the threshold, switching no more often than HEATER_MIN_SWITCH_MS.
+
+HEATER_NAMES = ("Off", "On")
+
+def set_heater_status(shower, threshold, temperature, now): #Switches the heater status on or off depending on the temperature at the thermistor and the threshold values.
+    on = heaterControl.step(shower, m_irStatus[shower] or m_predictor.preheat[shower], threshold*100, temperature, now) #Updates heaterOn too; it's heaterControl.on.
+    heaterPins[shower].value(on)
+    return HEATER_NAMES[on]
 
 
 
@@ -213,116 +289,287 @@ def vacancy_string(IR_input):
 
 #Main sensor-checking function
 
+@metrics.timed("pollSensors", 1)
 def pollSensors(sensorID):
-    global e_flowrate
-    global s_Temperature
-    #Each sensor check turns on a GPIO for a transistor feeding the ADC. 5us are given as a buffer, the values are read, and then the pin is switched off. This is done once for each sensor.
-    #print(sensorID)
-    if(sensorID == 0): #Maya code!
-        pinOut[0].on()
-        utime.sleep_us(5)
-        m_IRsensor(0)
-        pinOut[0].off()
-        
-        pinOut[1].on()
-        utime.sleep_us(5)
-        m_IRsensor(1)
-        pinOut[1].off()
-    elif(sensorID == 1): #Esme code!
-        pinOut[2].on()
-        utime.sleep_us(5)
-        resistance_val = get_resistance()
-        water_flow = flow_rate(resistance_val)
-        e_flowrate[0]=water_flow
-        pinOut[2].off()
-        
-        pinOut[3].on()
-        utime.sleep_us(5)
-        resistance_val = get_resistance()
-        water_flow = flow_rate(resistance_val)
-        e_flowrate[1]=water_flow
-        pinOut[3].off()
-    elif(sensorID == 2): #Sebastian code!
-        pinOut[4].on() 
-        utime.sleep_us(5)
-        s_Temperature[0] = s_CollectTemperatureData()
-        pinOut[4].off()
-        pinOut[5].on()
-        utime.sleep_us(5)
-        s_Temperature[1] = s_CollectTemperatureData()
-        pinOut[5].off()
+    #Samples one kind of sensor on every shower (see SENSOR_GROUPS) and pushes the calibrated readings into their rings. Runs from the sensor timer, each group at
+    #its own rate. adcSampler switches each transistor on, waits ADC_SETTLE_US, takes ADC_BURST samples, switches it off and filters them, and the
+    #calibration table turns that into real units with an integer lookup.
+    for channel in SENSOR_GROUPS[sensorID]:
+        sensorRings[channel].push(sensorCalibration.convert(channel, adcSampler.read(channel)))
+
+@metrics.timed("controlStep", 1)
+def controlStep(arg): #Updates the IR outputs and the heaters from the newest readings. Runs from the sensor timer every CONTROL_PERIOD_MS, however busy the web server is.
+    rings = sensorRings
+    now = utime.ticks_ms()
+    for shower in range(SHOWER_COUNT): #Same few steps for every shower, so the cost just grows with SHOWER_COUNT.
+        m_IRsensor(shower, rings[IR_BASE + shower].last) #Maya code!
+        s_Temperature[shower] = rings[TEMP_BASE + shower].last #Sebastian code!
+        set_heater_status(shower, shower_temp_threshold[shower], s_Temperature[shower], now) #Updates the heater status.
+
+
+def default_curves(): #Each channel's curve when CALIBRATION_FILE doesn't have one: the shower's own calibration from SHOWERS if it gives one, else the formula above for that kind.
+    kinds = (
+        calibrate.linear(-1, 2**16), #IR: inverted, since HIGH = no detection and LOW = detection.
+        flow_rate,
+        lambda raw: Resistance_to_Celsius(raw, COEFFICIENT),
+    )
+    defaults = []
+    for channel in range(len(CHANNEL_NAMES)):
+        kind = channel//SHOWER_COUNT
+        fn = kinds[kind]
+        specs = SHOWERS[channel % SHOWER_COUNT][SH_CALIBRATION]
+        if specs and SENSOR_KINDS[kind][0] in specs:
+            try:
+                fn = calibrate.from_spec(specs[SENSOR_KINDS[kind][0]])
+            except (ValueError, TypeError, KeyError) as e:
+                log.error("Bad calibration for {} in SHOWERS, using the default: {}", CHANNEL_NAMES[channel], e)
+        defaults.append(fn)
+    return defaults
+
+def load_calibration(): #Builds the per-channel tables: default_curves(), or whatever CALIBRATION_FILE says. A broken file is logged and ignored, not a boot loop.
+    defaults = default_curves()
+    try:
+        return calibrate.build(CHANNEL_NAMES, defaults, CHANNEL_SCALES, CALIBRATION_FILE)
+    except (ValueError, TypeError, KeyError) as e:
+        log.error("Bad {}, using the default calibration: {}", CALIBRATION_FILE, e)
+        return calibrate.build(CHANNEL_NAMES, defaults, CHANNEL_SCALES)
+
+sensorCalibration = load_calibration()
+sensorRings = [scheduler.Ring(RING_SIZE) for name in CHANNEL_NAMES] #Timer side pushes, picoHardwareLoop() drains.
+sensorScheduler = scheduler.Scheduler(SENSOR_TICK_MS)
+for kind in range(len(SENSOR_KINDS)):
+    sensorScheduler.every(SENSOR_KINDS[kind][2], pollSensors, kind)
+sensorScheduler.every(CONTROL_PERIOD_MS, controlStep) #Added last, so on ticks where sensors are due it sees their fresh readings.
+
+coreState = shared.DoubleBuffer(STATE_FORMAT) #Core 1 -> core 0: the readings and m_bargraph_version. get_status() and the /events pushes only ever read this, never the globals behind it.
+#The rest of what core 1 keeps (m_bargraph, m_daystats, m_accounting and m_predictor) is too much to publish every loop. picoHardwareLoop() updates
+#them with historyLock held, and the pages that read them take it just long enough to copy out what they need, never across an await.
+#save_state() copies them under it too, before the slow part. m_rollup is still read live: /api/history awaits partway through, so a
+#reply can have a loop's worth of newer samples in its later part.
+historyLock = shared.allocate_lock()
+dual_core = False #Set by main() once core 1 is actually running.
+
+def prime_sensors(): #Takes a first reading from everything, so the heaters never act on a zero and the pages have something to show.
+    for sensorID in range(len(SENSOR_GROUPS)):
+        pollSensors(sensorID)
+    controlStep(None)
+    publish_state()
+
+def start_sensors(): #Single core: hands the sensors over to the timer.
+    prime_sensors()
+    sensorScheduler.start()
+
+def core1_main(): #Everything on the control side, for core 1: a sensorScheduler tick every SENSOR_TICK_MS and picoHardwareLoop() every HARDWARE_PERIOD_MS, on its own clock.
+    try:
+        next_tick = utime.ticks_ms()
+        next_loop = utime.ticks_add(next_tick, HARDWARE_PERIOD_MS)
+        while not shutdown:
+            sensorScheduler.tick()
+            coreState.swap() #In case the last publish had to wait for a reader.
+            if utime.ticks_diff(utime.ticks_ms(), next_loop) >= 0:
+                picoHardwareLoop()
+                next_loop = utime.ticks_add(next_loop, HARDWARE_PERIOD_MS)
+            next_tick = utime.ticks_add(next_tick, SENSOR_TICK_MS)
+            delay = utime.ticks_diff(next_tick, utime.ticks_ms())
+            if delay < 0: #Fell behind. Resync rather than bursting to catch up.
+                next_tick = utime.ticks_ms()
+                delay = 0
+            utime.sleep_ms(delay)
+    except Exception as e: #Core 0 notices coreState has stopped moving and lets the watchdog reset us.
+        log.error("Core 1 stopped: {!r}", e)
+
+state_values = [0]*(ST_VERSION + 1) #publish_state() fills this in place and hands it to coreState in STATE_FORMAT order.
+
+def publish_state(): #Packs what the pages need into coreState. Called by whichever core runs picoHardwareLoop().
+    values = state_values
+    low = STATE_LIMIT_LOW
+    high = STATE_LIMIT_HIGH
+    for shower in range(SHOWER_COUNT):
+        temperature = s_Temperature[shower]
+        flow = e_flowrate[shower]
+        values[ST_TEMP + shower] = temperature if low <= temperature <= high else (high if temperature > high else low) #Compares rather than min(max()), which is four calls a shower every publish.
+        values[ST_FLOW + shower] = flow if low <= flow <= high else (high if flow > high else low)
+        values[ST_OCC + shower] = m_irStatus[shower]
+        values[ST_HEAT + shower] = heaterOn[shower]
+    values[ST_TIMESTAMP] = timestamp
+    values[ST_VERSION] = m_bargraph_version
+    coreState.publish(*values)
 
 
 #Beginning of core functions.
 
-def picoHardwareLoop(): #Main hardware-based loop that polls the sensors and updates the actuators!! Lehung/Dr. Chelvan look here!
+@metrics.timed("picoHardwareLoop", 0)
+def picoHardwareLoop(): #Main hardware-based loop that collects the sensor readings into the history!! Lehung/Dr. Chelvan look here! The sensors themselves and the heaters are on the timer now (controlStep()).
     #print("Hardware loop!")
-    global adcPin
-    global m_dataRecord
-    global m_bargraph
-    global timestamp
     #global obLed
     #print(".")
-    pollSensors(0) #maya's sensors
-    pollSensors(1) #esme's sensors
-    pollSensors(2) #seb's sensors
-
-    global shower1_status
-    global shower2_status
-    shower1_status = set_heater_status(2, shower_temp_threshold[0], s_Temperature[0]) #Updates the heater status.
-    shower2_status = set_heater_status(3, shower_temp_threshold[1], s_Temperature[1])
+    #Average whatever the timer has collected since last time. If a ring is empty (say the timer hasn't run yet) we keep its newest reading.
+    temperature = 0
+    for shower in range(SHOWER_COUNT):
+        ring = sensorRings[FLOW_BASE + shower]
+        e_flowrate[shower] = ring.drain_mean(ring.last) #Esme code!
+        ring = sensorRings[TEMP_BASE + shower]
+        temperature += ring.drain_mean(ring.last)
+        sensorRings[IR_BASE + shower].drain_mean(0) #The IR rings are only there for controlStep(); empty them so they don't just sit full.
+    rollup_sample[0] = (temperature + SHOWER_COUNT//2)//SHOWER_COUNT #Hundredths, like the temperature tables.
+    rollup_sample[1] = sum(e_flowrate)
+    rollup_sample[2] = sum(m_irStatus)*100
+    m_rollup.record(rollup_sample)
+    historyLock.acquire() #Core 0 only ever holds it for a copy, so this is never a long wait.
+    try:
+        updateHistory(rollup_sample[0], temperature)
+    finally:
+        historyLock.release()
+    publish_state() #Hand the results over to the web side. publish_status() then tells any dashboards on /events, from core 0.
+
+def updateHistory(average, temperature): #picoHardwareLoop()'s part that core 0's pages read: the accounting, day stats, bar graph and predictor. Runs with historyLock held.
+    global m_bargraph
+    global timestamp
+    global m_bargraph_version
+    day = (timestamp % WEEK_TIMESTEP)//FINE_TIMESTEP
+    usage = day_usage(day)
+    m_accounting.sample(day, m_irStatus, e_flowrate, heaterOn)
+    if m_daystats.record(timestamp, average) or day_usage(day) != usage:
+        m_bargraph_version += 1 #The text row changed.
+    temperature = temperature/(SHOWER_COUNT*SENSOR_KINDS[KIND_TEMP][1]) #The average over every shower, in degrees.
     
-    #Update the bar-graph record with the current average temperature.
-    m_dataRecord[timestamp//WEEK_TIMESTEP][timestamp%WEEK_TIMESTEP] = (s_Temperature[0] + s_Temperature[1])/2
-    #Calculate the rolling average for the current time ID only. Other values don't need to be recalculated.
-    m_ravg = 0.0
-    for i in range(RAVG_DEPTH):
-        m_ravg += m_dataRecord[i][timestamp%WEEK_TIMESTEP]
-    m_bargraph[timestamp%WEEK_TIMESTEP] = m_ravg/RAVG_DEPTH
+    #Update the bar-graph record with the current average temperature. The history keeps a running sum per timestep, so this also hands back the new rolling average for the current time ID without re-adding every week.
+    m_ravg = m_history.record(timestamp, temperature)
+    m_predictor.record(timestamp, m_irStatus)
+    m_old = m_bargraph[timestamp%WEEK_TIMESTEP]
+    m_bargraph[timestamp%WEEK_TIMESTEP] = m_ravg
+    if(m_bargraph[timestamp%WEEK_TIMESTEP] != m_old): #Compared after storing, since the array rounds to 32-bit floats.
+        m_bargraph_version += 1
     timestamp += 1
     
     if(timestamp>=TOTAL_TIME):
-        print(m_dataRecord)
+        log.info("History wrapped after {} samples", TOTAL_TIME) #This used to dump the whole record to serial every time. The data's in the snapshots if you need it.
         timestamp = 0
-    
-    #PLACEHOLDER: Update actuators
-        
-    #PLACEHOLDER: Push results to webpage-exposed API. Note: This might not be necessary; since it's running in a separate thread, the results can be dynamically accessed so long as they're global variables.
-    
+    m_predictor.update(timestamp) #Pre-heat for the slots coming up. The heaters act on it from controlStep().
+
+#Live status push (Server-Sent Events). Each open dashboard keeps one /events connection and gets a frame whenever the status changes, instead of opening a new connection every second to poll /status.
+MAX_EVENT_CLIENTS = 4 #Each one holds a socket open, and the Pico doesn't have many to spare. Anyone past this gets told to fall back to polling.
+EVENT_KEEPALIVE = 15 #Seconds between comment lines on an idle stream, so dead clients get noticed and proxies don't time us out.
+status_version = 0 #Bumped by refresh_status() whenever any of the pushed values change. Every cached form of the status (JSON, SSE frame, binary) is keyed on it.
+m_lastStatus = None #coreState's values (up to ST_TIMESTAMP) as of the last change.
+m_state_seq = -1 #coreState.seq when we last looked, so an unchanged snapshot doesn't even get unpacked.
+event_clients = [] #One asyncio.Event per connected /events client.
+m_frame_cache = b"" #The last SSE frame, shared by every client so the JSON is only built once per change.
+m_frame_version = -1
+
+def refresh_status(): #Checks coreState for anything new. If any of the pushed values have moved, bumps status_version. Returns status_version.
+    global status_version, m_lastStatus, m_state_seq
+    if coreState.seq == m_state_seq:
+        return status_version
+    m_state_seq = coreState.seq
+    current = coreState.read()[:ST_TIMESTAMP]
+    if current != m_lastStatus:
+        m_lastStatus = current
+        status_version += 1
+    return status_version
+
+def publish_status(): #Called by hardware_task() every period. If the temperatures, occupancy, heater status or flow have changed, wakes every /events client.
+    before = status_version
+    if refresh_status() == before:
+        return
+    for flag in event_clients:
+        flag.set()
+
+def status_frame(): #Builds the SSE frame for the current status, at most once per status_version.
+    global m_frame_cache, m_frame_version
+    version = refresh_status()
+    if m_frame_version != version:
+        m_frame_cache = b"data: " + get_status_bytes() + b"\n\n"
+        m_frame_version = version
+    return m_frame_cache
+
+@httpd.route("GET", "/events")
+async def send_events(request, writer, params): #Holds an /events connection open and streams a status frame every time publish_status() says something changed.
+    request["keep_alive"] = False #The stream only ends when the client goes away, so there's nothing left to reuse.
+    if len(event_clients) >= MAX_EVENT_CLIENTS:
+        await httpd.send_response(writer, "503 Service Unavailable", "text/plain", (), 0, ("Connection: close", "Retry-After: 30"))
+        return
+    flag = asyncio.Event()
+    event_clients.append(flag)
+    try:
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n\r\n")
+        seen = -1
+        while not shutdown:
+            if seen != status_version:
+                seen = status_version
+                writer.write(status_frame())
+                await writer.drain()
+            try:
+                await asyncio.wait_for(flag.wait(), EVENT_KEEPALIVE)
+            except asyncio.TimeoutError:
+                writer.write(b": ping\n\n")
+                await writer.drain()
+            flag.clear()
+    finally:
+        event_clients.remove(flag)
+
 def get_status(): #Intakes the status of things we want to push to the webpage as a dictionary and then returns it as a json to be pushed. This is the main Pico -> Webpage 'API'; everything we want to automatically update without refreshing the page should be recorded here and updated by JS inside the webpage.
-    avg_temp = (s_Temperature[0] + s_Temperature[1])/2
-    heater_check = heater_status(shower1_status, shower2_status)
-    num_showers = (m_irStatus[0] + m_irStatus[1])
-    flow = (e_flowrate[0] + e_flowrate[1])
-    shower_occupency[0] = "Vacant" if m_irStatus[0] == 0 else "Occupied"
-    shower_occupency[1] = "Vacant" if m_irStatus[1] == 0 else "Occupied"
+    #The JSON is cached and only rebuilt when refresh_status() says the values have changed; most calls just hand back the last string.
+    global m_status_json, m_status_bytes, m_json_version
+    version = refresh_status()
+    if m_json_version == version:
+        return m_status_json
+    state = m_lastStatus #Everything from one consistent snapshot, however far core 1 has got since.
     status = {
-        "temp1": s_Temperature[0],
-        "temp2": s_Temperature[1],
-        "avg_temp": avg_temp,
-        "heater_check": heater_check,
-        "num_showers": num_showers,
-        "flow": flow,
-        "shower_occ0" : shower_occupency[0],
-        "shower_occ1" : shower_occupency[1],
-        "sh1_heatstatus" : shower1_status,
-        "sh2_heatstatus" : shower2_status
+        "avg_temp": sum(state[ST_TEMP:ST_FLOW])/(100*SHOWER_COUNT),
+        "heater_check": heater_status(state[ST_HEAT:ST_TIMESTAMP]),
+        "num_showers": sum(state[ST_OCC:ST_HEAT]),
+        "flow": sum(state[ST_FLOW:ST_OCC])/100,
     }
-    return json.dumps(status)
-
-def web_page(m_data):#Generates the webpage payload. I separated out the style, script, and main body of the HTML into separate strings so we could work with them more easily.
-    bar_width = 8
-    m_bars_data = []
-    m_text_data = []
-    for i in range(COARSE_TIMESTEP): #Counts off each day, from 0 to 6.
-        dayslice = [m_data[j] for j in range(i*FINE_TIMESTEP,(i+1)*FINE_TIMESTEP)]
-        print("Printing bars,", dayslice)
-        m_bars_data.append(m_bars_day(dayslice)) #These need to pass m_bars_day and m_peak_day the relevant data from m_bargraph.
-        m_text_data.append(m_peak_day(dayslice))
-    m_bars_data = "\n".join(m_bars_data) #Terminates the end with a newline.
-    m_text_data = "\n".join(m_text_data)
-    
-    styleblock = """
+    for shower in range(SHOWER_COUNT): #One set of keys per shower; see STATUS_KEYS.
+        temp_key, occ_key, heat_key = STATUS_KEYS[shower]
+        status[temp_key] = state[ST_TEMP + shower]/100
+        status[occ_key] = OCCUPANCY_NAMES[state[ST_OCC + shower]]
+        status[heat_key] = HEATER_NAMES[state[ST_HEAT + shower]]
+    m_status_json = json.dumps(status)
+    m_status_bytes = m_status_json.encode("UTF-8")
+    m_json_version = version
+    return m_status_json
+
+m_status_json = ""
+m_status_bytes = b""
+m_json_version = -1
+STATUS_KEYS = tuple(("temp" + shower[SH_NAME], "shower_occ{}".format(i), "sh{}_heatstatus".format(shower[SH_NAME])) for i, shower in enumerate(SHOWERS)) #Each shower's keys in the status JSON, which are also the ids of its elements on the page. Occupancy has always been numbered from 0, the others by name.
+OCCUPANCY_NAMES = ("Vacant", "Occupied")
+
+def get_status_bytes(): #get_status() already encoded, for sending.
+    get_status()
+    return m_status_bytes
+
+#Binary status, for clients that poll a lot. Fixed layout, packed in place into one buffer, and only re-packed when the values change.
+STATUS_BIN_HEADER = "<BBI" #Layout version, number of showers, status_version. Little-endian, like everything after it. decodeStatus() in SCRIPT_BLOCK has to match.
+STATUS_BIN_SHOWER = "<hHB" #Then one of these per shower, in SHOWERS order: temperature (hundredths of a degree; -32768 or 32767 means the sensor is off scale, see STATE_LIMIT_LOW), flow (hundredths of a L/min, 0..65535), flags (bit 0: occupied, bit 1: heater on).
+STATUS_BIN_VERSION = 2 #Bump if the layout changes. 1 was the fixed two-shower one.
+STATUS_BIN_HEADER_SIZE = struct.calcsize(STATUS_BIN_HEADER)
+STATUS_BIN_SHOWER_SIZE = struct.calcsize(STATUS_BIN_SHOWER)
+status_bin_buf = bytearray(STATUS_BIN_HEADER_SIZE + STATUS_BIN_SHOWER_SIZE*SHOWER_COUNT) #6 + 5 bytes a shower.
+STATUS_BIN_BODY = (status_bin_buf,) #Made once, so sending doesn't even build the tuple.
+STATUS_BIN_HEADERS = ("Cache-Control: no-store",)
+m_bin_version = -1
+
+def status_bin(): #Packs the status into status_bin_buf if it's changed since last time, and returns the buffer.
+    global m_bin_version
+    version = refresh_status()
+    if m_bin_version != version:
+        state = m_lastStatus
+        struct.pack_into(STATUS_BIN_HEADER, status_bin_buf, 0, STATUS_BIN_VERSION, SHOWER_COUNT, version & 0xffffffff)
+        offset = STATUS_BIN_HEADER_SIZE
+        for shower in range(SHOWER_COUNT):
+            flow = state[ST_FLOW + shower] #Already pinned to an int16 by coreState, like the temperature, so only a negative one won't fit "H".
+            struct.pack_into(STATUS_BIN_SHOWER, status_bin_buf, offset, state[ST_TEMP + shower], flow if flow > 0 else 0,
+                state[ST_OCC + shower] | (state[ST_HEAT + shower] << 1))
+            offset += STATUS_BIN_SHOWER_SIZE
+        m_bin_version = version
+    return status_bin_buf
+
+#The dashboard is split into the static assets (style and script, served gzipped from /app.css and /app.js), the layout, and the bar graph, which only changes when m_bargraph does.
+#The layout and assets are prepared once at startup by build_page_shell(), and the page is cached as bytes by web_page() until the bar graph moves again.
+STYLE_BLOCK = """
         .barbox { /*Generic centering class for non-graphic elements of the graph section*/
             text-align: center;
             vertical-align: middle;
@@ -355,83 +602,107 @@ def web_page(m_data):#Generates the webpage payload. I separated out the style,
         }
     """
 
-    scriptblock = """
+SCRIPT_BLOCK = """
         function decTruncate(v) { /*Apparently this is the best way to round to two decimal places using Javascript. I know! Weird language.*/
             return Math.round(v*100)/100;
         }
-        function updateStatus() {
-            fetch("/status", {
-                method: "GET",
-                headers: {
-                    "Accept": "application/json"
+        function decodeStatus(buffer) { //Unpacks /status.bin (STATUS_BIN_HEADER/STATUS_BIN_SHOWER in main.py) into the same object /status gives.
+            var view = new DataView(buffer);
+            var count = view.getUint8(1);
+            var data = {seq: view.getUint32(2, true)};
+            var temps = 0, flow = 0, occupied = 0, heating = 0;
+            for (var i = 0; i < count; i++) {
+                var at = 6 + 5*i, name = SHOWER_NAMES[i];
+                var temp = view.getInt16(at, true)/100; //-327.68 or 327.67 is the sentinel for an off-scale sensor (shorted or open thermistor), not a real temperature.
+                var flags = view.getUint8(at + 4);
+                data["temp" + name] = temp;
+                data["shower_occ" + i] = (flags & 1) ? "Occupied" : "Vacant";
+                data["sh" + name + "_heatstatus"] = (flags & 2) ? "On" : "Off";
+                temps += temp;
+                flow += view.getUint16(at + 2, true);
+                occupied += flags & 1;
+                heating |= flags & 2;
+            }
+            data.avg_temp = count ? temps/count : 0;
+            data.heater_check = heating ? "ON" : "OFF";
+            data.num_showers = occupied;
+            data.flow = flow/100;
+            return data;
+        }
+        function updateStatus() { //Polls the small binary status rather than the JSON one.
+            fetch("/status.bin")
+            .then((response) => response.ok ? response.arrayBuffer() : Promise.reject(response))
+            .then((buffer) => applyStatus(decodeStatus(buffer)));
+        }
+        function applyStatus(data) { /*This bit of the JS updates all of the values we want to have auto-update on the page! This doesn't include the bar graphs; they can't be auto-regenerated but record very long-term data anyway, so the bar graphs auto-updating would be sort of pointless strain on the connection.*/
+            for (var key in data) { //Every status key is the id of the element that shows it, however many showers there are.
+                var element = document.getElementById(key);
+                if (element) {
+                    element.innerText = (typeof data[key] == "number") ? decTruncate(data[key]) : data[key];
                 }
-            })
-            .then((response) => response.ok ? response.json() : Promise.reject(response))
-            .then((data) => {
-                document.getElementById("temp1").innerText = decTruncate(data.temp1); /*This bit of the JS updates all of the values we want to have auto-update on the page! This doesn't include the bar graphs; they can't be auto-regenerated but record very long-term data anyway, so the bar graphs auto-updating would be sort of pointless strain on the connection.*/
-                document.getElementById("temp2").innerText = decTruncate(data.temp2);
-                document.getElementById("avg_temp").innerText = decTruncate(data.avg_temp);
-                document.getElementById("heater_check").innerText = data.heater_check;
-                document.getElementById("num_showers").innerText = data.num_showers;
-                document.getElementById("flow").innerText = decTruncate(data.flow);
-                document.getElementById("shower_occ0").innerText = data.shower_occ0;
-                document.getElementById("shower_occ1").innerText = data.shower_occ1;
-                document.getElementById("sh1_heatstatus").innerText = data.sh1_heatstatus;
-                document.getElementById("sh2_heatstatus").innerText = data.sh2_heatstatus;
-            });
+            }
         }
-        setInterval(updateStatus, 1000); // Refresh every 1 second
-
-        const queryParams = window.location.search;
-        const URLParams = new URLSearchParams(window.location.search);
-        var slider = document.getElementById("threshold1");
-        var output = document.getElementById("value1");
-        var slider2 = document.getElementById("threshold2");
-        var output2 = document.getElementById("value2");
-        slider.value = URLParams.get('threshold1');
-        slider2.value = URLParams.get('threshold2');
-
-        //For Updating the URL with query parameters:
-        function updateURL(){
-            var slidervalue1 = document.getElementById("threshold1").value; //These get the threshold values.
-            var slidervalue2 = document.getElementById("threshold2").value;
-
-            var baseUrl = window.location.href.split('?')[0]; //This stores the current URL
-            var newUrl = baseUrl + "?threshold1=" + encodeURIComponent(slidervalue1) + "&threshold2=" + encodeURIComponent(slidervalue2); //This attaches the threshold values to a new URL
-
-            
-            //This updates the URL at the top
-            //Maya's note: it updates the URL but didn't actually push the results to the server; for now I'll use replace() to ensure it gets pushed, and I'll try to find a less clunky way to implement it after, if there's time.
-            //window.history.pushState({ path: newUrl }, '', newUrl);
-            window.location.replace(newUrl);
-
+        var statusPoller = null;
+        function startPolling() { //The old way: ask for /status every second. Only used if the browser can't do EventSource, or the Pico turns the stream away, or it won't stay up.
+            if (statusPoller === null) {
+                statusPoller = setInterval(updateStatus, 1000); // Refresh every 1 second
+            }
+        }
+        if (window.EventSource) {
+            var events = new EventSource("/events"); //The Pico pushes a new status down this one connection whenever something changes.
+            var eventFailures = 0; //Errors since the stream last opened. EventSource reconnects by itself after a drop, so one blip shouldn't end it.
+            events.onopen = () => { eventFailures = 0; };
+            events.onmessage = (event) => applyStatus(JSON.parse(event.data));
+            events.onerror = (event) => {
+                updateStatus(); //Catch up on whatever changed while it was down.
+                if (events.readyState === EventSource.CLOSED || ++eventFailures >= 5) { //Turned away (the 503 closes it for good), or it just keeps failing: poll instead.
+                    events.close();
+                    startPolling();
+                }
+            };
+        } else {
+            startPolling();
         }
 
-        //updateURL();
-
-        output.innerHTML = slider.value;
-        output2.innerHTML = slider2.value;
+        var sliders = document.querySelectorAll("input.threshold"); //One per shower. Slider "thresholdN" shows its value in "valueN".
 
-        slider.oninput = function() {
-            output.innerHTML = this.value;
+        function showThresholds(data) { //Puts the thresholds the Pico is actually using onto the sliders.
+            sliders.forEach((slider) => {
+                slider.value = data[slider.id];
+                document.getElementById("value" + slider.dataset.shower).innerHTML = slider.value;
+            });
         }
+        fetch("/api/threshold").then((response) => response.json()).then(showThresholds);
 
-        slider2.oninput = function() {
-            output2.innerHTML = this.value;
+        //Sends a slider's value to the Pico. This used to reload the whole page with the thresholds in the URL; now it's one small POST and the page stays put.
+        function updateThreshold(slider){
+            var body = slider.id + "=" + encodeURIComponent(slider.value);
+            fetch("/api/threshold", {
+                method: "POST",
+                headers: {
+                    "Content-Type": "application/x-www-form-urlencoded"
+                },
+                body: body
+            })
+            .then((response) => response.ok ? response.json() : Promise.reject(response))
+            .then(showThresholds);
         }
 
-        slider.addEventListener("change",(event) => {updateURL();});
-        slider2.addEventListener("change",(event) => {updateURL();});
+        sliders.forEach((slider) => {
+            slider.oninput = function() {
+                document.getElementById("value" + this.dataset.shower).innerHTML = this.value;
+            }
+            slider.addEventListener("change",(event) => {updateThreshold(slider);});
+        });
     """
-    html = """
+
+PAGE_TEMPLATE = """
     <html>
         <head>
             <title>Pico Web Server</title>
             <meta name="viewport" content="width=device-width, initial-scale=1">
             <link rel="icon" href="data:,">
-            <style>
-                {styleblock}
-            </style>
+            <link rel="stylesheet" href="/app.css">
         </head>
         <body>
             <table style="width:50%; text-align: center;"> 
@@ -486,14 +757,27 @@ def web_page(m_data):#Generates the webpage payload. I separated out the style,
                 <h3>The following section is restricted to technicians only:</h3>
                 <!--<center>-->
 
-                <!--Shower 1 info table here.-->  
+                {m_shower_tables}
+                <!--</center>-->
+                <br>
+                <br>
+                <br>
+            </div>
+
+            <script src="/app.js"></script>
+        </body>
+    </html>
+    """
+
+SHOWER_TEMPLATE = """
+                <!--Shower {name} info table here. Filled in by render_shower_tables(), once per shower in SHOWERS; values may vary.-->  
                 <table>
                     <tr>
-                        <th><h3>Shower 01</h3></th>
+                        <th><h3>Shower {label}</h3></th>
                     </tr>
                     <tr>
                         <td>Status:</td>
-                        <td><span id="shower_occ0"></span></td> <!--One of these will be selected depending on the IR status-->  
+                        <td><span id="shower_occ{index}"></span></td> <!--One of these will be selected depending on the IR status-->  
                         <td style="text-align:center;">HOT Threshold</td> 
                     </tr>
                     <tr>
@@ -501,12 +785,12 @@ def web_page(m_data):#Generates the webpage payload. I separated out the style,
                     </tr>
                     <tr>
                         <td>Water Temperature:</td>
-                        <td><span id="temp1"></span>&#176;C</td><!--This is where the temperature of the water for the current shower will go-->  
-                        <td><input type="range" min="0" max="50" value="40" class="slider" id="threshold1">10&#176;C <span style="float:right">50&#176;C</span></td>
+                        <td><span id="temp{name}"></span>&#176;C</td><!--This is where the temperature of the water for the current shower will go-->  
+                        <td><input type="range" min="0" max="50" value="40" class="slider threshold" id="threshold{name}" data-shower="{name}">10&#176;C <span style="float:right">50&#176;C</span></td>
                     
-                        <!--Later, this and other sliders like it will relay the selected value back to the pico to change the threshold that enables the inline heating system-->  
+                        <!--This and the other sliders like it relay the selected value back to the pico to change the threshold that enables the inline heating system-->  
                     
-                        <td style="border:1px solid black;"><span id="value1"></span>&#176;C</td> 
+                        <td style="border:1px solid black;"><span id="value{name}"></span>&#176;C</td> 
                     
                     
                     <!--This is where the value of the current HOT threshold for the shower is, based on the slider selection-->
@@ -517,189 +801,464 @@ def web_page(m_data):#Generates the webpage payload. I separated out the style,
                     </tr>
                     <tr>
                         <td>Heater Status:</td>
-                        <td><span id="sh1_heatstatus"></span></td> <!--One of these will be selected based on the heater status, which may be its own variable or extrapolated based on current temperature and threshold. I believe the former is more appropriate-->  
+                        <td><span id="sh{name}_heatstatus"></span></td> <!--One of these will be selected based on the heater status-->  
                     </tr>   
                 </table> 
         
                 <br>
                 <br>
-        
-                <!--Shower 2 info table here. This is indentical to the first shower table, however values may vary.-->  
-                <table>
-                    <tr>
-                        <th><h3>Shower 02</h3></th>
-                    </tr>
-                    <tr>
-                        <td>Status:</td>
-                        <td><span id="shower_occ1"></span></td>
-                        <td style="text-align:center;">HOT Threshold</td>
-                    </tr>
-                    <tr>
-                        <td></td>
-                    </tr>
-                    <tr>
-                        <td>Water Temperature:</td>
-                        <td><span id="temp2"></span>&#176;C</td>
-                        
-                        <td><input type="range" min="0" max="50" value="40" class="slider" id="threshold2">10&#176;C <span style="float:right">50&#176;C</span></td>
-                        
-                        <td style="border:1px solid black;"><span id="value2"></span>&#176;C</td>
-                    </tr>
-                    <tr>
-                        <td></td>
-                    </tr>
-                    <tr>
-                        <td>Heater Status:</td>
-                        <td><span id="sh2_heatstatus"></span></td>
-                    </tr>
-                </table>  
-                <!--</center>-->
-                <br>
-                <br>
-                <br>
-            </div>
-
-            <script>
-                {scriptblock}
-            </script>
-        </body>
-    </html>
-    """.format(styleblock = styleblock, scriptblock = scriptblock, m_bars_data=m_bars_data,m_text_data = m_text_data, bar_width=bar_width)
-    return html
-
-def send_response(conn, headers, body, max_attempts = 10): #A function that handles the apparent inability of the Pico to send the entire webpage in one go. It'll keep track of how much gets sent with each attempt, and keep going until there's no more to push. If it takes too many attempts, it fails.
-    headlen = 0
-    attempts = 0
-    while headlen < len(headers) and attempts < max_attempts:
-        headlen += conn.send(headers[headlen:])
-        print("Sent {}/{} bytes of headers".format(headlen, len(headers)))
-        attempts += 1
-    
-    if headlen < len(headers):
-        raise RuntimeError("Failed to send headers after {} attempts".format(attempts))
-    
-    bodylen = 0
-    attempts = 0
-    while bodylen < len(body) and attempts < max_attempts:
-        bodylen += conn.send(body[bodylen:])
-        print("Sent {}/{} bytes of body".format(bodylen, len(body)))
-        attempts += 1
-        
-    if bodylen < len(body):
-        raise RuntimeError("Failed to send body after {} attempts".format(attempts))
-    
-def process_request(request): #An HTTP header interpreter to route the request based on its path, and to enable us to pull out the query parameters as integers. Returns a 404 if an invalid path is requested.
-    response = ""
-
-    # print(request)
-    global shower_temp_threshold
-    if request["path"] == "/":
-        print("getting webpage")
-        for k, v in request["query"]:
-            if k == "threshold1":
-                shower_temp_threshold[0] = int(v)
-            if k == "threshold2":
-                shower_temp_threshold[1] = int(v)
-        body = web_page(m_bargraph)
-        headers = ["HTTP/1.1 200 OK", "Content-Type: text/html", "Content-Length: {}".format(len(body)), "Connection: close"]
-        response = "\n".join(headers) + "\n\n" + body
-
-    elif request["path"] == "/status":
-        print("getting status")
-        body = get_status()
-        headers = ["HTTP/1.1 200 OK", "application/json", "Content-Length: {}".format(len(body)), "Connection: close"]
-        response = "\n".join(headers) + "\n\n" + body
-    else:
-        response = "HTTP/1.1 404 Not Found\n\n"
-    return response
-
-def respond_request(socket): #Connect to the socket and kick back connection information to the console.
+"""
+
+PAGE_HEAD = b"" #Everything in PAGE_TEMPLATE before the bars. Filled in by build_page_shell().
+PAGE_MID = b"" #Between the bars row and the text row.
+PAGE_TAIL = b"" #Everything after the text row.
+m_page_parts = () #Last rendered page, kept as the list of fragments it's made of so we never have to glue the whole thing into one big string.
+m_page_length = 0 #Total length of m_page_parts, which becomes the Content-Length.
+m_page_version = -1 #The m_bargraph_version that m_page_parts was rendered from. -1 forces the first render.
+
+BOOT_ID = random.getrandbits(16) #Mixed into the page ETag, so a browser can't get a stale 304 after a reset restarts m_bargraph_version from zero.
+STATIC_ASSETS = {} #Path -> (content type, raw bytes, gzipped bytes or None, ETag). Filled in by build_page_shell().
+ASSET_DIR = "static" #Where gzip_bytes() looks for app.css.gz and app.js.gz, made on a PC by 'python -m sim.assets' and copied over with the firmware.
+
+def asset_sources(): #(path, content type, text) for each static asset. The script depends on SHOWERS, so sim/assets.py builds them from here too.
+    script = "var SHOWER_NAMES = " + json.dumps(SHOWER_NAMES) + ";" + SCRIPT_BLOCK #decodeStatus() needs the names to make the same keys as /status.
+    return (("/app.css", "text/css", STYLE_BLOCK), ("/app.js", "application/javascript", script))
+
+def gzip_bytes(data, path):
+    #The gzipped copy of an asset, once at startup. The one from ASSET_DIR if it was made from exactly this data (a gzip file ends with the CRC
+    #and length of what went in), else compressed here if this build can. Most rp2 builds can't, so failing both we warn and return None, and
+    #the asset is served uncompressed.
     try:
-        conn, addr = socket.accept()
-    except OSError as e:
-        if e.errno == 110:
-            return
-        else:
-            raise
-
-    print('Got a connection from {}'.format(addr))
-
+        with open(path, "rb") as f:
+            gz = f.read()
+        if len(gz) > 18 and gz[:2] == b"\x1f\x8b" and struct.unpack("<II", gz[-8:]) == (binascii.crc32(data) & 0xffffffff, len(data) & 0xffffffff):
+            return gz
+        log.warning("{} wasn't made from this firmware's asset; run 'python -m sim.assets' again", path)
+    except OSError: #Not shipped.
+        pass
     try:
-        # Pump bytes from the buffer until we have the whole request (usually just one pass)
-        recv_bufsize = 1024
-        reqdata = b""
-        chunk = conn.recv(recv_bufsize)
-        while chunk:
-            reqdata += chunk
-            if len(chunk) == recv_bufsize:
-                chunk = conn.recv(recv_bufsize)
-            else:
-                chunk = None
-
-        # If the request was empty, just skip it completely
-        if not reqdata:
-            return None
-        
-        # UTF-8 is the accepted language of the web
-        reqdata = reqdata.decode("UTF-8")
-        reqdata = reqdata.replace("\r\n", "\n")
-        
-        # print('Request Content = {}'.format(reqdata))
-
-        # See https://developer.mozilla.org/en-US/docs/Web/HTTP/Messages for information on the HTTP request structure
-        request = {} #Breaks down the contents of request as a dictionary for interpretation, and passes that to process_request above.
-        reqline, _, reqdata = reqdata.partition("\n")
-        reqline = reqline.split(" ")
-        request["method"] = reqline[0]
-        request["fullpath"] = reqline[1]
-        request["path"], _, request["querystr"] = request["fullpath"].partition("?")
-        request["query"] = []
-        if request["querystr"]:
-            for param in request["querystr"].split("&"):
-                k, _, v = param.partition("=")
-                request["query"].append((k, v.strip(" ")))
-        request["protocol"] = reqline[2]
-
-        headerstr, _, request["body"] = reqdata.partition("\n\n")
-
-        request["headers"] = []
-        for line in headerstr.split("\n"):
-            k, _, v = line.partition(":")
-            request["headers"].append((k, v.strip(" ")))
-
+        import deflate
+        import io
+        buf = io.BytesIO()
+        f = deflate.DeflateIO(buf, deflate.GZIP)
+        f.write(data)
+        f.close()
+        return buf.getvalue()
+    except Exception:
+        pass
+    try:
+        import gzip
+        return gzip.compress(data)
+    except Exception:
+        log.warning("No {} and no way to compress here, so it goes out uncompressed", path)
+        return None
+
+def render_shower_tables(): #One SHOWER_TEMPLATE per shower in SHOWERS, with its element ids matching its keys in the status JSON (see STATUS_KEYS).
+    tables = []
+    for index in range(SHOWER_COUNT):
+        name = SHOWERS[index][SH_NAME]
+        tables.append(SHOWER_TEMPLATE.format(name = name, label = "{:0>2}".format(name), index = index))
+    return "".join(tables)
+
+def build_page_shell(): #Prepares the static assets and splits the layout around the two bar graph slots, exactly once.
+    global PAGE_HEAD, PAGE_MID, PAGE_TAIL
+    for path, content_type, text in asset_sources():
+        raw = text.encode("UTF-8")
+        etag = '"{:08x}"'.format(binascii.crc32(raw) & 0xffffffff) #Strong ETag; only changes if we flash new firmware.
+        STATIC_ASSETS[path] = (content_type, raw, gzip_bytes(raw, ASSET_DIR + path + ".gz"), etag)
+        httpd.add_route("GET", path, static_route(STATIC_ASSETS[path]))
+    head, _, rest = PAGE_TEMPLATE.partition("{m_bars_data}")
+    mid, _, tail = rest.partition("{m_text_data}")
+    PAGE_HEAD = head.encode("UTF-8")
+    PAGE_MID = mid.encode("UTF-8")
+    PAGE_TAIL = tail.replace("{m_shower_tables}", render_shower_tables()).encode("UTF-8")
+
+def render_bargraph(m_data, m_text_data): #Generates the two bar graph rows: bars from the bargraph data, and the text under them from each day's m_peak_day().
+    m_bars_data = []
+    for i in range(COARSE_TIMESTEP): #Counts off each day, from 0 to 6.
+        dayslice = m_data[i*FINE_TIMESTEP:(i+1)*FINE_TIMESTEP]
+        m_bars_data.append(m_bars_day(dayslice))
+    m_bars_data = "\n".join(m_bars_data) #Terminates the end with a newline.
+    m_text_data = "\n".join(m_text_data)
+    return m_bars_data.encode("UTF-8"), m_text_data.encode("UTF-8")
+
+@metrics.timed("web_page", 0)
+def web_page(): #Returns the webpage payload as (fragments, total length). Only re-renders the bar graph if m_bargraph has changed since the last call, otherwise it's just the cached bytes.
+    global m_page_parts, m_page_length, m_page_version
+    version = coreState.read()[ST_VERSION]
+    if m_page_version != version:
+        if not PAGE_HEAD:
+            build_page_shell()
+        historyLock.acquire() #Only for the copy and the day texts (a few dozen numbers); the bars are rendered from the copy.
         try:
-            response = process_request(request).encode("UTF-8")
-        except Exception:
-            # Return a 500 code if the request processor encounters an exception
-            response = b"HTTP/1.1 500 Internal Server Error\n\n"
-        sentlen = 0
-        while sentlen < len(response):
-            sentlen += conn.send(response[sentlen:])
-        print("Sent {} bytes response.".format(sentlen))
-    except OSError as e: #If conn.recv times out, ignore it and return to the main loop.
-        if e.errno == 110:
-            return
+            m_data = m_bargraph[:]
+            m_text_data = [m_peak_day(i) for i in range(COARSE_TIMESTEP)]
+        finally:
+            historyLock.release()
+        m_bars_data, m_text_data = render_bargraph(m_data, m_text_data)
+        m_page_parts = (PAGE_HEAD, m_bars_data, PAGE_MID, m_text_data, PAGE_TAIL)
+        m_page_length = len(PAGE_HEAD) + len(m_bars_data) + len(PAGE_MID) + len(m_text_data) + len(PAGE_TAIL)
+        m_page_version = version
+    return m_page_parts, m_page_length
+
+def page_etag(): #ETag for the dashboard page. It only depends on the bar graph version (the layout is fixed), plus BOOT_ID so the tags from before a reset don't match.
+    return '"{:04x}-{}"'.format(BOOT_ID, coreState.read()[ST_VERSION])
+
+async def send_static(request, writer, asset): #Serves one of the STATIC_ASSETS, gzipped if the client can take it, or a 304 if it already has it.
+    content_type, raw, gz, etag = asset
+    if gz is not None and "gzip" in httpd.get_header(request, "Accept-Encoding"):
+        body = gz
+        etag = etag[:-1] + '-gz"' #The gzipped bytes are a different representation, so they need their own strong tag.
+        headers = ("ETag: " + etag, "Content-Encoding: gzip", "Vary: Accept-Encoding", "Cache-Control: no-cache")
+    else:
+        body = raw
+        headers = ("ETag: " + etag, "Vary: Accept-Encoding", "Cache-Control: no-cache")
+    if httpd.etag_matches(request, etag):
+        await httpd.send_not_modified(writer, etag)
+        return
+    await httpd.send_response(writer, "200 OK", content_type, (body,), len(body), headers)
+
+def static_route(asset): #Makes the route handler for one static asset.
+    async def handler(request, writer, params):
+        await send_static(request, writer, asset)
+    return handler
+
+#Routes. Each page or API call registers itself with httpd.route(); see httpd.ROUTES.
+
+@httpd.route("GET", "/")
+async def send_page(request, writer, params):
+    log.debug("getting webpage")
+    etag = page_etag()
+    if httpd.etag_matches(request, etag):
+        await httpd.send_not_modified(writer, etag)
+        return
+    body, length = web_page()
+    await httpd.send_response(writer, "200 OK", "text/html", body, length, ("ETag: " + etag, "Cache-Control: no-cache"))
+
+@httpd.route("GET", "/status")
+async def send_status(request, writer, params):
+    log.debug("getting status")
+    if "application/octet-stream" in httpd.get_header(request, "Accept"): #Same as /status.bin, for clients that would rather ask that way.
+        await send_status_bin(request, writer, params)
+        return
+    body = get_status_bytes()
+    await httpd.send_response(writer, "200 OK", "application/json", (body,), len(body))
+
+@httpd.route("GET", "/status.bin")
+async def send_status_bin(request, writer, params): #The compact status; see STATUS_BIN_HEADER and STATUS_BIN_SHOWER.
+    status_bin()
+    await httpd.send_response(writer, "200 OK", "application/octet-stream", STATUS_BIN_BODY, len(status_bin_buf), STATUS_BIN_HEADERS)
+
+@httpd.route("GET", "/metrics")
+async def send_metrics(request, writer, params): #Prometheus text format. It's only put together here, when something scrapes it; the probes just bump counters.
+    await httpd.send_response(writer, "200 OK", "text/plain; version=0.0.4", metrics.render())
+
+@httpd.route("GET", "/logs")
+async def send_logs(request, writer, params): #The log buffer as it stands, oldest line first. Doesn't count as draining it; the serial port still gets everything.
+    body = log.lines()
+    await httpd.send_response(writer, "200 OK", "text/plain", (body,), len(body), ("Cache-Control: no-store",))
+
+HISTORY_PARAMS = (("from", int, None, None, -3600), ("to", int, None, None, -1), ("step", int, 1, None, 60), ("format", str, None, None, "csv")) #Sample numbers; negative ones count back from the newest (-1).
+history_row_buf = bytearray(struct.calcsize(HISTORY_BIN_ROW)) #Reused for every binary row; send_response() has copied each one out before it asks for the next.
+history_values = zeros('l', 3*len(HISTORY_SERIES)) #One point's [min, max, mean] per series, from m_rollup.merge().
+
+def history_rows(plan, binary): #Generates an /api/history body a row at a time, so a long span never has to exist as one string.
+    #Core 1 may record into m_rollup while this runs, which at worst makes the newest point one sample out of date.
+    newest = m_rollup.count - 1
+    if plan is None:
+        tier, first, step, points = None, 0, 0, 0
+    else:
+        tier, first, step, points = plan
+    if binary:
+        yield struct.pack(HISTORY_BIN_HEADER, HISTORY_BIN_VERSION, len(HISTORY_SERIES), HARDWARE_PERIOD_MS, max(newest, 0), first, step, points)
+    else:
+        columns = ["sample"]
+        for name in HISTORY_SERIES:
+            columns.extend((name + "_min", name + "_max", name + "_mean"))
+        yield (",".join(columns) + "\n").encode("UTF-8")
+    values = history_values
+    for point in range(points):
+        sample = first + point*step
+        found = m_rollup.merge(tier, sample, step, values)
+        if binary:
+            struct.pack_into(HISTORY_BIN_ROW, history_row_buf, 0, *values)
+            yield history_row_buf
+        elif found:
+            yield (str(sample) + "," + ",".join([str(v/100) for v in values]) + "\n").encode("UTF-8")
         else:
-            raise
+            yield (str(sample) + "," * len(values) + "\n").encode("UTF-8")
+
+@httpd.route("GET", "/api/history", HISTORY_PARAMS)
+async def send_history(request, writer, params):
+    #Temperature, flow and occupancy between samples 'from' and 'to' (one per HARDWARE_PERIOD_MS), each point the min/max/mean of about 'step' samples.
+    #As CSV, or binary (see HISTORY_BIN_HEADER) with format=bin or an octet-stream Accept header. The step is rounded up to whole buckets of
+    #whichever rollup tier answers it, and raised if the span would take more than HISTORY_MAX_POINTS; the first column (or the binary header) says what you got.
+    plan = m_rollup.plan(params["from"], params["to"], params["step"], HISTORY_MAX_POINTS)
+    binary = params["format"] == "bin" or "application/octet-stream" in httpd.get_header(request, "Accept")
+    headers = ("Cache-Control: no-store", "X-Sample-Period-Ms: {}".format(HARDWARE_PERIOD_MS), "X-Newest-Sample: {}".format(m_rollup.count - 1))
+    await httpd.send_response(writer, "200 OK", "application/octet-stream" if binary else "text/csv", history_rows(plan, binary), None, headers)
+
+@httpd.route("GET", "/api/days")
+async def send_days(request, writer, params): #m_daystats for each day of the bar graph, in the same order: temperatures in degrees (None until the day has a sample), slot of the min/max, shower-minutes and litres.
+    stats = m_daystats
+    days = []
+    historyLock.acquire()
+    try:
+        for day in range(COARSE_TIMESTEP):
+            n = stats.counts[day]
+            minutes, litres = day_usage(day)
+            days.append({
+                "samples": n,
+                "min": stats.mins[day]/100 if n else None,
+                "max": stats.maxs[day]/100 if n else None,
+                "mean": stats.mean(day)/100 if n else None,
+                "argmin": stats.argmin[day],
+                "argmax": stats.argmax[day],
+                "minutes": minutes,
+                "litres": litres,
+            })
     finally:
-        conn.close()
-    return
-    
-    
-#Seb's new global variables:
-threshold_q_start_indi = ["?","&"] #index 0 for shower 1, index 1 for shower 2
-shower_temp_threshold = [25,25]
-shower_actuator_pindex = [actuatorPin[2],actuatorPin[3]]
-shower_occupency = ["Vacant", "Vacant"]
-shower1_heater_status = "Off"
-shower2_heater_status = "Off"
+        historyLock.release()
+    await httpd.send_json(writer, days)
+
+SESSION_PARAMS = (("limit", int, 1, SESSION_LOG_SIZE, 20), ("shower", str, None, None, None)) #Newest first; 'shower' (a name from SHOWERS) picks out just one.
+
+def session_dict(shower, start, ms, ml, heater_s): #One session as /api/sessions reports it.
+    return {"shower": SHOWER_NAMES[shower], "start": start, "seconds": ms/1000, "litres": ml/1000, "heater_seconds": heater_s}
+
+@httpd.route("GET", "/api/sessions", SESSION_PARAMS)
+async def send_sessions(request, writer, params):
+    #The newest finished sessions from m_accounting's log, plus any that are still going. 'start' is on m_accounting's clock (metered
+    #seconds, which carries on across a reset), and 'clock' says where that clock is now, so clock - start is how long ago it was.
+    acc = m_accounting
+    only = None
+    if "shower" in params:
+        if params["shower"] not in SHOWER_NAMES:
+            raise httpd.RequestError("400 Bad Request", "No shower called {}".format(params["shower"]))
+        only = SHOWER_NAMES.index(params["shower"])
+    sessions = []
+    current = []
+    historyLock.acquire()
+    try:
+        for k in range(acc.count()):
+            if len(sessions) >= params["limit"]:
+                break
+            start, ms, ml, heater_s, shower, day = acc.record(k)
+            if only is None or shower == only:
+                sessions.append(session_dict(shower, start, ms, ml, heater_s))
+        for shower in range(SHOWER_COUNT):
+            if acc.occupied[shower] and (only is None or shower == only):
+                current.append(session_dict(shower, acc.open_start[shower], acc.open_ms[shower], acc.open_ml[shower], acc.open_heater_ms[shower]//1000))
+        clock = acc.clock()
+    finally:
+        historyLock.release()
+    await httpd.send_json(writer, {"clock": clock, "sessions": sessions, "open": current})
+
+@httpd.route("GET", "/api/usage")
+async def send_usage(request, writer, params):
+    #m_accounting's running totals: per shower since the snapshots began, and per shower for each day of the bar graph (in the same order
+    #as /api/days). Each list is in SHOWERS order, as named in "showers".
+    acc = m_accounting
+    days = []
+    historyLock.acquire()
+    try:
+        totals = {
+            "sessions": list(acc.total_sessions),
+            "litres": [ml/1000 for ml in acc.total_ml],
+            "minutes": [s//60 for s in acc.total_occupied_s],
+            "heater_minutes": [s//60 for s in acc.total_heater_s],
+        }
+        for day in range(COARSE_TIMESTEP):
+            row = range(day*SHOWER_COUNT, (day + 1)*SHOWER_COUNT)
+            days.append({
+                "sessions": [acc.day_sessions[i] for i in row],
+                "litres": [acc.day_ml[i]/1000 for i in row],
+                "minutes": [acc.day_occupied_ms[i]//60000 for i in row],
+                "heater_minutes": [acc.day_heater_ms[i]//60000 for i in row],
+            })
+    finally:
+        historyLock.release()
+    await httpd.send_json(writer, {"showers": SHOWER_NAMES, "total": totals, "days": days})
+
+@httpd.route("GET", "/api/control")
+async def send_control(request, writer, params):
+    #What the heaters are doing and why, per shower in SHOWERS order: heater on, pre-heating, heaterControl's duty (permille) and relay switches
+    #so far, and how likely m_predictor reckons each of the next PREHEAT_LEAD_SLOTS slots is to be busy (percent). The duty and switch counts
+    #are controlStep()'s, which doesn't take historyLock; each list is one copy of its array, so it's at worst a step out from the others.
+    state = coreState.read()
+    now = state[ST_TIMESTAMP]
+    historyLock.acquire()
+    try:
+        preheat = list(m_predictor.preheat)
+        outlook = [[m_predictor.probability(shower, slot) for slot in range(now, now + PREHEAT_LEAD_SLOTS)] for shower in range(SHOWER_COUNT)]
+    finally:
+        historyLock.release()
+    reply = {
+        "showers": SHOWER_NAMES,
+        "heater": list(state[ST_HEAT:ST_HEAT + SHOWER_COUNT]),
+        "preheat": preheat,
+        "duty": list(heaterControl.duty),
+        "switches": list(heaterControl.switches),
+        "outlook": outlook,
+    }
+    await httpd.send_json(writer, reply)
+
+THRESHOLD_KEYS = tuple("threshold" + shower[SH_NAME] for shower in SHOWERS) #Also the ids of the sliders.
+THRESHOLD_PARAMS = tuple((key, int, 0, 50, None) for key in THRESHOLD_KEYS) #Same range as the sliders on the page.
+
+def threshold_reply(): #The acknowledgement for the threshold API: just the thresholds as they now stand.
+    reply = {}
+    for shower in range(SHOWER_COUNT):
+        reply[THRESHOLD_KEYS[shower]] = shower_temp_threshold[shower]
+    return reply
+
+@httpd.route("GET", "/api/threshold")
+async def get_threshold(request, writer, params):
+    await httpd.send_json(writer, threshold_reply())
+
+@httpd.route("POST", "/api/threshold", THRESHOLD_PARAMS)
+async def set_threshold(request, writer, params): #Updates any or all of the shower thresholds. Anything out of range is rejected with a 400 before we touch the heaters.
+    for shower in range(SHOWER_COUNT):
+        if THRESHOLD_KEYS[shower] in params:
+            shower_temp_threshold[shower] = params[THRESHOLD_KEYS[shower]]
+    await httpd.send_json(writer, threshold_reply())
+
+#Snapshots. The layout constants go in alongside the data so a snapshot from firmware with a different history size is ignored instead of loaded into the wrong slots.
+snapshot_seq = 0 #Sequence number of the newest snapshot on flash.
+snapshot_busy = False
+snapshot_meta = bytearray(struct.calcsize(SNAPSHOT_META)) #Packed into in place each time, so saving doesn't allocate.
+usage_seq = 0 #Same again for USAGE_FILES...
+occupancy_seq = 0 #...and OCCUPANCY_FILES.
+#What save_state() writes, copied in one go under historyLock, so each snapshot is a single moment of core 1's state even though the writing
+#takes a while. Each one is a slice of the buffer it copies, so it's the same type and size and copy_parts() is a plain slice assignment. About 3 KB.
+history_scratch = [m_history.data[:]]
+usage_scratch = [part[:] for part in m_accounting.buffers()]
+occupancy_scratch = [part[:] for part in m_predictor.buffers()]
+
+def copy_parts(parts, scratch):
+    for i in range(len(parts)):
+        scratch[i][:] = parts[i]
+
+async def save_state(): #Saves the history, timestamp and thresholds to the older of the two snapshot files, then the usage and occupancy to the older of theirs. Runs as its own task, yielding between chunks.
+    global snapshot_seq, snapshot_busy, usage_seq, occupancy_seq
+    snapshot_busy = True
+    try:
+        historyLock.acquire() #Just for the copies. The flash writes come after, from them.
+        try:
+            struct.pack_into(SNAPSHOT_META, snapshot_meta, 0, timestamp, WEEK_TIMESTEP, RAVG_DEPTH, ord(HISTORY_TYPECODE), SHOWER_COUNT, *shower_temp_threshold)
+            copy_parts((m_history.data,), history_scratch)
+            copy_parts(m_accounting.buffers(), usage_scratch)
+            copy_parts(m_predictor.buffers(), occupancy_scratch)
+        finally:
+            historyLock.release()
+        seq = snapshot_seq + 1
+        await snapshot.save(SNAPSHOT_FILES[seq % 2], seq, [snapshot_meta] + history_scratch)
+        snapshot_seq = seq
+        log.info("Saved snapshot {}", seq)
+        seq = usage_seq + 1
+        await snapshot.save(USAGE_FILES[seq % 2], seq, usage_scratch)
+        usage_seq = seq
+        seq = occupancy_seq + 1
+        await snapshot.save(OCCUPANCY_FILES[seq % 2], seq, occupancy_scratch)
+        occupancy_seq = seq
+    except OSError as e: #Flash full or similar. The old snapshot is still there, so just try again next time.
+        log.warning("Snapshot failed: {}", e)
+    finally:
+        snapshot_busy = False
+
+def restore_part(paths, parts, what): #Loads the newest good snapshot out of paths straight into parts, if it's their size. Returns its sequence number (0 if there's none) and whether it loaded.
+    found = snapshot.newest(paths)
+    if found is None:
+        return 0, False
+    path, seq, length = found
+    if length != snapshot.size(parts):
+        log.warning("Saved {} doesn't match this firmware's layout, starting fresh", what)
+        return seq, False
+    snapshot.load(path, parts)
+    log.info("Restored {} {} from {}", what, seq, path)
+    return seq, True
+
+def restore_usage(): #Loads the newest good usage and occupancy snapshots into m_accounting and m_predictor, if there are ones that fit.
+    global usage_seq, occupancy_seq
+    usage_seq, loaded = restore_part(USAGE_FILES, m_accounting.buffers(), "usage")
+    if loaded and not m_accounting.restored():
+        log.warning("Saved usage doesn't match this firmware's layout, starting fresh")
+    occupancy_seq, loaded = restore_part(OCCUPANCY_FILES, m_predictor.buffers(), "occupancy")
+    if loaded and not m_predictor.rebuilt():
+        log.warning("Saved occupancy doesn't match this firmware's layout, starting fresh")
+
+def restore_state(): #Loads the newest good snapshot, if there is one, and rebuilds the bar graph from it. Called at boot before the first hardware loop.
+    global timestamp, snapshot_seq, m_bargraph_version
+    restore_usage()
+    found = snapshot.newest(SNAPSHOT_FILES)
+    if found is None:
+        log.info("No saved history, starting fresh")
+        return
+    path, seq, length = found
+    snapshot_seq = seq
+    if length != len(snapshot_meta) + len(m_history.data)*struct.calcsize(HISTORY_TYPECODE):
+        log.warning("Saved history doesn't match this firmware's layout, starting fresh")
+        return
+    snapshot.load(path, (snapshot_meta, m_history.data))
+    meta = struct.unpack_from(SNAPSHOT_META, snapshot_meta, 0)
+    saved_time, slots, depth, typecode = meta[:4] #meta[4] is the shower count. The length check above already covers it (a different count is a different size).
+    if slots != WEEK_TIMESTEP or depth != RAVG_DEPTH or typecode != ord(HISTORY_TYPECODE):
+        m_history.clear()
+        log.warning("Saved history doesn't match this firmware's layout, starting fresh")
+        return
+    m_history.rebuild()
+    m_daystats.rebuild(m_history, saved_time % TOTAL_TIME, 100) #The water use comes back with m_accounting, in restore_usage().
+    for slot in range(WEEK_TIMESTEP):
+        m_bargraph[slot] = m_history.mean(slot)
+    m_bargraph_version += 1
+    timestamp = saved_time % TOTAL_TIME
+    for shower in range(SHOWER_COUNT):
+        shower_temp_threshold[shower] = meta[5 + shower]
+    log.info("Restored snapshot {} from {}", seq, path)
+
+async def hardware_task(watchdog): #Runs picoHardwareLoop() on its own fixed schedule (unless core 1 has it), pushes status to /events, and feeds the watchdog. It lives in its own task so web clients can only ever delay it by however long a single handler runs without awaiting (and the sensors and heaters don't wait on it at all; they're on sensorScheduler's timer or core 1).
+    next_hardware_update = utime.ticks_ms()
+    next_snapshot = utime.ticks_add(next_hardware_update, SNAPSHOT_PERIOD_S*1000)
+    core1_seq = coreState.seq
+    core1_seen = next_hardware_update
+    while not shutdown:
+        if dual_core and coreState.seq != core1_seq:
+            core1_seq = coreState.seq
+            core1_seen = utime.ticks_ms()
+        if not dual_core or utime.ticks_diff(utime.ticks_ms(), core1_seen) < CORE1_STALL_MS: #A hung core 1 gets us reset, same as a hung core 0.
+            watchdog.feed()
+            metrics.watchdog_fed(WATCHDOG_TIMEOUT_MS)
+        metrics.loop_tick(HARDWARE_PERIOD_MS)
+        if not dual_core:
+            picoHardwareLoop()
+        publish_status() #Push results to any dashboards listening on /events, but only if something actually changed.
+        if SNAPSHOT_PERIOD_S and not snapshot_busy and utime.ticks_diff(utime.ticks_ms(), next_snapshot) >= 0:
+            asyncio.create_task(save_state()) #Off in its own task, so the flash write never pushes back the next hardware update.
+            next_snapshot = utime.ticks_add(utime.ticks_ms(), SNAPSHOT_PERIOD_S*1000)
+        gc.collect() #Clean up unused memory. This code, when run on a Pi Pico W, will run into memory allocation failures without it, and hard fault.
+        next_hardware_update = utime.ticks_add(next_hardware_update, HARDWARE_PERIOD_MS) #Scheduled off the previous deadline rather than 'now', so the cadence doesn't drift.
+        delay = utime.ticks_diff(next_hardware_update, utime.ticks_ms())
+        if delay < 0: #We've fallen behind by more than a whole period. Resync instead of running a burst of back-to-back updates to catch up.
+            next_hardware_update = utime.ticks_ms()
+            delay = 0
+        await asyncio.sleep(delay/1000)
+
+async def serve(watchdog): #Starts the web server in the background and then hands control to the hardware loop until we're told to shut down.
+    server = await asyncio.start_server(httpd.respond_request, '0.0.0.0', HTTP_PORT, backlog=5)
+    log.info("Listening on port {}", HTTP_PORT)
+    asyncio.create_task(log.drain_task(LOG_DRAIN_PERIOD_S))
+    try:
+        await hardware_task(watchdog)
+    finally:
+        server.close() #This makes sure the socket closes when you're done using the Pico.
+        await server.wait_closed()
 
 def main(): #The main loop. It just makes me feel better to put this in a function. Doesn't it make you feel better, too?
-    global shutdown
-    print("Booting up...")
+    global shutdown, dual_core
+    log.info("Booting up...")
 
-    watchdog = machine.WDT(timeout=5000) #The Pico kept crashing into a weird unreachable state where I'd have to power cycle it, so now when the Pico encounters a problem it'll just time out and hard-reset itself, no problem.
-    print("Created Watchdog timer")
+    watchdog = machine.WDT(timeout=WATCHDOG_TIMEOUT_MS) #The Pico kept crashing into a weird unreachable state where I'd have to power cycle it, so now when the Pico encounters a problem it'll just time out and hard-reset itself, no problem.
+    log.info("Created Watchdog timer")
 
     # Create a network connection
     ssid = 'RPI_PICO_AP'       #Set access point name 
@@ -710,30 +1269,31 @@ def main(): #The main loop. It just makes me feel better to put this in a functi
 
     while ap.active() == False:
         pass
-    print('Connection is successful')
-    print(ap.ifconfig())
+    log.info('Connection is successful')
+    log.info("{}", ap.ifconfig())
+
+    restore_state() #Get the bar graph back from before the last reset, if we can.
+    build_page_shell() #Pre-render the static parts of the dashboard before the first client shows up.
+    prime_sensors()
+    log.share(DUAL_CORE) #Before core 1 can log anything.
+    if DUAL_CORE and shared.start(core1_main):
+        dual_core = True
+        log.info("Sensors and control running on core 1")
+    else:
+        log.share(False) #Just us after all, and the sensor timer mustn't find the log locked.
+        sensorScheduler.start()
+    httpd.preallocate_buffers(httpd.MAX_CONNECTIONS)
+    log.drain() #Get the boot messages out now, rather than waiting for the first drain.
 
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.bind(('', 80))
-    s.settimeout(0.1)
-    s.listen(5)
-    
-    next_hardware_update = utime.ticks_ms()
-    while not shutdown:
-        try:
-            watchdog.feed()
-            respond_request(s)
-            #print(utime.ticks_ms())
-            if utime.ticks_diff(next_hardware_update, utime.ticks_ms()) < 0: #Triggers the hardware loop once per second or so (it's lagged slightly by s.settimeout). 
-                print("Hardware update...")
-                picoHardwareLoop()
-                next_hardware_update = utime.ticks_ms() + 1000
-                gc.collect() #Clean up unused memory. This code, when run on a Pi Pico W, will run into memory allocation failures without it, and hard fault.
-        except KeyboardInterrupt:
-            print("Shutting down...")
-            shutdown = True
-    s.close() #This single command makes sure the socket closes when you're done using the Pico.
+    try:
+        asyncio.run(serve(watchdog))
+    except KeyboardInterrupt:
+        log.info("Shutting down...")
+        shutdown = True
+    sensorScheduler.stop() #Core 1 sees 'shutdown' and stops on its own.
+    log.drain()
     
-main() #Sets all of the above code into motion.
+if __name__ == "__main__": #The Pico runs main.py as __main__ at boot. Importing it (e.g. from the simulator in sim/) just defines everything without starting up.
+    main() #Sets all of the above code into motion.
 
 
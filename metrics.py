@@ -0,0 +1,176 @@
+#Always-on instrumentation for the hot paths, served as Prometheus text at /metrics.
+#
+#Each instrumented function gets a probe: a fixed slot in a handful of arrays that counts its calls, the time spent in it (ticks_us), the slowest
+#call, and gc.mem_free() either side of the last call. There's also the hardware loop's jitter against its period and how close the watchdog has
+#come to biting. All of it is sized at import time and only ever updated in place with small ints, so recording never allocates; the text is only
+#built when somebody scrapes /metrics.
+import gc
+import utime
+from history import zeros
+
+MAX_PROBES = 16 #Slots in the arrays below. probe() refuses to register more than this.
+PREFIX = "shower_" #Put in front of every metric name.
+
+_names = [] #Probe index -> the function name it's reported under.
+calls = zeros('L', MAX_PROBES)
+total_s = zeros('L', MAX_PROBES) #Time spent, kept as whole seconds plus leftover microseconds so neither ever grows past a small int.
+total_us = zeros('L', MAX_PROBES)
+max_us = zeros('L', MAX_PROBES) #Slowest single call.
+free_before = zeros('L', MAX_PROBES) #gc.mem_free() going into the last call...
+free_after = zeros('L', MAX_PROBES) #...and coming out of it.
+alloc_max = zeros('L', MAX_PROBES) #Most heap a single call has eaten (free before - free after). A gc.collect() inside the call hides whatever it freed.
+
+_mem_free = getattr(gc, "mem_free", None) #MicroPython only. On the host the heap numbers just stay at 0.
+_mem_alloc = getattr(gc, "mem_alloc", None)
+
+#Hardware loop cadence. Plain module ints, which are small enough that updating them doesn't allocate either.
+loop_count = 0
+loop_last_start = None #ticks_ms() at the start of the previous loop.
+loop_jitter_last = 0 #How far (ms, either way) the last gap between loops was from the period.
+loop_jitter_max = 0
+loop_jitter_total = 0
+
+#Watchdog. The WDT can't tell us how long it has left, so we keep track of the feeds ourselves.
+watchdog_timeout = 0 #ms. 0 until the first feed, which means "no watchdog".
+watchdog_last_feed = 0
+watchdog_gap_max = 0 #Longest we've ever gone between feeds. timeout - this is the closest we've come to a reset.
+
+def mem_free():
+    return _mem_free() if _mem_free is not None else 0
+
+def probe(name): #Registers a probe and returns its slot. Call it once per function at import time, never per call.
+    if name in _names:
+        return _names.index(name)
+    if len(_names) >= MAX_PROBES:
+        raise ValueError("Out of metrics probes; raise MAX_PROBES")
+    _names.append(name)
+    return len(_names) - 1
+
+def record(p, start, free): #Books one finished call against probe p. 'start' is ticks_us() and 'free' is mem_free() from when the call began.
+    elapsed = utime.ticks_diff(utime.ticks_us(), start)
+    after = mem_free()
+    calls[p] += 1
+    total_us[p] += elapsed
+    if total_us[p] >= 1000000:
+        total_s[p] += total_us[p]//1000000
+        total_us[p] %= 1000000
+    if elapsed > max_us[p]:
+        max_us[p] = elapsed
+    free_before[p] = free
+    free_after[p] = after
+    if free - after > alloc_max[p]:
+        alloc_max[p] = free - after
+
+def timed(name, nargs = -1): #Decorator for a plain function. Give nargs if it always takes that many positional arguments (0 to 2): MicroPython builds a
+    #tuple for every *args call, and the fixed-size wrappers don't. Keyword arguments aren't passed through either way; none of the hot paths use them.
+    p = probe(name)
+    def wrap(fn):
+        if nargs == 0:
+            def wrapper():
+                start = utime.ticks_us()
+                free = mem_free()
+                try:
+                    return fn()
+                finally:
+                    record(p, start, free)
+        elif nargs == 1:
+            def wrapper(a):
+                start = utime.ticks_us()
+                free = mem_free()
+                try:
+                    return fn(a)
+                finally:
+                    record(p, start, free)
+        elif nargs == 2:
+            def wrapper(a, b):
+                start = utime.ticks_us()
+                free = mem_free()
+                try:
+                    return fn(a, b)
+                finally:
+                    record(p, start, free)
+        else:
+            def wrapper(*args):
+                start = utime.ticks_us()
+                free = mem_free()
+                try:
+                    return fn(*args)
+                finally:
+                    record(p, start, free)
+        return wrapper
+    return wrap
+
+def timed_async(name): #Same as timed(), for coroutines. Every call makes a coroutine object anyway, so there's no point in fixed-size wrappers here. The time includes any awaiting, and the heap figures include whatever other tasks did meanwhile.
+    p = probe(name)
+    def wrap(fn):
+        async def wrapper(*args):
+            start = utime.ticks_us()
+            free = mem_free()
+            try:
+                return await fn(*args)
+            finally:
+                record(p, start, free)
+        return wrapper
+    return wrap
+
+def loop_tick(period_ms): #Called at the top of every hardware loop. Measures how far the gap since the previous one was from period_ms.
+    global loop_count, loop_last_start, loop_jitter_last, loop_jitter_max, loop_jitter_total
+    now = utime.ticks_ms()
+    if loop_last_start is not None:
+        loop_jitter_last = abs(utime.ticks_diff(now, loop_last_start) - period_ms)
+        loop_jitter_total += loop_jitter_last
+        if loop_jitter_last > loop_jitter_max:
+            loop_jitter_max = loop_jitter_last
+    loop_last_start = now
+    loop_count += 1
+
+def watchdog_fed(timeout_ms): #Call right after every watchdog.feed().
+    global watchdog_timeout, watchdog_last_feed, watchdog_gap_max
+    now = utime.ticks_ms()
+    if watchdog_timeout:
+        gap = utime.ticks_diff(now, watchdog_last_feed)
+        if gap > watchdog_gap_max:
+            watchdog_gap_max = gap
+    watchdog_timeout = timeout_ms
+    watchdog_last_feed = now
+
+def _family(name, kind, help): #The HELP and TYPE lines that start off each metric.
+    return "# HELP {0}{1} {2}\n# TYPE {0}{1} {3}\n".format(PREFIX, name, help, kind).encode("UTF-8")
+
+def _sample(name, value, fn = None):
+    if fn is None:
+        return "{}{} {}\n".format(PREFIX, name, value).encode("UTF-8")
+    return '{}{}{{fn="{}"}} {}\n'.format(PREFIX, name, fn, value).encode("UTF-8")
+
+def _per_probe(name, kind, help, value):
+    yield _family(name, kind, help)
+    for p in range(len(_names)):
+        yield _sample(name, value(p), _names[p])
+
+def render(): #The whole /metrics page, one line at a time, so it can go straight out through httpd.send_response() without being joined up first.
+    yield from _per_probe("calls_total", "counter", "Calls to each instrumented function.", lambda p: calls[p])
+    yield from _per_probe("seconds_total", "counter", "Time spent in each instrumented function.", lambda p: "{}.{:06d}".format(total_s[p], total_us[p]))
+    yield from _per_probe("max_seconds", "gauge", "Slowest single call.", lambda p: "{:.6f}".format(max_us[p]/1000000))
+    if _mem_free is not None:
+        yield from _per_probe("mem_free_before_bytes", "gauge", "gc.mem_free() going into the last call.", lambda p: free_before[p])
+        yield from _per_probe("mem_free_after_bytes", "gauge", "gc.mem_free() coming out of the last call.", lambda p: free_after[p])
+        yield from _per_probe("alloc_max_bytes", "gauge", "Most heap used by a single call.", lambda p: alloc_max[p])
+        yield _family("heap_free_bytes", "gauge", "gc.mem_free() right now.")
+        yield _sample("heap_free_bytes", mem_free())
+        yield _family("heap_alloc_bytes", "gauge", "gc.mem_alloc() right now.")
+        yield _sample("heap_alloc_bytes", _mem_alloc() if _mem_alloc is not None else 0)
+
+    yield _family("hardware_loops_total", "counter", "Hardware loops run.")
+    yield _sample("hardware_loops_total", loop_count)
+    yield _family("hardware_jitter_seconds", "gauge", "How far the last gap between hardware loops was from the period.")
+    yield _sample("hardware_jitter_seconds", "{:.3f}".format(loop_jitter_last/1000))
+    yield _family("hardware_jitter_max_seconds", "gauge", "Worst gap error since boot.")
+    yield _sample("hardware_jitter_max_seconds", "{:.3f}".format(loop_jitter_max/1000))
+    yield _family("hardware_jitter_seconds_total", "counter", "Sum of the gap errors; divide by hardware_loops_total for the average.")
+    yield _sample("hardware_jitter_seconds_total", "{:.3f}".format(loop_jitter_total/1000))
+
+    if watchdog_timeout:
+        yield _family("watchdog_margin_seconds", "gauge", "Time left right now before the watchdog would reset us.")
+        yield _sample("watchdog_margin_seconds", "{:.3f}".format((watchdog_timeout - utime.ticks_diff(utime.ticks_ms(), watchdog_last_feed))/1000))
+        yield _family("watchdog_margin_min_seconds", "gauge", "Closest the watchdog has come to resetting us since boot.")
+        yield _sample("watchdog_margin_min_seconds", "{:.3f}".format((watchdog_timeout - watchdog_gap_max)/1000))
@@ -0,0 +1,159 @@
+#Downsampled history for /api/history. Every hardware loop hands record() one sample of each series, and each tier keeps a ring of buckets
+#summarising 'size' samples apiece (min, max and mean), e.g. raw seconds, then 10 s, 1 min, 10 min and hourly buckets. A tier's open bucket is
+#updated in place as samples come in and written to the ring when it fills, so recording costs the same few operations per tier whatever the
+#history length. A query is answered from the coarsest tier that's still fine enough for the step asked for, so the work per returned point
+#stays bounded however long a span is asked for.
+#
+#Everything is ints (the caller picks a scale, e.g. hundredths) in fixed arrays: 6 bytes per series per bucket, allocated once.
+from history import zeros
+
+EMPTY_MIN = 32767 #What an empty bucket's min and max hold. An empty bucket has min > max, which is how merge() knows to skip it.
+EMPTY_MAX = -32768
+_LIMIT_LOW = -32767 #Samples are clamped into this range, so they fit in 'h' and never look like EMPTY_MAX.
+_LIMIT_HIGH = 32766
+
+class Tier:
+    def __init__(self, size, buckets, series):
+        self.size = size #Samples per bucket.
+        self.buckets = buckets #Closed buckets kept.
+        self.mins = zeros('h', buckets*series) #Bucket k of series s is at (k % buckets)*series + s.
+        self.maxs = zeros('h', buckets*series)
+        self.means = zeros('h', buckets*series)
+        self.acc_min = zeros('h', series) #The open bucket.
+        self.acc_max = zeros('h', series)
+        self.acc_sum = zeros('l', series)
+        self.acc_n = 0
+        for i in range(len(self.mins)):
+            self.mins[i] = EMPTY_MIN
+            self.maxs[i] = EMPTY_MAX
+
+class Rollup:
+    #tiers: ((samples per bucket, buckets kept), ...) from finest to coarsest. Each size should divide the next.
+    #series: how many values each sample has.
+    def __init__(self, tiers, series):
+        self.series = series
+        self.tiers = [Tier(size, buckets, series) for size, buckets in tiers]
+        self.count = 0 #Samples recorded so far. Sample i is in bucket i//size of every tier.
+        self._reset_open(self.tiers)
+
+    def _reset_open(self, tiers):
+        for tier in tiers:
+            for s in range(self.series):
+                tier.acc_min[s] = EMPTY_MIN
+                tier.acc_max[s] = EMPTY_MAX
+                tier.acc_sum[s] = 0
+            tier.acc_n = 0
+
+    def record(self, values): #Adds one sample: values[s] for each series (any indexable; main.py reuses one array).
+        n = self.count
+        series = self.series
+        for tier in self.tiers:
+            acc_min = tier.acc_min
+            acc_max = tier.acc_max
+            acc_sum = tier.acc_sum
+            for s in range(series):
+                v = min(max(values[s], _LIMIT_LOW), _LIMIT_HIGH)
+                if v < acc_min[s]:
+                    acc_min[s] = v
+                if v > acc_max[s]:
+                    acc_max[s] = v
+                acc_sum[s] += v
+            tier.acc_n += 1
+            if (n + 1) % tier.size == 0: #That filled the bucket. Close it into the ring and start the next one.
+                base = ((n//tier.size) % tier.buckets)*series
+                count = tier.acc_n
+                for s in range(series):
+                    tier.mins[base + s] = acc_min[s]
+                    tier.maxs[base + s] = acc_max[s]
+                    tier.means[base + s] = (acc_sum[s] + count//2)//count
+                    acc_min[s] = EMPTY_MIN
+                    acc_max[s] = EMPTY_MAX
+                    acc_sum[s] = 0
+                tier.acc_n = 0
+        self.count = n + 1
+
+    def oldest(self, tier): #The first sample a tier still has a bucket for.
+        first_bucket = max(0, self.count//tier.size - tier.buckets)
+        return first_bucket*tier.size
+
+    def plan(self, start, end, step, max_points):
+        #Works out how to answer a query for samples start..end (inclusive; negative counts back from the newest, -1 being the newest) at
+        #roughly 'step' samples per point. Returns (tier, first sample, step, points), with step rounded up to whole buckets of the tier
+        #(and further if it would take more than max_points), or None if there's nothing in range.
+        if self.count == 0:
+            return None
+        if start < 0:
+            start += self.count
+        if end < 0:
+            end += self.count
+        end = min(end, self.count - 1)
+        step = max(1, step)
+        start = max(0, start)
+        tier = None
+        for t in self.tiers: #The coarsest tier no coarser than the step, among those that reach back to 'start'.
+            if self.oldest(t) <= start and t.size <= step:
+                tier = t
+        if tier is None: #Nothing fine enough reaches back that far: use whichever does, at its own resolution.
+            for t in self.tiers:
+                if self.oldest(t) <= start:
+                    tier = t
+                    break
+            if tier is None: #Older than even the coarsest tier has. Start from what it does have.
+                tier = self.tiers[-1]
+                start = self.oldest(tier)
+        step = max(tier.size, (step + tier.size - 1)//tier.size*tier.size)
+        start = start//tier.size*tier.size
+        if end < start:
+            return None
+        points = (end - start)//step + 1
+        if points > max_points:
+            step = ((end - start)//max_points + tier.size)//tier.size*tier.size
+            points = (end - start)//step + 1
+        return tier, start, step, points
+
+    def merge(self, tier, start, step, out): #Summarises samples start..start+step-1 from 'tier' into out: [min, max, mean] for each series, in order. Returns False if there's no data at all in that range.
+        series = self.series
+        current = self.count//tier.size #The open bucket.
+        first = start//tier.size
+        last = min((start + step)//tier.size - 1, current)
+        first = max(first, current - tier.buckets, 0) #Anything older has been overwritten.
+        found = 0
+        for s in range(series):
+            out[3*s] = EMPTY_MIN
+            out[3*s + 1] = EMPTY_MAX
+            out[3*s + 2] = 0
+        for k in range(first, last + 1):
+            if k == current:
+                if not tier.acc_n:
+                    continue
+                for s in range(series):
+                    if tier.acc_min[s] < out[3*s]:
+                        out[3*s] = tier.acc_min[s]
+                    if tier.acc_max[s] > out[3*s + 1]:
+                        out[3*s + 1] = tier.acc_max[s]
+                    out[3*s + 2] += (tier.acc_sum[s] + tier.acc_n//2)//tier.acc_n
+            else:
+                base = (k % tier.buckets)*series
+                if tier.mins[base] > tier.maxs[base]: #Never filled (e.g. before boot).
+                    continue
+                for s in range(series):
+                    if tier.mins[base + s] < out[3*s]:
+                        out[3*s] = tier.mins[base + s]
+                    if tier.maxs[base + s] > out[3*s + 1]:
+                        out[3*s + 1] = tier.maxs[base + s]
+                    out[3*s + 2] += tier.means[base + s]
+            found += 1
+        if not found:
+            return False
+        for s in range(series): #Mean of the bucket means. The buckets are all the same size apart from a partly filled open one, which is close enough.
+            out[3*s + 2] = (out[3*s + 2] + found//2)//found
+        return True
+
+    def clear(self):
+        for tier in self.tiers:
+            for i in range(len(tier.mins)):
+                tier.mins[i] = EMPTY_MIN
+                tier.maxs[i] = EMPTY_MAX
+                tier.means[i] = 0
+        self._reset_open(self.tiers)
+        self.count = 0
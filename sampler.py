@@ -0,0 +1,53 @@
+#Burst acquisition for the sensor mux. Every sensor comes in through the one ADC pin, selected by switching its transistor on. Instead of one
+#read_u16() per sensor, each channel gets a burst of samples taken in a tight loop into a preallocated array('H'), and then the burst is boiled
+#down to one value (mean or median). Averaging N samples cuts the noise by about sqrt(N), which is what lets the IR hysteresis band be narrower.
+import utime
+from history import zeros
+
+MEAN = 0 #Cheapest. Good for white-ish noise.
+MEDIAN = 1 #Throws out spikes (e.g. the heater relay clicking) completely, but has to sort the burst, so keep the burst short if you use it.
+
+class Sampler:
+    #adc: the machine.ADC everything is read through.
+    #pins: the select line (machine.Pin) for each channel, in channel order.
+    #burst: samples per channel per read.
+    #settle_us: how long to wait after switching a channel on before sampling it.
+    def __init__(self, adc, pins, burst, settle_us = 5, mode = MEAN):
+        self.adc = adc
+        self.pins = pins
+        self.burst = max(1, burst)
+        self.settle_us = settle_us
+        self.mode = mode
+        self.samples = zeros('H', self.burst) #The current channel's burst. Reused for every channel, every time.
+
+    def _mean(self):
+        total = 0
+        for v in self.samples:
+            total += v
+        return (total + self.burst//2)//self.burst #Rounded. total stays a small int for any sane burst (65535*burst).
+
+    def _median(self): #Insertion sort, in place. For a 16 sample burst that's at most 120 swaps, and it never allocates.
+        s = self.samples
+        for i in range(1, self.burst):
+            v = s[i]
+            j = i - 1
+            while j >= 0 and s[j] > v:
+                s[j + 1] = s[j]
+                j -= 1
+            s[j + 1] = v
+        mid = self.burst//2
+        if self.burst % 2:
+            return s[mid]
+        return (s[mid - 1] + s[mid] + 1)//2
+
+    def read(self, channel): #Selects one channel, takes a burst from it and returns the filtered 16-bit value.
+        pin = self.pins[channel]
+        read = self.adc.read_u16 #Looked up once, not once per sample.
+        s = self.samples
+        pin.on()
+        utime.sleep_us(self.settle_us)
+        for i in range(self.burst):
+            s[i] = read()
+        pin.off()
+        return self._median() if self.mode == MEDIAN else self._mean()
+
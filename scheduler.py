@@ -0,0 +1,88 @@
+#Sensor sampling and control off a hardware timer, so they keep to time whatever the web server is doing.
+#
+#hardware_task() is an asyncio task, which means a handler that runs a long time without awaiting holds it up, heaters and all. The Scheduler
+#here hangs off a machine.Timer instead. On the RP2040 its callback is a soft interrupt: it runs between two bytecodes of whatever else is going
+#on, asyncio or not. Each job runs every so many timer ticks, and the readings go into Rings for the slower asyncio side to pick up.
+import machine
+import utime
+import metrics
+import log
+from history import zeros
+
+_MASK = (1 << 30) - 1 #Ring indexes wrap like ticks do, so they stay small ints forever.
+
+class Ring:
+    #A single-producer, single-consumer ring of ints. Only the timer side pushes and only the asyncio side drains, and each one only ever
+    #writes its own index, so neither side needs a lock or has to turn interrupts off. If the consumer falls behind and the ring fills up,
+    #new readings are counted in 'overruns' and dropped, but 'last' always has the newest one.
+    def __init__(self, size, typecode = 'l'): #size has to be a power of two.
+        self.data = zeros(typecode, size)
+        self.mask = size - 1
+        self.head = 0 #Pushes so far. Producer only.
+        self.tail = 0 #Readings consumed so far. Consumer only.
+        self.last = 0
+        self.overruns = 0
+
+    def push(self, value):
+        self.last = value
+        if ((self.head - self.tail) & _MASK) > self.mask:
+            self.overruns += 1
+            return
+        self.data[self.head & self.mask] = value
+        self.head = (self.head + 1) & _MASK #Stored last, so the consumer never sees a slot before it's filled in.
+
+    def __len__(self):
+        return (self.head - self.tail) & _MASK
+
+    def drain_mean(self, default): #Consumes everything pushed since the last drain and returns its (rounded) mean, or 'default' if there's nothing new.
+        head = self.head #Taken once: anything pushed while we add up is left for next time.
+        n = (head - self.tail) & _MASK
+        if not n:
+            return default
+        total = 0
+        for i in range(self.tail, self.tail + n):
+            total += self.data[i & self.mask]
+        self.tail = head
+        return (total + n//2)//n
+
+class Scheduler:
+    def __init__(self, tick_ms):
+        self.tick_ms = tick_ms
+        self.jobs = [] #[period in ticks, function, argument].
+        self.ticks = 0
+        self.timer = None
+        self.busy = False
+        self.overruns = 0 #Ticks skipped because the previous one was still going.
+        self.errors = 0 #Jobs that raised (each one is logged too). The others still run, and so does the next tick.
+        self.probe = metrics.probe("sensor_tick")
+
+    def every(self, period_ms, job, arg = None): #Runs job(arg) every period_ms, rounded to a whole number of ticks. Jobs run in the order they were added.
+        self.jobs.append([max(1, (period_ms + self.tick_ms//2)//self.tick_ms), job, arg])
+
+    def tick(self, timer = None): #The timer callback. Also fine to call by hand, e.g. from the simulator or a benchmark.
+        if self.busy: #Only happens if the jobs take longer than a tick.
+            self.overruns += 1
+            return
+        self.busy = True
+        start = utime.ticks_us()
+        free = metrics.mem_free()
+        n = self.ticks
+        for job in self.jobs:
+            if n % job[0] == 0:
+                try:
+                    job[1](job[2])
+                except Exception as e:
+                    self.errors += 1
+                    log.error("Sensor job failed: {!r}", e)
+        self.ticks = (n + 1) & _MASK
+        metrics.record(self.probe, start, free)
+        self.busy = False
+
+    def start(self):
+        self.stop()
+        self.timer = machine.Timer(mode = machine.Timer.PERIODIC, period = self.tick_ms, callback = self.tick)
+
+    def stop(self):
+        if self.timer is not None:
+            self.timer.deinit()
+            self.timer = None
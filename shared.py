@@ -0,0 +1,61 @@
+#Handing state from the control core to the network core. Core 1 owns the sensors, heaters and history; core 0 serves the web pages. Rather than
+#both of them poking at the same Python globals, core 1 packs what the pages need into a small struct and publishes it here, and core 0 reads
+#the newest complete copy.
+#
+#There are two buffers. The writer always packs into the one readers aren't looking at, then swaps them under the lock. A reader holds the lock
+#only while it unpacks. The writer never waits for the lock: if a reader has it, the swap is just retried on the next publish.
+import struct
+try:
+    import _thread
+except ImportError: #A MicroPython build without threads. Everything here still works from one core.
+    _thread = None
+
+class _NoLock:
+    def acquire(self, waitflag = 1, timeout = -1):
+        return True
+    def release(self):
+        pass
+
+def allocate_lock():
+    return _thread.allocate_lock() if _thread is not None else _NoLock()
+
+def start(fn, args = ()): #Runs fn(*args) on the other core (or, on the host, in a thread). Returns False if this build can't.
+    if _thread is None:
+        return False
+    _thread.start_new_thread(fn, args)
+    return True
+
+class DoubleBuffer:
+    def __init__(self, fmt):
+        self.fmt = fmt
+        size = struct.calcsize(fmt)
+        self.buffers = (bytearray(size), bytearray(size))
+        self.front = 0 #The buffer readers get.
+        self.lock = allocate_lock()
+        self.seq = 0 #Publishes that have made it to the front. Readers can compare this to see if anything's new without unpacking.
+        self.pending = False #A publish is packed into the back buffer but couldn't swap yet.
+        self.missed = 0 #Swaps that had to wait for a reader.
+
+    def publish(self, *values): #Writer side. Packs values into the back buffer and swaps it to the front if no reader is in the way.
+        struct.pack_into(self.fmt, self.buffers[1 - self.front], 0, *values)
+        self.pending = True
+        self.swap()
+
+    def swap(self): #Brings a pending publish to the front. Never blocks; returns False if a reader had the lock.
+        if not self.pending:
+            return True
+        if not self.lock.acquire(0):
+            self.missed += 1
+            return False
+        self.front = 1 - self.front
+        self.seq += 1
+        self.pending = False
+        self.lock.release()
+        return True
+
+    def read(self): #Reader side. The newest published values, as a tuple.
+        self.lock.acquire()
+        try:
+            return struct.unpack_from(self.fmt, self.buffers[self.front], 0)
+        finally:
+            self.lock.release()
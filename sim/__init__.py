@@ -0,0 +1,48 @@
+#Host-side simulator for the shower monitor. Installs fake machine/utime/network/usocket modules so main.py can be imported, run, profiled and
+#load-tested under plain CPython on Linux, with the sensors driven by scripted or recorded waveforms (see waveforms.py).
+#
+#    import sim
+#    board = sim.install()            #Must come before 'import main'.
+#    import main
+#    main.sensorScheduler.tick()       #One sensor timer tick (or main.start_sensors() to put it on a real timer).
+#    main.picoHardwareLoop()
+#
+#Or just 'python -m sim' to run the whole firmware with a web server on localhost.
+import sys
+from sim import board as _board
+from sim import waveforms
+
+#GPIOs on the sensor mux for each shower, as main.SHOWERS assigns them. A scenario for more showers wires up more pins the same way.
+IR_PINS = (10, 11)
+FLOW_PINS = (12, 13)
+TEMP_PINS = (14, 15)
+
+def install(scenario = None, fast = False): #Resets the board, puts the fake modules in place of the MicroPython ones, and wires up a scenario (default_scenario() if none is given). Returns the board.
+    from sim import machine, utime, network, usocket
+    _board.board = _board.Board()
+    _board.board.fast = fast
+    sys.modules["machine"] = machine
+    sys.modules["utime"] = utime
+    sys.modules["network"] = network
+    sys.modules["usocket"] = usocket
+    (scenario or default_scenario)(_board.board)
+    return _board.board
+
+def default_scenario(board, seed = 0): #Two showers: shower 1 busy for 40 s out of every 2 min, shower 2 for 90 s out of every 5 min, both with a little noise. Water warms up while running and cools off after. A different seed shifts everything in time and changes the noise, so a room full of simulated units don't all move in step.
+    shift = seed*37
+    busy1 = waveforms.square(0, 1, 120, 1/3, phase = shift)
+    busy2 = waveforms.square(0, 1, 300, 0.3, phase = 60 + shift)
+    board.wire(IR_PINS[0], waveforms.noisy(waveforms.ir_presence(busy1), 500, seed = 1 + 10*seed))
+    board.wire(IR_PINS[1], waveforms.noisy(waveforms.ir_presence(busy2), 500, seed = 2 + 10*seed))
+    board.wire(FLOW_PINS[0], waveforms.noisy(waveforms.flow(lambda t: 9.5*busy1(t)), 300, seed = 3 + 10*seed))
+    board.wire(FLOW_PINS[1], waveforms.noisy(waveforms.flow(lambda t: 12.0*busy2(t)), 300, seed = 4 + 10*seed))
+    board.wire(TEMP_PINS[0], waveforms.noisy(waveforms.temperature(waveforms.sine(30, 8, 120, phase = shift)), 200, seed = 5 + 10*seed))
+    board.wire(TEMP_PINS[1], waveforms.noisy(waveforms.temperature(waveforms.sine(28, 10, 300, phase = 60 + shift)), 200, seed = 6 + 10*seed))
+
+def empty_scenario(board): #Nobody showering, water sitting at 20 degrees.
+    for pin in IR_PINS:
+        board.wire(pin, waveforms.constant(waveforms.IR_ABSENT))
+    for pin in FLOW_PINS:
+        board.wire(pin, waveforms.constant(0))
+    for pin in TEMP_PINS:
+        board.wire(pin, waveforms.temperature(waveforms.constant(20)))
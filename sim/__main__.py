@@ -0,0 +1,14 @@
+#Runs the whole firmware on the host: 'python -m sim [port [seed]]'. The dashboard is then on http://localhost:<port>/ (8080 by default).
+#'seed' picks a variant of the default scenario (see default_scenario()), for running several units side by side; sim/farm.py does that.
+import sys
+import sim
+
+seed = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+sim.install(lambda board: sim.default_scenario(board, seed))
+import main
+
+if len(sys.argv) > 1:
+    main.HTTP_PORT = int(sys.argv[1])
+else:
+    main.HTTP_PORT = 8080
+main.main()
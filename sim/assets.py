@@ -0,0 +1,30 @@
+#Gzips the dashboard's static assets on the host, for MicroPython builds that can't compress at boot (most rp2 ones):
+#
+#    python -m sim.assets [dir]
+#
+#writes app.css.gz and app.js.gz into dir (main.ASSET_DIR, "static", by default). Copy that folder to the Pico alongside main.py. app.js has
+#the shower names from SHOWERS in it, so run this again whenever SHOWERS or the page changes; main.gzip_bytes() checks each file against the
+#asset it's about to serve and ignores (with a warning) one that's out of date.
+import os
+import sys
+import gzip
+import sim
+
+def write_assets(main, directory): #Returns the paths written.
+    written = []
+    os.makedirs(directory, exist_ok = True)
+    for path, content_type, text in main.asset_sources():
+        out = os.path.join(directory, path.lstrip("/") + ".gz")
+        with open(out, "wb") as f:
+            f.write(gzip.compress(text.encode("UTF-8"), 9, mtime = 0)) #mtime 0, so the same assets always make the same file.
+        written.append(out)
+    return written
+
+def main_assets(argv):
+    sim.install(sim.empty_scenario, True)
+    import main
+    for out in write_assets(main, argv[0] if argv else main.ASSET_DIR):
+        print("Wrote {} ({} bytes)".format(out, os.path.getsize(out)))
+
+if __name__ == "__main__":
+    main_assets(sys.argv[1:])
@@ -0,0 +1,59 @@
+#Shared state for the simulated Pico: which GPIOs are high, what each ADC channel is wired to, and the clock. The fake machine/utime modules
+#all read and write this one object, so a test can script the sensors and then look at what the firmware did to the actuators.
+import time
+
+class Board:
+    def __init__(self):
+        self.pins = {} #GPIO id -> 0/1. Anything never written reads as 0.
+        self.mux = {} #GPIO id of a transistor/mux select line -> waveform feeding the ADC while that line is high.
+        self.idle = 0 #What the ADC reads when no mux line is on.
+        self.fast = False #If True, sleep_us()/sleep_ms() advance the fake clock instead of actually sleeping, so loops can be benchmarked flat out.
+        self.offset_us = 0
+        self.start = time.monotonic()
+        self.adc_reads = 0 #How many ADC samples the firmware has taken. Handy for checking the cost of a loop.
+        self.pin_writes = 0
+        self.feeds = [] #ticks_ms() of every watchdog feed.
+        self.timers = [] #Running machine.Timers in fast mode. They go off from advance(), since the clock only really moves there.
+        self._firing = False
+
+    def now_us(self): #Microseconds since the board "powered on".
+        return int((time.monotonic() - self.start)*1000000) + self.offset_us
+
+    def now_s(self):
+        return self.now_us()/1000000
+
+    def advance(self, us): #Moves the fake clock forward without sleeping, and fires any fast-mode timers that come due on the way.
+        self.offset_us += int(us)
+        if self.timers and not self._firing:
+            self.fire_timers()
+
+    def fire_timers(self): #Runs the callbacks of the fast-mode timers that are due, oldest deadline first, the way the soft IRQs would have.
+        self._firing = True #A callback that sleeps moves the clock too; that mustn't start firing timers from inside a timer.
+        try:
+            now = self.now_us()
+            while True:
+                due = [t for t in self.timers if t.due_us <= now]
+                if not due:
+                    break
+                min(due, key = lambda t: t.due_us).fire()
+        finally:
+            self._firing = False
+
+    def wire(self, pin, waveform): #Connects a waveform to the ADC through the mux line on GPIO 'pin'.
+        self.mux[pin] = waveform
+
+    def read_adc(self): #The raw 16-bit reading for whatever's selected right now. If more than one mux line is on, they fight and we average them, which is roughly what the real circuit does.
+        self.adc_reads += 1
+        t = self.now_s()
+        total = 0
+        count = 0
+        for pin in self.mux:
+            if self.pins.get(pin, 0):
+                total += self.mux[pin](t)
+                count += 1
+        if not count:
+            return self.idle
+        value = int(total/count)
+        return 0 if value < 0 else (65535 if value > 65535 else value)
+
+board = Board() #The one board everything shares. sim.install() resets it.
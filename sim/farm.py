@@ -0,0 +1,53 @@
+#A room full of simulated units, for trying gateway.py on one machine: 'python -m sim.farm [count] [first port]' starts 'count' copies of
+#'python -m sim' (4 by default) on consecutive ports from 'first port' (9100), each with its own scenario seed and its own scratch directory for
+#snapshots, and prints the gateway command line that polls them all. Ctrl-C stops the lot.
+import os
+import sys
+import time
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def start(count, first_port): #Starts the units. Returns [(name, port, Popen)].
+    units = []
+    for i in range(count):
+        port = first_port + i
+        scratch = tempfile.mkdtemp(prefix = "sim{}-".format(port)) #Every unit writes history_a/b.bin into its working directory; they mustn't share.
+        env = dict(os.environ)
+        env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+        process = subprocess.Popen([sys.executable, "-m", "sim", str(port), str(i)], cwd = scratch, env = env,
+            stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+        units.append(("unit{}".format(i + 1), port, process))
+    return units
+
+def stop(units):
+    for name, port, process in units:
+        process.terminate()
+    for name, port, process in units:
+        try:
+            process.wait(5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+def main(argv):
+    count = int(argv[0]) if argv else 4
+    first_port = int(argv[1]) if len(argv) > 1 else 9100
+    units = start(count, first_port)
+    print("Started {} units. Point the gateway at them with:".format(count))
+    print("python gateway.py " + " ".join("{}=localhost:{}".format(name, port) for name, port, process in units))
+    running = set(name for name, port, process in units)
+    try:
+        while running: #Kill one off by hand to see how the gateway copes; the rest carry on.
+            time.sleep(1)
+            for name, port, process in units:
+                if name in running and process.poll() is not None:
+                    running.discard(name)
+                    print("{} (port {}) exited".format(name, port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop(units)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,110 @@
+#Stand-in for MicroPython's machine module, backed by sim.board.
+from sim import board as _board
+
+def _state():
+    return _board.board
+
+class Pin:
+    IN = 0
+    OUT = 1
+    PULL_UP = 1
+    PULL_DOWN = 2
+
+    def __init__(self, id, mode = -1, pull = -1, value = None):
+        self.id = id
+        if value is not None:
+            self.value(value)
+
+    def value(self, v = None):
+        if v is None:
+            return _state().pins.get(self.id, 0)
+        _state().pins[self.id] = 1 if v else 0
+        _state().pin_writes += 1
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+    def toggle(self):
+        self.value(not self.value())
+
+    def __call__(self, v = None):
+        return self.value(v)
+
+class ADC:
+    def __init__(self, pin):
+        self.pin = pin
+
+    def read_u16(self):
+        return _state().read_adc()
+
+class WDT: #Doesn't actually reset anything, but remembers every feed so the margin can be checked.
+    def __init__(self, id = 0, timeout = 5000):
+        self.timeout = timeout
+        self.last = _state().now_us()//1000
+
+    def feed(self):
+        self.last = _state().now_us()//1000
+        _state().feeds.append(self.last)
+
+    def margin(self): #Milliseconds left before the real one would have reset the Pico.
+        return self.timeout - (_state().now_us()//1000 - self.last)
+
+class Timer:
+    #Periodic or one-shot callbacks, like the RP2040's soft timers. In real time (the default) each timer gets a thread that calls back on
+    #schedule, which interrupts the firmware between bytecodes much like the real thing. In fast mode the board fires them from advance()
+    #instead, so they keep pace with the simulated clock. board.fire_timers() catches them up by hand.
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, id = -1, mode = PERIODIC, period = -1, callback = None, freq = -1):
+        self.callback = None
+        self.running = False
+        if callback is not None:
+            self.init(mode = mode, period = period, callback = callback, freq = freq)
+
+    def init(self, mode = PERIODIC, period = -1, callback = None, freq = -1):
+        self.deinit()
+        self.mode = mode
+        self.period_us = int(1000000/freq) if freq > 0 else int(period*1000)
+        self.callback = callback
+        self.due_us = _state().now_us() + self.period_us
+        self.running = True
+        if _state().fast:
+            _state().timers.append(self)
+        else:
+            import threading
+            self.thread = threading.Thread(target = self._run, daemon = True)
+            self.thread.start()
+
+    def fire(self):
+        if self.mode == Timer.PERIODIC:
+            self.due_us += self.period_us
+        else:
+            self.deinit()
+        self.callback(self)
+
+    def _run(self):
+        import time
+        while self.running:
+            delay = self.due_us - _state().now_us()
+            if delay > 0:
+                time.sleep(delay/1000000)
+            if self.running:
+                self.fire()
+
+    def deinit(self):
+        self.running = False
+        if self in _state().timers:
+            _state().timers.remove(self)
+
+def reset():
+    raise SystemExit("machine.reset()")
+
+def freq(hz = None):
+    return 125000000
+
+def unique_id():
+    return b"\x53\x49\x4d\x50\x49\x43\x4f\x00"
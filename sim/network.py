@@ -0,0 +1,25 @@
+#Stand-in for MicroPython's network module. The access point comes up instantly and "lives" on localhost.
+STA_IF = 0
+AP_IF = 1
+
+class WLAN:
+    def __init__(self, interface = STA_IF):
+        self.interface = interface
+        self._active = False
+        self._config = {}
+
+    def active(self, state = None):
+        if state is None:
+            return self._active
+        self._active = bool(state)
+
+    def config(self, *args, **kwargs):
+        if args:
+            return self._config.get(args[0])
+        self._config.update(kwargs)
+
+    def ifconfig(self):
+        return ("127.0.0.1", "255.0.0.0", "127.0.0.1", "127.0.0.1")
+
+    def isconnected(self):
+        return self._active
@@ -0,0 +1,152 @@
+#Replays occupancy through the heater control in control.py, with a simple model of the water at each thermistor, and scores each way of
+#running the heaters: the energy used against how long people stood in a shower waiting for it to get warm.
+#
+#    python -m sim.replay [sessions.json] [--week N] [--weeks N] [--passes N] [--seed N] [--lead N] [--probability P] [--kp N] [--ki N] [--kd N]
+#
+#sessions.json is a saved /api/sessions reply (curl 'http://<unit>/api/sessions?limit=128' > sessions.json). Its sessions are laid out one
+#slot per HARDWARE_PERIOD_MS, as the firmware sees them, and played --passes times so the predictor has some weeks to learn from. Without a
+#file it makes up --weeks weeks of habitual use: each shower has a favourite slot or few in the week, used most weeks, give or take a
+#couple of slots. The first RAVG_DEPTH weeks are the predictor's learning time and don't count towards the score.
+#
+#The policies: "reactive" only heats while someone's in there (no pre-heating), "predictive" is main.py's settings (or the ones given on the
+#command line), and "always" wants every heater all the time, which is the least waiting any amount of energy can buy.
+import sys
+import json
+import random
+import sim
+
+AMBIENT = 20.0 #Degrees. Where idle water drifts to.
+INLET = 15.0 #Degrees. Where running water drifts to, unheated.
+HEAT_RATE = 0.25 #Degrees per second a heater adds at full power.
+IDLE_TAU_S = 900 #Time constant of idle water cooling off to AMBIENT...
+FLOW_TAU_S = 80 #...and of running water heading for INLET. A heater running flat out holds running water at INLET + HEAT_RATE*FLOW_TAU_S.
+HEATER_W = 3000 #Per heater, for the energy column.
+
+def parse_args(argv):
+    options = {"file": None, "week": None, "weeks": None, "passes": None, "seed": 0, "lead": None, "probability": None, "kp": None, "ki": None, "kd": None}
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        if arg.startswith("--") and arg[2:] in options and i + 1 < len(argv):
+            options[arg[2:]] = int(argv[i + 1])
+            i += 2
+        elif not arg.startswith("--") and options["file"] is None:
+            options["file"] = arg
+            i += 1
+        else:
+            raise SystemExit("usage: python -m sim.replay [sessions.json] [--week N] [--weeks N] [--passes N] [--seed N] [--lead N] [--probability P] [--kp N] [--ki N] [--kd N]")
+    return options
+
+def from_sessions(main, path, week): #One pass of per-shower occupancy (a bytearray of slots each) from a saved /api/sessions reply, padded to whole weeks.
+    with open(path) as f:
+        reply = json.load(f)
+    period_s = main.HARDWARE_PERIOD_MS/1000
+    spans = []
+    for session in reply["sessions"] + reply.get("open", []):
+        if session["shower"] not in main.SHOWER_NAMES:
+            print("Skipping a session on shower {}, which isn't in SHOWERS".format(session["shower"]))
+            continue
+        start = int(session["start"]/period_s)
+        spans.append((main.SHOWER_NAMES.index(session["shower"]), start, start + max(1, int(session["seconds"]/period_s + 0.5))))
+    if not spans:
+        raise SystemExit("No sessions in {}".format(path))
+    base = min(span[1] for span in spans)
+    length = max(span[2] for span in spans) - base
+    length = (length + week - 1)//week*week
+    trace = [bytearray(length) for shower in range(main.SHOWER_COUNT)]
+    for shower, start, end in spans:
+        for slot in range(start - base, end - base):
+            trace[shower][slot] = 1
+    return trace
+
+def synthetic(main, week, weeks, seed): #Made-up habits: a few favourite slots per shower, each used 80% of weeks, a couple of slots either way.
+    rng = random.Random(seed)
+    trace = [bytearray(week*weeks) for shower in range(main.SHOWER_COUNT)]
+    for shower in range(main.SHOWER_COUNT):
+        habits = [(rng.randrange(week), rng.randint(3 + week//20, 3 + week//8)) for i in range(1 + week//200)]
+        for w in range(weeks):
+            for start, length in habits:
+                if rng.random() < 0.8:
+                    start = w*week + start + rng.randint(-2, 2)
+                    for slot in range(max(0, start), min(len(trace[shower]), start + length)):
+                        trace[shower][slot] = 1
+    return trace
+
+def replay(main, trace, passes, week, lead, probability, gains, always = False): #Plays the trace through a fresh Predictor and HeaterControl. Returns the score dict.
+    import control
+    import utime
+    showers = main.SHOWER_COUNT
+    predictor = control.Predictor(showers, week, main.RAVG_DEPTH, lead, probability)
+    heaters = control.HeaterControl(showers, main.HEATER_BAND, main.HEATER_MIN_SWITCH_MS, gains[0], gains[1], gains[2], main.HEATER_WINDOW_MS)
+    ticks = main.HARDWARE_PERIOD_MS//main.CONTROL_PERIOD_MS
+    dt = main.CONTROL_PERIOD_MS/1000
+    setpoints = [threshold*100 for threshold in main.shower_temp_threshold]
+    ready = [threshold - main.HEATER_BAND/100 for threshold in main.shower_temp_threshold] #Warm enough to count as hot water.
+    water = [AMBIENT]*showers
+    occupied = bytearray(showers)
+    waiting = [False]*showers #In a session that hasn't had hot water yet.
+    length = len(trace[0])
+    warmup = main.RAVG_DEPTH*week if length*passes > main.RAVG_DEPTH*week else 0
+    score = {"heater_s": 0.0, "sessions": 0, "cold_s": 0.0, "wait_s": 0.0}
+    now = 0
+    timestamp = 0
+    for slot in range(length*passes):
+        counted = slot >= warmup
+        for shower in range(showers):
+            was = occupied[shower]
+            occupied[shower] = trace[shower][slot % length]
+            if occupied[shower] and not was:
+                waiting[shower] = True
+                if counted:
+                    score["sessions"] += 1
+        for tick in range(ticks):
+            now = utime.ticks_add(now, main.CONTROL_PERIOD_MS)
+            for shower in range(showers):
+                demand = always or occupied[shower] or predictor.preheat[shower]
+                on = heaters.step(shower, demand, setpoints[shower], int(water[shower]*100), now)
+                t = water[shower]
+                if occupied[shower]:
+                    t += (HEAT_RATE*on - (t - INLET)/FLOW_TAU_S)*dt
+                else:
+                    t += (HEAT_RATE*on - (t - AMBIENT)/IDLE_TAU_S)*dt
+                water[shower] = t
+                if counted:
+                    score["heater_s"] += on*dt
+                if occupied[shower] and t < ready[shower]:
+                    if counted:
+                        score["cold_s"] += dt
+                        if waiting[shower]:
+                            score["wait_s"] += dt
+                elif occupied[shower]:
+                    waiting[shower] = False
+        predictor.record(timestamp, occupied)
+        timestamp = (timestamp + 1) % (week*main.RAVG_DEPTH)
+        predictor.update(timestamp)
+    score["switches"] = sum(heaters.switches)
+    return score
+
+def main_replay(argv):
+    options = parse_args(argv)
+    sim.install(sim.empty_scenario, True)
+    import main
+    week = options["week"] or main.WEEK_TIMESTEP
+    if options["file"]:
+        trace = from_sessions(main, options["file"], week)
+        passes = options["passes"] or main.RAVG_DEPTH + 1
+    else:
+        trace = synthetic(main, week, options["weeks"] or main.RAVG_DEPTH + 4, options["seed"])
+        passes = options["passes"] or 1
+    lead = main.PREHEAT_LEAD_SLOTS if options["lead"] is None else options["lead"]
+    probability = main.PREHEAT_PROBABILITY if options["probability"] is None else options["probability"]
+    gains = [main.HEATER_KP if options["kp"] is None else options["kp"], main.HEATER_KI if options["ki"] is None else options["ki"], main.HEATER_KD if options["kd"] is None else options["kd"]]
+    print("{} showers, {} slots of {} ms a pass, {} passes, {}-slot weeks. Predictive: lead {} slots at {}%, gains {}/{}/{}.".format(
+        main.SHOWER_COUNT, len(trace[0]), main.HARDWARE_PERIOD_MS, passes, week, lead, probability, gains[0], gains[1], gains[2]))
+    print("{:<12}{:>10}{:>10}{:>10}{:>10}{:>12}{:>10}".format("policy", "heater_s", "kWh", "switches", "sessions", "wait_s/ses", "cold_s"))
+    for name, policy_lead, always in (("reactive", 0, False), ("predictive", lead, False), ("always", 0, True)):
+        score = replay(main, trace, passes, week, policy_lead, probability, gains, always)
+        sessions = score["sessions"]
+        print("{:<12}{:>10.0f}{:>10.3f}{:>10}{:>10}{:>12.1f}{:>10.0f}".format(name, score["heater_s"], score["heater_s"]*HEATER_W/3600000, score["switches"],
+              sessions, score["wait_s"]/sessions if sessions else 0, score["cold_s"]))
+
+if __name__ == "__main__":
+    main_replay(sys.argv[1:])
@@ -0,0 +1,2 @@
+#Stand-in for MicroPython's usocket: on the host it's just the normal socket module.
+from socket import *
@@ -0,0 +1,43 @@
+#Stand-in for MicroPython's utime, on the simulated board clock. The ticks values wrap like the real ones do, so ticks_diff() bugs show up here too.
+import time as _time
+from sim import board as _board
+
+TICKS_PERIOD = 1 << 30
+_TICKS_MAX = TICKS_PERIOD - 1
+_TICKS_HALF = TICKS_PERIOD >> 1
+
+def ticks_us():
+    return _board.board.now_us() & _TICKS_MAX
+
+def ticks_ms():
+    return (_board.board.now_us()//1000) & _TICKS_MAX
+
+def ticks_cpu():
+    return ticks_us()
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) & _TICKS_MAX
+
+def ticks_diff(end, start):
+    return ((end - start + _TICKS_HALF) & _TICKS_MAX) - _TICKS_HALF
+
+def _sleep_us(us):
+    if _board.board.fast:
+        _board.board.advance(us)
+    elif us > 0:
+        _time.sleep(us/1000000)
+
+def sleep_us(us):
+    _sleep_us(us)
+
+def sleep_ms(ms):
+    _sleep_us(ms*1000)
+
+def sleep(s):
+    _sleep_us(s*1000000)
+
+def time():
+    return int(_time.time())
+
+def localtime(secs = None):
+    return _time.localtime(secs)[:8]
@@ -0,0 +1,79 @@
+#Scripted and recorded signals to feed the simulated ADC. A waveform is just a function of time in seconds that returns a raw 16-bit reading,
+#so they can be combined however a test needs. The helpers at the bottom convert real units (occupied or not, L/min, degrees) into the raw
+#counts the firmware expects, using the same scaling as main.py's formulas.
+import math
+import random
+
+def constant(value):
+    return lambda t: value
+
+def square(low, high, period, duty = 0.5, phase = 0.0): #'high' for the first duty*period seconds of every period, 'low' for the rest.
+    def wave(t):
+        return high if ((t + phase) % period) < duty*period else low
+    return wave
+
+def sine(mean, amplitude, period, phase = 0.0):
+    def wave(t):
+        return mean + amplitude*math.sin(2*math.pi*(t + phase)/period)
+    return wave
+
+def ramp(start, end, duration): #Goes from start to end over 'duration' seconds and then stays there.
+    def wave(t):
+        if t >= duration:
+            return end
+        return start + (end - start)*t/duration
+    return wave
+
+def noisy(wave, sigma, seed = None): #Adds gaussian ADC noise on top of another waveform.
+    rng = random.Random(seed)
+    return lambda t: wave(t) + rng.gauss(0, sigma)
+
+def schedule(events, default): #Piecewise signal from a list of (start second, value). Before the first event it's 'default'.
+    events = sorted(events)
+    def wave(t):
+        value = default
+        for start, v in events:
+            if t < start:
+                break
+            value = v
+        return value
+    return wave
+
+def recorded(samples, interval, loop = True): #Plays back a list of recorded raw readings taken every 'interval' seconds, linearly interpolating between them.
+    samples = list(samples)
+    def wave(t):
+        pos = t/interval
+        if loop:
+            pos %= len(samples)
+        elif pos >= len(samples) - 1:
+            return samples[-1]
+        i = int(pos)
+        frac = pos - i
+        a = samples[i]
+        b = samples[(i + 1) % len(samples)]
+        return a + (b - a)*frac
+    return wave
+
+def load_csv(path, column, interval, loop = True): #Reads one column of a CSV recording (raw ADC counts, one row per sample) and plays it back like recorded().
+    samples = []
+    with open(path) as f:
+        for line in f:
+            cells = line.strip().split(",")
+            try:
+                samples.append(float(cells[column]))
+            except (ValueError, IndexError): #Header row or a short line.
+                continue
+    return recorded(samples, interval, loop)
+
+#Real-world unit helpers. These match the conversions in main.py, so if you change those, change these.
+IR_PRESENT = 8000 #The IR receiver pulls the line low when someone's there.
+IR_ABSENT = 60000
+
+def ir_presence(occupied): #Turns a 0/1 occupancy waveform into IR sensor readings.
+    return lambda t: IR_PRESENT if occupied(t) else IR_ABSENT
+
+def flow(litres_per_min, max_rate = 50): #Turns a L/min waveform into photoresistor readings.
+    return lambda t: litres_per_min(t)*65536/max_rate
+
+def temperature(celsius, coefficient = 50): #Turns a degrees-C waveform into thermistor readings.
+    return lambda t: celsius(t)*65536/coefficient
@@ -0,0 +1,95 @@
+#Crash-safe snapshots of the history to flash, so a watchdog reset doesn't wipe the bar graph.
+#
+#There are two snapshot files and we always overwrite the older one, so if the Pico resets partway through a write the other file is still
+#intact. Each file starts with a small header (magic, sequence number, payload length, CRC32 of the payload) and the payload is just the raw
+#bytes of whatever buffers main.py hands us, back to back. At boot we take the valid file with the highest sequence number.
+import os
+import struct
+import binascii
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+MAGIC = b"SHW1"
+HEADER = "<4sIII" #magic, sequence number, payload length, CRC32 of the payload.
+HEADER_SIZE = struct.calcsize(HEADER)
+CHUNK = 512 #Bytes written between yields, so a big history doesn't hold up the other tasks while it goes out to flash.
+
+def _itemsize(mv): #Bytes per item of a memoryview. MicroPython's memoryview has no cast() or nbytes, and slices a typed array by item, so we work in items and convert.
+    return len(bytes(mv[0:1])) if len(mv) else 1
+
+async def save(path, seq, parts): #Writes 'parts' (a list of bytes-like objects) to path as snapshot number 'seq', giving the other tasks a turn between chunks.
+    crc = 0
+    length = 0
+    with open(path, "wb") as f:
+        f.write(struct.pack(HEADER, b"\0\0\0\0", 0, 0, 0)) #Placeholder. The real header goes in last, so a half-written file never has a valid magic.
+        for part in parts:
+            mv = memoryview(part)
+            itemsize = _itemsize(mv)
+            step = max(1, CHUNK//itemsize)
+            for start in range(0, len(mv), step):
+                piece = mv[start:start+step]
+                f.write(piece)
+                crc = binascii.crc32(piece, crc)
+                length += len(piece)*itemsize
+                await asyncio.sleep(0)
+        f.flush()
+        f.seek(0)
+        f.write(struct.pack(HEADER, MAGIC, seq, length, crc & 0xffffffff))
+    sync = getattr(os, "sync", None)
+    if sync is not None:
+        sync()
+
+def check(path): #Returns (sequence, payload length) if the file at path is a complete snapshot with a good CRC, or None otherwise.
+    try:
+        with open(path, "rb") as f:
+            header = f.read(HEADER_SIZE)
+            if len(header) < HEADER_SIZE:
+                return None
+            magic, seq, length, crc = struct.unpack(HEADER, header)
+            if magic != MAGIC:
+                return None
+            buf = bytearray(CHUNK)
+            mv = memoryview(buf)
+            remaining = length
+            actual = 0
+            while remaining > 0:
+                n = f.readinto(mv[:min(CHUNK, remaining)])
+                if not n:
+                    return None #Truncated.
+                actual = binascii.crc32(mv[:n], actual)
+                remaining -= n
+            if actual & 0xffffffff != crc:
+                return None
+            return seq, length
+    except OSError: #File doesn't exist yet.
+        return None
+
+def newest(paths): #Picks the newest valid snapshot out of paths. Returns (path, sequence, payload length), or None if there isn't one.
+    best = None
+    for path in paths:
+        found = check(path)
+        if found is not None and (best is None or found[0] > best[1]):
+            best = (path, found[0], found[1])
+    return best
+
+def size(parts): #Payload length that saving 'parts' would give, to check a snapshot against before loading it.
+    total = 0
+    for part in parts:
+        mv = memoryview(part)
+        total += len(mv)*_itemsize(mv)
+    return total
+
+def load(path, parts): #Reads a snapshot's payload straight back into 'parts' (the same buffers, in the same order, that it was saved from). Call check() or newest() first.
+    with open(path, "rb") as f:
+        f.seek(HEADER_SIZE)
+        for part in parts:
+            mv = memoryview(part)
+            itemsize = _itemsize(mv)
+            pos = 0
+            while pos < len(mv):
+                n = f.readinto(mv[pos:])
+                if not n:
+                    raise OSError("Snapshot is shorter than expected")
+                pos += n//itemsize
@@ -0,0 +1,9 @@
+#Host tests, run against the real main.py on the simulator (see sim/). From the top of the repo: 'python -m unittest'.
+#The simulator has to be installed before anything imports main, so it's done once here and every test module takes main and the board from
+#this package. The board starts out with empty_scenario() wired up; a test that rewires a pin puts it back when it's done.
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import sim
+board = sim.install(sim.empty_scenario, fast = True)
+import main
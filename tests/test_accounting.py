@@ -0,0 +1,99 @@
+#accounting.py's sessions and totals, driven with made-up ticks so every figure can be worked out by hand.
+import unittest
+import tests #Installs the simulated utime.
+from accounting import Accounting, M_WRITTEN
+
+PERIOD = 1000
+
+def run(accounting, steps, day = 0, start = 0):
+    #steps: one (occupied, flow, heater) per shower for each sample, a PERIOD apart. Returns the ticks the next sample would be at.
+    now = start
+    for step in steps:
+        accounting.sample(day, [s[0] for s in step], [s[1] for s in step], [s[2] for s in step], now)
+        now += PERIOD
+    return now
+
+class Sessions(unittest.TestCase):
+    def setUp(self):
+        self.accounting = Accounting(2, 3, 4, 100, PERIOD, 3000)
+
+    def test_session(self):
+        accounting = self.accounting
+        idle = (0, 0, 0)
+        steps = [(idle, idle)]
+        steps.append(((1, 600, 0), (1, 0, 0))) #Both open. 6 L/min is 100 mL a sample.
+        steps.append(((1, 600, 1), (1, 0, 0)))
+        steps.append(((1, 600, 1), (0, 0, 0))) #Shower 1 closes after 2 s: too short to log.
+        steps.append(((1, 600, 1), idle))
+        steps.append(((1, 600, 0), idle))
+        steps.append(((0, 600, 0), idle)) #Shower 0 closes after 5 s.
+        steps.append((idle, idle))
+        run(accounting, steps)
+        self.assertEqual(accounting.count(), 1)
+        start, ms, ml, heater_s, shower, day = accounting.record(0)
+        self.assertEqual((start, ms, ml, heater_s, shower, day), (2, 5000, 500, 3, 0, 0)) #The opening sample's water went before anyone was in.
+        self.assertEqual(list(accounting.day_sessions[0:2]), [1, 0])
+        self.assertEqual(list(accounting.day_ml[0:2]), [600, 0])
+        self.assertEqual(list(accounting.day_occupied_ms[0:2]), [5000, 2000]) #Counted whether or not the session was logged.
+        self.assertEqual(list(accounting.day_heater_ms[0:2]), [3000, 0])
+        self.assertEqual((accounting.total_sessions[0], accounting.total_ml[0], accounting.total_heater_s[0]), (1, 600, 3))
+        self.assertEqual(accounting.clock(), 8)
+
+    def test_min_ms(self): #Exactly min_ms is logged.
+        accounting = self.accounting
+        idle = (0, 0, 0)
+        on = (1, 0, 0)
+        run(accounting, [(on, idle), (on, idle), (on, idle), (idle, idle)])
+        self.assertEqual(accounting.count(), 1)
+        self.assertEqual(accounting.record(0)[1], 3000)
+
+    def test_log_wraps(self):
+        accounting = self.accounting
+        idle = (0, 0, 0)
+        on = (1, 0, 0)
+        steps = []
+        for i in range(6):
+            steps += [(on, idle)]*(4 + i) + [(idle, idle)]
+        run(accounting, steps)
+        self.assertEqual(accounting.meta[M_WRITTEN], 6)
+        self.assertEqual(accounting.count(), 4)
+        self.assertEqual([accounting.record(k)[1] for k in range(4)], [9000, 8000, 7000, 6000]) #Newest first.
+
+class Integration(unittest.TestCase):
+    def test_remainder_carried(self): #0.01 L/min is a sixth of a mL a second: none of it should be lost to rounding.
+        accounting = Accounting(1, 1, 1, 100, PERIOD, 0)
+        run(accounting, [((0, 1, 0),)]*60)
+        self.assertEqual(accounting.total_ml[0], 10)
+
+    def test_late_loop_and_gap(self):
+        accounting = Accounting(1, 1, 1, 100, PERIOD, 0)
+        accounting.sample(0, [0], [600], [1], 0) #First sample: one period.
+        accounting.sample(0, [0], [600], [1], 2500) #Late: what really passed.
+        accounting.sample(0, [0], [600], [1], 60000) #A stall: only one period.
+        self.assertEqual(accounting.total_ml[0], 100 + 250 + 100)
+        self.assertEqual(accounting.day_heater_ms[0], 4500)
+        self.assertEqual(accounting.clock(), 4)
+
+    def test_negative_flow(self):
+        accounting = Accounting(1, 1, 1, 100, PERIOD, 0)
+        run(accounting, [((0, -5, 0),), ((0, 600, 0),)])
+        self.assertEqual(accounting.total_ml[0], 100)
+
+class Days(unittest.TestCase):
+    def test_rollover(self):
+        accounting = Accounting(1, 2, 4, 100, PERIOD, 0)
+        on = ((1, 600, 0),)
+        idle = ((0, 0, 0),)
+        now = run(accounting, [idle, on, on], 0)
+        now = run(accounting, [on, idle], 1, now) #Opened on day 0, closed on day 1: counted on day 1.
+        self.assertEqual(list(accounting.day_sessions), [0, 1])
+        self.assertEqual(accounting.record(0)[5], 1)
+        self.assertEqual(list(accounting.day_ml), [200, 100])
+        run(accounting, [idle], 0, now) #Back round to day 0: its row is from last time, so it starts over.
+        self.assertEqual(list(accounting.day_ml), [0, 100])
+        self.assertEqual(list(accounting.day_occupied_ms), [0, 2000])
+        self.assertEqual(accounting.day_total(accounting.day_ml, 1), 100)
+        self.assertEqual(accounting.total_ml[0], 300)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,33 @@
+#The gzipped dashboard assets shipped in static/ for boards that can't compress (see sim/assets.py).
+import gzip
+import os
+import tempfile
+import unittest
+from tests import main
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class ShippedAssets(unittest.TestCase):
+    def test_up_to_date(self): #Fails after a change to the page or SHOWERS until 'python -m sim.assets' is run again.
+        for path, content_type, text in main.asset_sources():
+            shipped = os.path.join(ROOT, main.ASSET_DIR + path + ".gz")
+            with open(shipped, "rb") as f:
+                gz = f.read()
+            self.assertEqual(main.gzip_bytes(text.encode("UTF-8"), shipped), gz, shipped)
+            self.assertEqual(gzip.decompress(gz), text.encode("UTF-8"))
+
+    def test_stale_file_ignored(self):
+        raw = b"body { color: red; }"
+        with tempfile.TemporaryDirectory() as scratch:
+            stale = os.path.join(scratch, "app.css.gz")
+            with open(stale, "wb") as f:
+                f.write(gzip.compress(b"body { color: blue; }"))
+            gz = main.gzip_bytes(raw, stale)
+        self.assertEqual(gzip.decompress(gz), raw) #Compressed here instead.
+
+    def test_missing_file(self):
+        gz = main.gzip_bytes(b"x"*100, os.path.join(ROOT, "no such dir", "app.js.gz"))
+        self.assertEqual(gzip.decompress(gz), b"x"*100)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+#calibrate.py's lookup tables, against the curves they stand in for.
+import json
+import os
+import tempfile
+import unittest
+import calibrate
+
+SH = (1.009e-3, 2.378e-4, 2.019e-7, 10000) #A common 10k NTC.
+
+class Tables(unittest.TestCase):
+    def test_linear_exact(self):
+        table = calibrate.Table(calibrate.linear(0.5, -100), 1)
+        for raw in (0, 1, 255, 256, 1000, 32768, 65535):
+            self.assertEqual(table.lookup(raw), (raw - 200)//2) #Interpolation rounds down.
+
+    def test_steinhart_hart(self): #Every raw value that means 0-80 degrees: the table should be within a hundredth or two of the real curve.
+        fn = calibrate.steinhart_hart(*SH)
+        table = calibrate.Table(fn, 100)
+        worst = 0
+        for raw in range(0, 65536, 7):
+            degrees = fn(raw)
+            if 0 <= degrees <= 80:
+                worst = max(worst, abs(table.lookup(raw) - degrees*100))
+        self.assertLess(worst, 2)
+
+    def test_points(self):
+        fn = calibrate.points([[20000, 4.5], [0, 0], [65535, 50]]) #Out of order on purpose.
+        self.assertEqual(fn(0), 0)
+        self.assertAlmostEqual(fn(10000), 2.25)
+        self.assertEqual(fn(20000), 4.5)
+        self.assertEqual(calibrate.points([[100, 1], [200, 2]])(50), 1) #Flat past the ends.
+        self.assertEqual(calibrate.points([[100, 1], [200, 2]])(300), 2)
+
+    def test_poly(self):
+        self.assertAlmostEqual(calibrate.poly([1, 2, 3])(10), 1 + 20 + 300)
+
+class Build(unittest.TestCase):
+    def test_overrides(self):
+        with tempfile.TemporaryDirectory() as scratch:
+            path = os.path.join(scratch, "calibration.json")
+            with open(path, "w") as f:
+                json.dump({"b": {"linear": [2, 1]}}, f)
+            calibration = calibrate.build(("a", "b"), (calibrate.linear(1), calibrate.linear(1)), (1, 1), path)
+        self.assertEqual(calibration.convert(0, 1000), 1000) #Default.
+        self.assertEqual(calibration.convert(1, 1000), 2001) #From the file.
+
+    def test_missing_file(self):
+        calibration = calibrate.build(("a",), (calibrate.linear(3),), (1,), "/no/such/calibration.json")
+        self.assertEqual(calibration.convert(0, 10), 30)
+
+    def test_bad_spec(self):
+        with self.assertRaises(ValueError):
+            calibrate.from_spec({"cubic": [1, 2]})
+
+if __name__ == "__main__":
+    unittest.main()
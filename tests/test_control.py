@@ -0,0 +1,75 @@
+#control.py: the heater relay's switching rules and the predictor's pre-heat flags.
+import unittest
+import tests #Installs the simulated utime.
+from control import HeaterControl, Predictor
+
+SET = 4000 #40.00 degrees.
+BAND = 200
+
+class Hysteresis(unittest.TestCase):
+    def test_band(self):
+        control = HeaterControl(1, BAND, 0)
+        self.assertEqual(control.step(0, 1, SET, SET - BAND, 0), 0) #Not below the band yet.
+        self.assertEqual(control.step(0, 1, SET, SET - BAND - 1, 1), 1)
+        self.assertEqual(control.step(0, 1, SET, SET, 2), 1) #Stays on up to the setpoint...
+        self.assertEqual(control.step(0, 1, SET, SET + 1, 3), 0) #...and goes off past it.
+        self.assertEqual(control.step(0, 1, SET, SET - 100, 4), 0) #Inside the band it stays as it was.
+        self.assertEqual(control.switches[0], 2)
+
+    def test_min_switch(self):
+        control = HeaterControl(1, BAND, 5000)
+        self.assertEqual(control.step(0, 1, SET, 3000, 1000), 1) #The first switch is never held back.
+        self.assertEqual(control.step(0, 1, SET, SET + 1, 2000), 1) #Wants off, but too soon.
+        self.assertEqual(control.step(0, 1, SET, SET + 1, 5999), 1)
+        self.assertEqual(control.step(0, 1, SET, SET + 1, 6000), 0)
+        self.assertEqual(control.step(0, 1, SET, 3000, 7000), 0) #And too soon to come back on.
+        self.assertEqual(control.step(0, 1, SET, 3000, 11000), 1)
+        self.assertEqual(control.switches[0], 3)
+
+    def test_forced_off(self): #No demand, or past setpoint + band, turns it off however recently it switched.
+        control = HeaterControl(2, BAND, 60000)
+        self.assertEqual(control.step(0, 1, SET, 3000, 0), 1)
+        self.assertEqual(control.step(0, 1, SET, SET + BAND, 10), 1) #At setpoint + band it's only the hysteresis, held by min_switch.
+        self.assertEqual(control.step(0, 1, SET, SET + BAND + 1, 20), 0)
+        self.assertEqual(control.step(1, 1, SET, 3000, 0), 1)
+        self.assertEqual(control.step(1, 0, SET, 3000, 10), 0)
+        self.assertEqual(control.step(1, 0, SET, 3000, 100000), 0) #And no demand never turns it on.
+
+class Pid(unittest.TestCase):
+    def test_proportional_window(self): #5 degrees below at 100 permille a degree: on for the first half of each window.
+        control = HeaterControl(1, BAND, 0, kp = 100, window_ms = 20000)
+        states = [control.step(0, 1, SET, SET - 500, now) for now in range(0, 40000, 1000)]
+        self.assertEqual(control.duty[0], 500)
+        self.assertEqual(states, ([1]*10 + [0]*10)*2)
+
+    def test_full_power_when_cold(self):
+        control = HeaterControl(1, BAND, 0, kp = 100)
+        self.assertEqual(control.step(0, 1, SET, 0, 0), 1)
+        self.assertEqual(control.duty[0], 1000)
+
+class Preheat(unittest.TestCase):
+    def test_threshold_and_lead(self):
+        predictor = Predictor(1, 10, 2, 2, 50)
+        for t in range(20): #Slot 5 busy one week in two, slot 8 never.
+            predictor.record(t, [1 if t == 5 else 0])
+        self.assertEqual(predictor.probability(0, 5), 50)
+        predictor.update(4) #Looks at slots 4 and 5.
+        self.assertEqual(predictor.preheat[0], 1)
+        predictor.update(6)
+        self.assertEqual(predictor.preheat[0], 0)
+        predictor.update(14) #Timestamps keep counting; slots wrap.
+        self.assertEqual(predictor.preheat[0], 1)
+        strict = Predictor(1, 10, 2, 2, 51)
+        for t in range(20):
+            strict.record(t, [1 if t == 5 else 0])
+        strict.update(4)
+        self.assertEqual(strict.preheat[0], 0)
+
+    def test_lead_zero(self):
+        predictor = Predictor(1, 4, 1, 0, 10)
+        predictor.record(0, [1])
+        predictor.update(0)
+        self.assertEqual(predictor.preheat[0], 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+#gateway.py's polling and merging, against a stand-in unit on localhost.
+import asyncio
+import json
+import unittest
+import httpd
+from tests import main
+from tests.test_httpd import Reader, Writer
+
+_routes = dict(httpd.ROUTES)
+import gateway
+GATEWAY_ROUTES = dict(httpd.ROUTES) #gateway.py registers its pages in the same table as main.py's. Put main's back for the other tests.
+httpd.ROUTES.clear()
+httpd.ROUTES.update(_routes)
+
+def reader_for(data):
+    reader = asyncio.StreamReader()
+    reader.feed_data(data)
+    reader.feed_eof()
+    return reader
+
+def status(temp, occupied, heater, flow):
+    return {"temp1": temp, "sh1_heatstatus": "On" if heater else "Off", "num_showers": occupied, "flow": flow}
+
+class Responses(unittest.TestCase):
+    def read(self, data):
+        async def run():
+            return await gateway.read_response(reader_for(data))
+        return asyncio.run(run())
+
+    def test_content_length(self):
+        self.assertEqual(self.read(b"HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\nhello"), (200, b"hello", False))
+
+    def test_chunked_and_close(self):
+        data = b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\nConnection: close\r\n\r\n3\r\nabc\r\n2;x=y\r\nde\r\n0\r\n\r\n"
+        self.assertEqual(self.read(data), (200, b"abcde", True))
+
+    def test_bad_status_line(self):
+        with self.assertRaises(gateway.PollError):
+            self.read(b"SPDY 200\r\n\r\n")
+
+    def test_too_long(self):
+        with self.assertRaises(gateway.PollError):
+            self.read("HTTP/1.1 200 OK\r\nContent-Length: {}\r\n\r\n".format(gateway.MAX_RESPONSE + 1).encode("UTF-8"))
+
+class Nodes(unittest.TestCase):
+    def setUp(self):
+        self.saved = list(gateway.nodes)
+
+    def tearDown(self):
+        gateway.nodes[:] = self.saved
+
+    def test_parse_node(self):
+        node = gateway.parse_node("pool=10.0.0.5:8080")
+        self.assertEqual((node.name, node.host, node.port), ("pool", "10.0.0.5", 8080))
+        node = gateway.parse_node("10.0.0.6")
+        self.assertEqual((node.name, node.host, node.port), ("10.0.0.6", "10.0.0.6", 80))
+        node = gateway.parse_node({"host": "h", "port": "81"})
+        self.assertEqual((node.name, node.host, node.port), ("h", "h", 81))
+
+    def test_backoff(self):
+        for failures in range(1, 30):
+            delay = gateway.backoff(failures)
+            self.assertGreaterEqual(delay, gateway.BACKOFF_MIN_S*0.8)
+            self.assertLessEqual(delay, gateway.BACKOFF_MAX_S*1.2)
+        self.assertGreater(gateway.backoff(30), gateway.BACKOFF_MAX_S*0.7)
+
+    def test_facility_skips_stale(self):
+        fresh = gateway.Node("a", "h", 1)
+        fresh.status = status(30, 1, True, 2.5)
+        fresh.last_ok = 100
+        stale = gateway.Node("b", "h", 2)
+        stale.status = status(10, 1, True, 9)
+        stale.last_ok = 100 - gateway.STALE_AFTER_S - 1
+        gateway.nodes[:] = [fresh, stale]
+        view = gateway.facility(100)
+        self.assertEqual((view["nodes"], view["stale"], view["showers"], view["num_showers"], view["heaters_on"], view["flow"], view["avg_temp"]),
+            (2, 1, 1, 1, 1, 2.5, 30))
+        self.assertEqual([unit["stale"] for unit in view["units"]], [False, True])
+
+class Polling(unittest.TestCase):
+    def test_poll_and_fail(self): #Polls a stand-in unit twice over one kept-alive connection, then again after it's gone.
+        body = json.dumps(status(25, 0, False, 0)).encode("UTF-8")
+        connections = []
+        async def unit(reader, writer):
+            connections.append(writer)
+            while True:
+                try:
+                    await reader.readuntil(b"\r\n\r\n")
+                except asyncio.IncompleteReadError:
+                    break
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: " + str(len(body)).encode("UTF-8") + b"\r\n\r\n" + body)
+                await writer.drain()
+            writer.close()
+        async def run():
+            gateway.poll_slots = asyncio.Semaphore(gateway.MAX_CONCURRENT)
+            server = await asyncio.start_server(unit, "127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            node = gateway.Node("u", "127.0.0.1", port)
+            results = [await gateway.poll_node(node), await gateway.poll_node(node)]
+            node.close()
+            server.close()
+            await server.wait_closed()
+            results.append(await gateway.poll_node(node))
+            return node, results
+        node, results = asyncio.run(run())
+        self.assertEqual(results, [True, True, False])
+        self.assertEqual(len(connections), 1)
+        self.assertEqual(node.status, status(25, 0, False, 0))
+        self.assertEqual((node.polls, node.failures), (2, 1))
+
+class Pages(unittest.TestCase):
+    def setUp(self):
+        self.routes = dict(httpd.ROUTES)
+        self.nodes = list(gateway.nodes)
+        httpd.ROUTES.clear()
+        httpd.ROUTES.update(GATEWAY_ROUTES)
+
+    def tearDown(self):
+        httpd.ROUTES.clear()
+        httpd.ROUTES.update(self.routes)
+        gateway.nodes[:] = self.nodes
+
+    def test_node_by_escaped_name(self):
+        gateway.nodes[:] = [gateway.Node("pool 2", "h", 1)]
+        writer = Writer()
+        asyncio.run(httpd.respond_request(Reader(b"GET /api/node?name=pool%202 HTTP/1.1\r\nHost: x\r\n\r\n"), writer))
+        self.assertTrue(bytes(writer.sent).startswith(b"HTTP/1.1 200 "), bytes(writer.sent)[:40])
+        self.assertIn(b'"name": "pool 2"', bytes(writer.sent))
+
+if __name__ == "__main__":
+    unittest.main()
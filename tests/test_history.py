@@ -0,0 +1,97 @@
+#history.py's ring buffer and day summaries, against doing it the slow way.
+import random
+import unittest
+from history import History, DayStats
+
+def brute_mean(samples, slots, depth, slot, timestamp):
+    #The average of a slot over the last 'depth' periods, straight from the list of every sample recorded (missing periods count as 0).
+    total = 0
+    for t in range(max(0, timestamp - slots*depth), timestamp):
+        if t % slots == slot:
+            total += samples[t]
+    return total/depth
+
+class RunningSums(unittest.TestCase):
+    def check(self, typecode, scale, places):
+        slots, depth = 7, 3
+        history = History(slots, depth, typecode, scale)
+        rng = random.Random(1)
+        samples = []
+        for t in range(slots*depth*5 + 4): #Round the ring a few times, ending partway through.
+            value = round(rng.uniform(10, 60), 2)
+            samples.append(value)
+            mean = history.record(t, value)
+            self.assertAlmostEqual(mean, brute_mean(samples, slots, depth, t % slots, t + 1), places)
+        for slot in range(slots):
+            self.assertAlmostEqual(history.mean(slot), brute_mean(samples, slots, depth, slot, len(samples)), places)
+        return history, samples
+
+    def test_integer(self):
+        history, samples = self.check('H', 100, 2)
+        self.assertEqual(history.value(len(samples) - 1), samples[-1])
+
+    def test_float(self):
+        self.check('f', 1, 3)
+
+    def test_rebuild(self): #What restoring a snapshot does: the data comes back and the sums are redone from it.
+        history, samples = self.check('H', 100, 2)
+        sums = list(history.sums)
+        for i in range(len(history.sums)):
+            history.sums[i] = 0
+        history.rebuild()
+        self.assertEqual(list(history.sums), sums)
+
+    def test_clear(self):
+        history, samples = self.check('H', 100, 2)
+        history.clear()
+        self.assertEqual(sum(history.data), 0)
+        self.assertEqual(sum(history.sums), 0)
+
+def brute_day(samples, days, per_day, day):
+    #The day's (min, argmin, max, argmax, mean) over its most recent run: from the last time the timestamps came round to its start.
+    start = None
+    for t in range(len(samples)):
+        if t % (days*per_day) == day*per_day:
+            start = t
+    if start is None:
+        return None
+    run = samples[start:start + per_day]
+    low = min(run)
+    high = max(run)
+    return low, run.index(low), high, run.index(high), (sum(run) + len(run)//2)//len(run)
+
+def day_figures(stats, day):
+    if not stats.counts[day]:
+        return None
+    return stats.mins[day], stats.argmin[day], stats.maxs[day], stats.argmax[day], stats.mean(day)
+
+class Days(unittest.TestCase):
+    def test_against_brute_force(self):
+        days, per_day = 4, 6
+        stats = DayStats(days, per_day)
+        history = History(days*per_day, 2, 'H', 100)
+        rng = random.Random(3)
+        samples = []
+        for t in range(days*per_day*3 + 9): #Ends partway through a day, with the days after it left over from the last time round.
+            value = round(rng.uniform(10, 60), 2)
+            history.record(t, value)
+            samples.append(int(round(value*100)))
+            stats.record(t, samples[-1])
+            for day in range(days):
+                self.assertEqual(day_figures(stats, day), brute_day(samples, days, per_day, day), (t, day))
+        rebuilt = DayStats(days, per_day) #What restoring a snapshot does.
+        rebuilt.rebuild(history, len(samples), 100)
+        for day in range(days):
+            self.assertEqual(day_figures(rebuilt, day), day_figures(stats, day), day)
+
+    def test_ties_and_changes(self):
+        stats = DayStats(2, 3)
+        self.assertTrue(stats.record(0, 5)) #Start of the day.
+        self.assertFalse(stats.record(1, 5)) #Same again: no move, and the first one stays the argmin/argmax.
+        self.assertEqual((stats.argmin[0], stats.argmax[0]), (0, 0))
+        self.assertTrue(stats.record(2, 7))
+        self.assertIsNone(stats.mean(1))
+        self.assertEqual(stats.mean(0), 6) #17/3, rounded.
+
+if __name__ == "__main__":
+    unittest.main()
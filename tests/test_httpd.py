@@ -0,0 +1,135 @@
+#The web server on its own, fed canned requests instead of sockets.
+import asyncio
+import unittest
+import httpd
+from tests import main
+
+class Reader: #Hands out a canned request the way a socket would, then end of stream.
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+    async def read(self, n):
+        chunk = self.data[self.pos:self.pos+n]
+        self.pos += len(chunk)
+        return chunk
+
+class Writer: #Keeps whatever gets sent to it.
+    def __init__(self):
+        self.sent = bytearray()
+        self.closed = False
+    def write(self, data):
+        self.sent += data
+    async def drain(self):
+        pass
+    def close(self):
+        self.closed = True
+    async def wait_closed(self):
+        pass
+    def get_extra_info(self, name):
+        return ("127.0.0.1", 0)
+
+class Socket: #A connection the way uasyncio's streams see it: the writer's close() does nothing, and only wait_closed() shuts the socket.
+    def __init__(self):
+        self.closed = False
+        self.event = asyncio.Event()
+
+class IdleReader: #A client that connected and is sending nothing. Reads wait until the socket's closed and then see the end of the stream.
+    def __init__(self, sock):
+        self.sock = sock
+    async def read(self, n):
+        await self.sock.event.wait()
+        return b""
+
+class MicroWriter(Writer):
+    def __init__(self, sock):
+        Writer.__init__(self)
+        self.sock = sock
+    def close(self):
+        pass
+    async def wait_closed(self):
+        self.sock.closed = True
+        self.sock.event.set()
+
+def serve(data): #Runs one connection through respond_request() and returns what went back to the client.
+    writer = Writer()
+    asyncio.run(httpd.respond_request(Reader(data), writer))
+    return bytes(writer.sent)
+
+class NotUTF8(unittest.TestCase):
+    def test_path(self):
+        reply = serve(b"GET /status\xff HTTP/1.1\r\nHost: x\r\n\r\n")
+        self.assertTrue(reply.startswith(b"HTTP/1.1 400 "), reply[:40])
+
+    def test_header(self):
+        reply = serve(b"GET /status HTTP/1.1\r\nAccept: \xc3(\r\n\r\n")
+        self.assertTrue(reply.startswith(b"HTTP/1.1 400 "), reply[:40])
+
+    def test_body(self):
+        reply = serve(b"POST /status HTTP/1.1\r\nContent-Length: 5\r\n\r\na=\xff\xfe1")
+        self.assertTrue(reply.startswith(b"HTTP/1.1 400 "), reply[:40])
+
+    def test_still_serves(self): #The same connection machinery still answers a good request.
+        reply = serve(b"GET /status HTTP/1.1\r\nHost: x\r\n\r\n")
+        self.assertTrue(reply.startswith(b"HTTP/1.1 200 "), reply[:40])
+
+class Query(unittest.TestCase):
+    def parse(self, data):
+        buf = bytearray(data)
+        return httpd.parse_query(buf, 0, len(buf))
+
+    def test_unquotes(self):
+        self.assertEqual(self.parse(b"shower=A%20b&x=1+2&k%3d=%C3%A9&plain=v"), [("shower", "A b"), ("x", "1 2"), ("k=", "\u00e9"), ("plain", "v")])
+
+    def test_bad_escapes(self):
+        for data in (b"a=%zz", b"a=%2", b"a=%", b"%g1=b"):
+            with self.assertRaises(httpd.RequestError):
+                self.parse(data)
+
+    def test_escaped_param(self): #Every byte of the shower's name escaped, as a form field or a careful client might send it.
+        name = "".join("%{:02X}".format(c) for c in main.SHOWER_NAMES[0].encode("UTF-8"))
+        reply = serve("GET /api/sessions?shower={} HTTP/1.1\r\nHost: x\r\n\r\n".format(name).encode("UTF-8"))
+        self.assertTrue(reply.startswith(b"HTTP/1.1 200 "), reply[:40])
+        reply = serve(b"GET /api/sessions?shower=%Z1 HTTP/1.1\r\nHost: x\r\n\r\n")
+        self.assertTrue(reply.startswith(b"HTTP/1.1 400 "), reply[:40])
+
+    def test_body_kept(self): #request["body"] is the body as sent, not what parse_query() left of it.
+        async def run():
+            buf = bytearray(httpd.REQ_BUFSIZE)
+            request, carry = await httpd.read_request(Reader(b"POST /x HTTP/1.1\r\nContent-Length: 7\r\n\r\na=b%20c"), buf, None, 5, 5)
+            return request
+        request = asyncio.run(run())
+        self.assertEqual(request["body"], "a=b%20c")
+        self.assertEqual(request["form"], [("a", "b c")])
+
+class Eviction(unittest.TestCase):
+    def setUp(self):
+        self.saved = list(httpd.open_connections)
+        del httpd.open_connections[:]
+
+    def tearDown(self):
+        httpd.open_connections[:] = self.saved
+
+    def test_idle_connection_is_closed(self):
+        sock = Socket()
+        async def run():
+            idle = asyncio.create_task(httpd.respond_request(IdleReader(sock), MicroWriter(sock)))
+            await asyncio.sleep(0) #Let it claim its place, first in line.
+            for i in range(httpd.MAX_CONNECTIONS - 1):
+                httpd.open_connections.append([Writer(), True]) #Busy, so they can't be evicted.
+            writer = Writer()
+            await httpd.respond_request(Reader(b"GET /status HTTP/1.1\r\nHost: x\r\n\r\n"), writer)
+            await asyncio.wait_for(idle, 1) #Would sit there until RECV_TIMEOUT if the socket hadn't really closed.
+            return bytes(writer.sent)
+        reply = asyncio.run(run())
+        self.assertTrue(sock.closed)
+        self.assertTrue(reply.startswith(b"HTTP/1.1 200 "), reply[:40])
+        self.assertEqual(len(httpd.open_connections), httpd.MAX_CONNECTIONS - 1)
+
+    def test_all_busy(self):
+        for i in range(httpd.MAX_CONNECTIONS):
+            httpd.open_connections.append([Writer(), True])
+        reply = serve(b"GET /status HTTP/1.1\r\nHost: x\r\n\r\n")
+        self.assertTrue(reply.startswith(b"HTTP/1.1 503 "), reply[:40])
+
+if __name__ == "__main__":
+    unittest.main()
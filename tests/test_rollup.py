@@ -0,0 +1,74 @@
+#rollup.py's tiers, against working out each point from every sample recorded.
+import random
+import unittest
+from rollup import Rollup
+
+TIERS = ((1, 40), (5, 16), (25, 8))
+SERIES = 2
+
+def brute(samples, s, lo, hi):
+    values = [sample[s] for sample in samples[lo:hi + 1]]
+    return min(values), max(values), sum(values)/len(values)
+
+class Merging(unittest.TestCase):
+    def setUp(self):
+        self.rollup = Rollup(TIERS, SERIES)
+        rng = random.Random(2)
+        self.samples = []
+        for i in range(613): #Round every ring at least once, ending partway through a bucket of each tier.
+            sample = (rng.randint(-3000, 3000), rng.randint(0, 500))
+            self.samples.append(sample)
+            self.rollup.record(sample)
+
+    def check(self, start, end, step, max_points = 100):
+        rollup = self.rollup
+        plan = rollup.plan(start, end, step, max_points)
+        self.assertIsNotNone(plan)
+        tier, first, step, points = plan
+        self.assertLessEqual(points, max_points)
+        self.assertEqual(step % tier.size, 0)
+        out = [0]*(3*SERIES)
+        for i in range(points):
+            at = first + i*step
+            lo = max(at, rollup.oldest(tier))
+            hi = min(at + step - 1, rollup.count - 1)
+            found = rollup.merge(tier, at, step, out)
+            self.assertEqual(found, lo <= hi, (start, end, at))
+            if not found:
+                continue
+            for s in range(SERIES):
+                low, high, mean = brute(self.samples, s, lo, hi)
+                self.assertEqual((out[3*s], out[3*s + 1]), (low, high), (start, end, at, s))
+                if hi < rollup.count//tier.size*tier.size: #All closed buckets, so the mean of their means is the mean (give or take rounding).
+                    self.assertLessEqual(abs(out[3*s + 2] - mean), 1)
+        return tier
+
+    def test_raw(self):
+        self.assertEqual(self.check(-30, -1, 1).size, 1)
+
+    def test_coarser(self):
+        self.assertEqual(self.check(-60, -1, 5).size, 5)
+        self.assertEqual(self.check(-150, -1, 25).size, 25)
+
+    def test_odd_step(self): #Rounded up to whole buckets.
+        self.assertEqual(self.check(-70, -1, 7).size, 5)
+
+    def test_too_old(self): #Past what the fine tiers keep: answered from one that still has it.
+        self.assertEqual(self.check(0, -1, 1).size, 25)
+        self.assertEqual(self.check(-80, -1, 1).size, 5)
+
+    def test_max_points(self):
+        self.check(-150, -1, 1, 7)
+
+    def test_empty(self):
+        self.assertIsNone(Rollup(TIERS, SERIES).plan(0, -1, 1, 10))
+        out = [0]*(3*SERIES)
+        rollup = Rollup(TIERS, SERIES)
+        rollup.record((1, 2))
+        self.assertTrue(rollup.merge(rollup.tiers[2], 0, 25, out))
+        self.assertEqual(out, [1, 1, 1, 2, 2, 2])
+        rollup.clear()
+        self.assertIsNone(rollup.plan(0, -1, 1, 10))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+#snapshot.py: what gets written comes back, and a damaged file is never loaded.
+import asyncio
+import os
+import tempfile
+import unittest
+import snapshot
+from history import zeros
+
+def parts(seed): #A typed array bigger than one CHUNK, plus a bytearray, so both item sizes and the chunking get exercised.
+    values = zeros('l', snapshot.CHUNK//2)
+    for i in range(len(values)):
+        values[i] = (i*seed) - 5000
+    raw = bytearray(range(seed, seed + 37))
+    return [values, raw]
+
+class Snapshots(unittest.TestCase):
+    def setUp(self):
+        self.scratch = tempfile.TemporaryDirectory()
+        self.paths = (os.path.join(self.scratch.name, "a.bin"), os.path.join(self.scratch.name, "b.bin"))
+
+    def tearDown(self):
+        self.scratch.cleanup()
+
+    def save(self, path, seq, data):
+        asyncio.run(snapshot.save(path, seq, data))
+
+    def test_round_trip(self):
+        saved = parts(3)
+        self.save(self.paths[0], 7, saved)
+        self.assertEqual(snapshot.check(self.paths[0]), (7, snapshot.size(saved)))
+        loaded = parts(1)
+        snapshot.load(self.paths[0], loaded)
+        self.assertEqual(list(loaded[0]), list(saved[0]))
+        self.assertEqual(loaded[1], saved[1])
+
+    def test_newest(self):
+        self.save(self.paths[0], 4, parts(3))
+        self.save(self.paths[1], 5, parts(4))
+        self.assertEqual(snapshot.newest(self.paths)[:2], (self.paths[1], 5))
+
+    def test_truncated(self): #The Pico reset partway through writing the newer file: the older one wins.
+        self.save(self.paths[0], 4, parts(3))
+        self.save(self.paths[1], 5, parts(4))
+        with open(self.paths[1], "rb") as f:
+            data = f.read()
+        with open(self.paths[1], "wb") as f:
+            f.write(data[:len(data) - 10])
+        self.assertIsNone(snapshot.check(self.paths[1]))
+        self.assertEqual(snapshot.newest(self.paths)[:2], (self.paths[0], 4))
+
+    def test_bad_crc(self):
+        self.save(self.paths[0], 4, parts(3))
+        with open(self.paths[0], "r+b") as f:
+            f.seek(snapshot.HEADER_SIZE + 100)
+            byte = f.read(1)
+            f.seek(snapshot.HEADER_SIZE + 100)
+            f.write(bytes([byte[0] ^ 1]))
+        self.assertIsNone(snapshot.check(self.paths[0]))
+        self.assertIsNone(snapshot.newest(self.paths))
+
+    def test_missing_and_empty(self):
+        self.assertIsNone(snapshot.check(self.paths[0]))
+        open(self.paths[1], "wb").close()
+        self.assertIsNone(snapshot.check(self.paths[1]))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+#What core 1 publishes for the pages, with readings that don't fit.
+import asyncio
+import json
+import os
+import struct
+import tempfile
+import threading
+import unittest
+import accounting
+import calibrate
+import snapshot
+import sim
+from sim import waveforms
+from tests import main, board
+
+class OffScaleReadings(unittest.TestCase):
+    def setUp(self):
+        self.tables = list(main.sensorCalibration.tables)
+        main.sensorCalibration.tables[main.TEMP_BASE] = calibrate.Table(calibrate.steinhart_hart(1.009e-3, 2.378e-4, 2.019e-7, 10000), 100)
+        board.wire(sim.TEMP_PINS[0], waveforms.constant(0)) #Shorted thermistor: about 1510 degrees through that table.
+
+    def tearDown(self):
+        main.sensorCalibration.tables[:] = self.tables
+        board.wire(sim.TEMP_PINS[0], waveforms.temperature(waveforms.constant(20)))
+        main.prime_sensors()
+
+    def test_shorted_thermistor_is_pinned(self):
+        main.prime_sensors() #Used to raise struct.error here, which boot-looped the board.
+        self.assertGreater(main.s_Temperature[0], main.STATE_LIMIT_HIGH)
+        state = main.coreState.read()
+        self.assertEqual(state[main.ST_TEMP], main.STATE_LIMIT_HIGH)
+        self.assertEqual(main.heaterOn[0], 0)
+
+    def test_hardware_loop_keeps_going(self):
+        main.prime_sensors()
+        for i in range(3):
+            for tick in range(main.HARDWARE_PERIOD_MS//main.SENSOR_TICK_MS):
+                main.sensorScheduler.tick()
+                board.advance(main.SENSOR_TICK_MS*1000)
+            main.picoHardwareLoop()
+        self.assertEqual(main.coreState.read()[main.ST_TEMP], main.STATE_LIMIT_HIGH)
+        self.assertEqual(json.loads(main.get_status())["temp1"], main.STATE_LIMIT_HIGH/100)
+
+    def test_status_bin_answers(self):
+        main.prime_sensors()
+        buf = main.status_bin()
+        temp, flow, flags = struct.unpack_from(main.STATUS_BIN_SHOWER, buf, main.STATUS_BIN_HEADER_SIZE)
+        self.assertEqual(temp, main.STATE_LIMIT_HIGH)
+
+    def test_negative_flow(self): #A calibration can dip a little below zero at no flow; "H" can't hold that.
+        saved = main.e_flowrate[0]
+        main.e_flowrate[0] = -5
+        try:
+            main.publish_state()
+            temp, flow, flags = struct.unpack_from(main.STATUS_BIN_SHOWER, main.status_bin(), main.STATUS_BIN_HEADER_SIZE)
+            self.assertEqual(flow, 0)
+        finally:
+            main.e_flowrate[0] = saved
+
+class HistoryLock(unittest.TestCase): #Core 0 copies the bar graph and usage with historyLock held; core 1 mustn't change them meanwhile.
+    def test_loop_waits_for_readers(self):
+        start = main.timestamp
+        main.historyLock.acquire()
+        try:
+            core1 = threading.Thread(target = main.picoHardwareLoop)
+            core1.start()
+            core1.join(0.2)
+            self.assertTrue(core1.is_alive())
+            self.assertEqual(main.timestamp, start)
+        finally:
+            main.historyLock.release()
+        core1.join(5)
+        self.assertFalse(core1.is_alive())
+        self.assertEqual(main.timestamp, (start + 1) % main.TOTAL_TIME)
+
+    def test_pages_let_go(self):
+        main.m_bargraph_version += 1
+        main.publish_state()
+        parts, length = main.web_page()
+        self.assertEqual(sum(len(part) for part in parts), length)
+        self.assertTrue(main.historyLock.acquire(0))
+        main.historyLock.release()
+
+class Snapshots(unittest.TestCase): #save_state() writes over several awaits while core 1 carries on; what lands on flash has to be one moment.
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.scratch = tempfile.TemporaryDirectory()
+        os.chdir(self.scratch.name) #The snapshot files go in the working directory.
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.scratch.cleanup()
+
+    def test_usage_is_one_moment(self):
+        acc = main.m_accounting
+        before = list(acc.total_ml)
+        meta = list(acc.meta)
+        async def core1(): #Keeps logging water the whole time the save is going.
+            while main.snapshot_busy:
+                acc.total_ml[0] += 1
+                acc.meta[accounting.M_WRITTEN] += 1
+                await asyncio.sleep(0)
+        async def run():
+            main.snapshot_busy = True #So core1() doesn't stop before the save has even started.
+            task = asyncio.create_task(core1())
+            await main.save_state()
+            await task
+        try:
+            asyncio.run(run())
+            parts = [part[:] for part in acc.buffers()]
+            path, seq, length = snapshot.newest(main.USAGE_FILES)
+            snapshot.load(path, parts)
+            buffers = acc.buffers()
+            self.assertEqual(list(parts[[i for i in range(len(buffers)) if buffers[i] is acc.total_ml][0]]), before)
+            self.assertEqual(list(parts[[i for i in range(len(buffers)) if buffers[i] is acc.meta][0]]), meta)
+        finally:
+            for i in range(len(before)):
+                acc.total_ml[i] = before[i]
+            for i in range(len(meta)):
+                acc.meta[i] = meta[i]
+
+if __name__ == "__main__":
+    unittest.main()